@@ -0,0 +1,132 @@
+"""
+Пакетная отрисовка участков карты без GUI.
+
+Пример:
+    python batch_render.py maps/chernarus.png --settings last_settings.json --n-cells 5 --out regions
+    python batch_render.py maps/chernarus.png --cells cells.txt --workers 8
+
+Исходная карта не передаётся в процессы: каждый процесс открывает то же тайловое хранилище
+через memmap только для чтения, так что страницы карты общие для всех процессов через кэш ОС.
+"""
+import argparse
+import json
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from map_processing import normalize_params, render_region
+from tile_store import TileStore
+
+# Состояние процесса-исполнителя, заполняется в _init_worker
+_worker = {}
+
+
+def _init_worker(store_dir, params, db_path, out_dir, fmt):
+    _worker["store"] = TileStore(store_dir)
+    _worker["params"] = params
+    _worker["db_path"] = db_path
+    _worker["out_dir"] = out_dir
+    _worker["fmt"] = fmt
+
+
+def _render_cell(cell):
+    image, _ = render_region(_worker["store"], _worker["params"], _worker["db_path"], cell)
+    fmt = _worker["fmt"]
+    path = os.path.join(_worker["out_dir"], f"region_{cell[0]:03d}_{cell[1]:03d}.{fmt}")
+    if fmt == "jpg":
+        image.convert("RGB").save(path, format="JPEG", quality=90)
+    else:
+        image.save(path, format=fmt.upper())
+    return cell, path
+
+
+def all_cells(params, map_size, step=1):
+    """Все центральные ячейки сетки в выходном разрешении с заданным шагом."""
+    output_resolution = params.get("output_resolution") or map_size
+    interval = params["pixels_per_100m"] * output_resolution[0] / map_size[0]
+    total_cols = math.ceil(output_resolution[0] / interval)
+    total_rows = math.ceil(output_resolution[1] / interval)
+    return [(col, row) for row in range(0, total_rows, step) for col in range(0, total_cols, step)]
+
+
+def read_cells(file_path):
+    """Читает список ячеек: по одной паре "col,row" (или "col row") на строку, # – комментарий."""
+    cells = []
+    with open(file_path, encoding="utf-8") as f:
+        for line in f:
+            line = line.split("#", 1)[0].strip()
+            if not line:
+                continue
+            col, row = line.replace(",", " ").split()[:2]
+            cells.append((int(col), int(row)))
+    return cells
+
+
+def render_batch(map_path, params, cells, out_dir, db_path=os.path.join("db", "name.db"),
+                 workers=None, fmt="png", log_func=None):
+    """
+    Рисует участки для всех ячеек cells и сохраняет их в out_dir.
+    Возвращает список (ячейка, путь к файлу) в порядке завершения.
+    """
+    params = normalize_params(params)
+    store = TileStore.open_map(map_path, log_func=log_func)
+    if not params.get("output_resolution"):
+        params["output_resolution"] = store.size
+    os.makedirs(out_dir, exist_ok=True)
+    init_args = (store.store_dir, params, db_path, out_dir, fmt)
+
+    results = []
+    start = time.perf_counter()
+    # Ошибка в одной ячейке не прерывает пакет ни в одном из режимов
+    if workers == 1:
+        _init_worker(*init_args)
+        for cell in cells:
+            try:
+                results.append(_render_cell(cell))
+            except Exception as e:
+                if log_func:
+                    log_func(f"Ошибка отрисовки участка {cell}: {e}")
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=init_args) as pool:
+            futures = {pool.submit(_render_cell, cell): cell for cell in cells}
+            for future in as_completed(futures):
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    if log_func:
+                        log_func(f"Ошибка отрисовки участка {futures[future]}: {e}")
+    if log_func:
+        elapsed = time.perf_counter() - start
+        log_func(f"Отрисовано участков: {len(results)} из {len(cells)} за {elapsed:.1f} с -> {out_dir}")
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Пакетная отрисовка участков карты с сеткой и названиями")
+    parser.add_argument("map", help="исходная карта (PNG)")
+    parser.add_argument("--settings", default="last_settings.json", help="файл настроек в формате MapSettingsTab")
+    parser.add_argument("--db", default=os.path.join("db", "name.db"), help="база названий")
+    parser.add_argument("--out", default="regions", help="каталог для результатов")
+    parser.add_argument("--n-cells", type=int, help="размер участка (ячеек в сторону), по умолчанию из настроек")
+    parser.add_argument("--cells", help="файл со списком ячеек; по умолчанию – все ячейки карты")
+    parser.add_argument("--step", type=int, default=1, help="шаг перебора ячеек при отрисовке всей карты")
+    parser.add_argument("--workers", type=int, default=None, help="число процессов (по умолчанию – по числу ядер)")
+    parser.add_argument("--format", choices=["png", "webp", "jpg"], default="png")
+    args = parser.parse_args(argv)
+
+    with open(args.settings, encoding="utf-8") as f:
+        params = json.load(f)
+    if args.n_cells is not None:
+        params["n_cells"] = args.n_cells
+
+    if args.cells:
+        cells = read_cells(args.cells)
+    else:
+        store = TileStore.open_map(args.map, log_func=print)
+        cells = all_cells(params, store.size, args.step)
+    render_batch(args.map, params, cells, args.out, args.db, args.workers, args.format, log_func=print)
+
+
+if __name__ == "__main__":
+    main()
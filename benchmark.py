@@ -0,0 +1,277 @@
+"""
+Бенчмарк конвейера подготовки карт без GUI.
+
+Пример:
+    python benchmark.py --sizes 2048 4096 --names 1000 10000 --out bench.json
+    python benchmark.py --sizes 8192 --names 100000 --baseline bench_base.json
+    python benchmark.py --save-baseline bench_base.json
+
+Карты и базы названий синтезируются в рабочем каталоге и переиспользуются между запусками.
+Каждый набор (размер карты, число названий) измеряется в отдельном процессе,
+поэтому пиковая память (RSS) относится только к нему. Qt и системные шрифты не нужны.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import sqlite3
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+import numpy as np
+from PIL import Image
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+WORK_DIR = os.path.join("cache", "bench")
+NAME_TYPES = ("NameCityCapital", "NameCity", "NameVillage", "Hill", "NameLocal", "NameMarine")
+
+
+def peak_rss_mb():
+    """Пиковый RSS процесса в МБ или None, если платформа его не сообщает."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux сообщает килобайты, macOS – байты
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def synth_map(path, size, seed=0):
+    """Синтетическая карта size x size: плавный рельеф с шумом, похожий по сжатию на настоящую."""
+    rng = np.random.default_rng(seed)
+    coarse = rng.integers(0, 256, (max(2, size // 256), max(2, size // 256), 3), dtype=np.uint8)
+    base = Image.fromarray(coarse, "RGB").resize((size, size), resample=Image.BILINEAR)
+    # Шум добавляется полосами, чтобы не держать в памяти второй полный массив
+    out = Image.new("RGB", (size, size))
+    strip = 1024
+    for top in range(0, size, strip):
+        h = min(strip, size - top)
+        arr = np.asarray(base.crop((0, top, size, top + h)), dtype=np.int16)
+        arr = arr + rng.integers(-12, 13, arr.shape, dtype=np.int16)
+        out.paste(Image.fromarray(np.clip(arr, 0, 255).astype(np.uint8), "RGB"), (0, top))
+    out.save(path, format="PNG", compress_level=1)
+
+
+def synth_names_db(db_path, count, world_size, seed=0):
+    """База названий с count случайными записями в пределах карты world_size x world_size метров."""
+    from db_handler import create_db
+
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    create_db(db_path)
+    rng = random.Random(seed)
+    rows = [
+        (f"Пункт {i}", rng.choice(NAME_TYPES), rng.uniform(0, world_size), rng.uniform(0, world_size))
+        for i in range(count)
+    ]
+    conn = sqlite3.connect(db_path)
+    conn.executemany("INSERT INTO names (name, type, x, y) VALUES (?, ?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+
+
+def bench_params(map_size, output_size, n_cells):
+    """Настройки как у MapSettingsTab.get_parameters(), но без путей к шрифтам Windows."""
+    name_settings = {
+        name_type: {"font_size": 25, "font_color": (56, 56, 56, 255), "font": None}
+        for name_type in NAME_TYPES
+    }
+    # Синтетическая карта – 1 пиксель на метр
+    cols = math.ceil(map_size / 100)
+    return {
+        "output_resolution": (output_size, output_size),
+        "pixels_per_100m": 100,
+        "grid_thickness_100": 1,
+        "grid_thickness_1km": 3,
+        "margin": 10,
+        "color_100": (98, 98, 98, 130),
+        "color_1km": (42, 42, 42, 130),
+        "font_size": 20,
+        "font_color": (0, 0, 0, 255),
+        "font_path": None,
+        "origin": "bottom-left",
+        "center_col": cols // 2,
+        "center_row": cols // 2,
+        "n_cells": n_cells,
+        "name_settings": name_settings,
+    }
+
+
+def _timed(results, stage, repeat, func):
+    """Минимальное время из repeat запусков; результат последнего запуска возвращается."""
+    best = None
+    value = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        value = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    # Пиковый RSS общий для процесса и стадий не различает: он сообщается один раз на набор
+    results[stage] = {"seconds": round(best, 4)}
+    return value
+
+
+def run_case(map_path, db_path, map_size, output_size, n_cells, repeat, work_dir):
+    """Измеряет все стадии для одной пары (карта, база). Запускается в отдельном процессе."""
+    from map_processing import (
+        draw_grid, draw_grid_region, draw_names, extract_region, region_geometry, render_region,
+        render_region_multiscale, resize_image
+    )
+    from db_handler import get_names
+    from region_cache import RegionCache, render_region_cached
+    from render_pipeline import RenderPipeline
+    from resize_cache import resized_maps
+    from tile_store import TileStore
+
+    params = bench_params(map_size, output_size, n_cells)
+    scale = output_size / map_size
+    interval = params["pixels_per_100m"] * scale
+    center = (params["center_col"], params["center_row"])
+    stages = {}
+
+    store = _timed(stages, "tile_store_open", 1,
+                   lambda: TileStore.open_map(map_path, root=os.path.join(work_dir, "tiles")))
+    full = Image.open(map_path).convert("RGBA")
+    resized = _timed(stages, "resize_image", repeat, lambda: resize_image(full, params["output_resolution"]))
+    full = None
+    _timed(stages, "resize_pyramid", repeat, lambda: resize_image(store, params["output_resolution"]))
+
+    grid_args = (interval, 1, 3, params["color_100"], params["color_1km"], "0", "0",
+                 params["font_size"], None, params["font_color"], params["margin"], params["origin"])
+    with_grid = _timed(stages, "draw_grid", repeat, lambda: draw_grid(resized.copy(), *grid_args))
+    _timed(stages, "get_names", repeat, lambda: get_names(db_path))
+    _timed(stages, "draw_names", repeat, lambda: draw_names(
+        with_grid.copy(), db_path, params["name_settings"], params["origin"], scale=scale))
+    with_grid = None
+
+    _, _, _, _, crop_box = region_geometry(resized.size, center, n_cells, interval, params["origin"])
+    region = resized.crop(crop_box)
+    _timed(stages, "draw_grid_region", repeat, lambda: draw_grid_region(region.copy(), *grid_args))
+    _timed(stages, "extract_region", repeat, lambda: extract_region(store, center, n_cells,
+                                                                     params["pixels_per_100m"], params["origin"]))
+    resized = region = None
+
+    # Сквозные сценарии GUI: apply_grid (холодный, повторный и со сменой настроек сетки
+    # при уже уменьшенной карте) и extract_region (без кэша и из кэша)
+    resized_maps.cache_dir = os.path.join(work_dir, "resized")
+    resized_maps.clear(disk=True)
+    pipeline = RenderPipeline(db_path)
+    _timed(stages, "apply_grid_cold", 1, lambda: pipeline.render(store, params))
+    _timed(stages, "apply_grid_warm", repeat, lambda: pipeline.render(store, params))
+    pipeline.clear()
+    _timed(stages, "apply_grid_resized_cached", 1, lambda: pipeline.render(store, params))
+    pipeline.clear()
+    _timed(stages, "extract_region_flow", repeat, lambda: render_region(store, params, db_path, center, n_cells))
+    # Обзор и детальный вид одного места за один вызов
+    _timed(stages, "extract_region_multiscale", repeat, lambda: render_region_multiscale(
+        store, params, db_path, center, [(n_cells * 2, 768), (n_cells, 1024)]))
+    cache = RegionCache(os.path.join(work_dir, "regions"))
+    cache.clear()
+    render_region_cached(cache, store, store.map_hash, params, db_path, center, n_cells)
+    _timed(stages, "extract_region_cached", repeat, lambda: render_region_cached(
+        cache, store, store.map_hash, params, db_path, center, n_cells))
+    return {"peak_rss_mb": peak_rss_mb(), "stages": stages}
+
+
+def run_benchmark(sizes, name_counts, output_scale=1.0, n_cells=5, repeat=3, work_dir=WORK_DIR,
+                  baseline=None, log_func=print):
+    """
+    Прогоняет все сочетания размеров карт и баз названий.
+    Возвращает {"<карта>-><выход>px/<названий>names": {"peak_rss_mb": ..., "stages": {стадия: {...}}}}.
+    """
+    os.makedirs(work_dir, exist_ok=True)
+    results = {}
+    for size in sizes:
+        map_path = os.path.join(work_dir, f"map_{size}.png")
+        if not os.path.exists(map_path):
+            log_func(f"Синтез карты {size}x{size}...")
+            synth_map(map_path, size)
+        for count in name_counts:
+            db_path = os.path.join(work_dir, f"names_{size}_{count}.db")
+            if not os.path.exists(db_path):
+                log_func(f"Синтез базы на {count} названий...")
+                synth_names_db(db_path, count, size)
+            output_size = max(1, round(size * output_scale))
+            case = f"{size}->{output_size}px/{count}names"
+            # Отдельный процесс на каждый набор: пиковая память не накапливается между ними
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+                results[case] = pool.submit(
+                    run_case, map_path, db_path, size, output_size, n_cells, repeat, work_dir
+                ).result()
+            log_func(format_case(case, results[case], (baseline or {}).get(case)))
+    return results
+
+
+def format_case(case, result, baseline=None):
+    lines = [f"{case}: пик RSS {result['peak_rss_mb']} МБ"]
+    for stage, value in result["stages"].items():
+        line = f"  {stage:<28}{value['seconds']:>10.4f} с"
+        base = (baseline or {}).get("stages", {}).get(stage)
+        if base and base["seconds"] > 0:
+            line += f"   x{value['seconds'] / base['seconds']:.2f} к базовому"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def compare(results, baseline, threshold=1.2, min_seconds=0.005):
+    """
+    Сравнивает результаты с базовыми. Возвращает список регрессий
+    (набор, стадия, было, стало) – стадий, замедлившихся больше чем в threshold раз.
+    Стадии быстрее min_seconds не сравниваются: их время – в основном шум.
+    """
+    regressions = []
+    for case, result in results.items():
+        base_case = baseline.get(case)
+        if not base_case:
+            continue
+        for stage, value in result["stages"].items():
+            base = base_case["stages"].get(stage)
+            if not base or max(base["seconds"], value["seconds"]) < min_seconds:
+                continue
+            if value["seconds"] > base["seconds"] * threshold:
+                regressions.append((case, stage, base["seconds"], value["seconds"]))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк стадий отрисовки карты")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[2048, 4096], help="стороны синтетических карт")
+    parser.add_argument("--names", type=int, nargs="+", default=[1000, 10000], help="числа названий в базах")
+    parser.add_argument("--output-scale", type=float, default=1.0, help="выходное разрешение относительно карты")
+    parser.add_argument("--n-cells", type=int, default=5, help="размер участка для extract_region")
+    parser.add_argument("--repeat", type=int, default=3, help="повторов на стадию (берётся минимум)")
+    parser.add_argument("--work-dir", default=WORK_DIR, help="каталог для синтетических данных")
+    parser.add_argument("--out", help="сохранить результаты в JSON")
+    parser.add_argument("--baseline", help="JSON с базовыми результатами для сравнения")
+    parser.add_argument("--save-baseline", help="сохранить результаты как базовые")
+    parser.add_argument("--threshold", type=float, default=1.2, help="во сколько раз замедление считается регрессией")
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    results = run_benchmark(args.sizes, args.names, args.output_scale, args.n_cells, args.repeat, args.work_dir,
+                            baseline)
+    for path in (args.out, args.save_baseline):
+        if path:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(results, f, ensure_ascii=False, indent=2)
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold)
+        for case, stage, before, after in regressions:
+            print(f"РЕГРЕССИЯ {case} {stage}: {before:.4f} с -> {after:.4f} с")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,88 @@
+"""
+Преобразования координат карты над массивами NumPy.
+
+Мировые координаты – метры от начала координат карты, пиксели – выходной карты
+размера (width, height) с масштабом scale пикселей на метр. offset – левый верхний угол
+участка в пикселях карты: с ним получаются координаты внутри участка.
+Нумерация ячеек та же, что у draw_grid: от края, с которого идёт отсчёт для origin.
+Все функции принимают как скаляры, так и массивы и обрабатывают их за один проход.
+"""
+import numpy as np
+
+ORIGINS = ("top-left", "top-right", "bottom-left", "bottom-right")
+
+
+def _flips(origin):
+    """(отсчёт X справа, отсчёт Y снизу); неизвестное начало координат считается top-left."""
+    return origin in ("top-right", "bottom-right"), origin in ("bottom-left", "bottom-right")
+
+
+def world_to_pixel(world_x, world_y, size, origin, scale=1.0, offset=(0, 0)):
+    """Мировые координаты (м) -> пиксели карты или участка с левым верхним углом offset."""
+    flip_x, flip_y = _flips(origin)
+    px = np.asarray(world_x, dtype=np.float64) * scale
+    py = np.asarray(world_y, dtype=np.float64) * scale
+    if flip_x:
+        px = size[0] - px
+    if flip_y:
+        py = size[1] - py
+    if offset[0]:
+        px = px - offset[0]
+    if offset[1]:
+        py = py - offset[1]
+    return px, py
+
+
+def pixel_to_world(pixel_x, pixel_y, size, origin, scale=1.0, offset=(0, 0)):
+    """Обратное к world_to_pixel: пиксели карты или участка -> мировые координаты (м)."""
+    flip_x, flip_y = _flips(origin)
+    px = np.asarray(pixel_x, dtype=np.float64) + offset[0]
+    py = np.asarray(pixel_y, dtype=np.float64) + offset[1]
+    if flip_x:
+        px = size[0] - px
+    if flip_y:
+        py = size[1] - py
+    return px / scale, py / scale
+
+
+def pixel_to_cell(pixel_x, pixel_y, size, origin, interval, offset=(0, 0)):
+    """Пиксели -> (столбец, строка) ячейки сетки с шагом interval пикселей, целые массивы."""
+    flip_x, flip_y = _flips(origin)
+    px = np.asarray(pixel_x, dtype=np.float64) + offset[0]
+    py = np.asarray(pixel_y, dtype=np.float64) + offset[1]
+    if flip_x:
+        px = size[0] - px
+    if flip_y:
+        py = size[1] - py
+    return np.floor(px / interval).astype(np.int64), np.floor(py / interval).astype(np.int64)
+
+
+def world_to_cell(world_x, world_y, size, origin, scale, interval):
+    """Мировые координаты (м) -> (столбец, строка) ячейки сетки карты."""
+    px, py = world_to_pixel(world_x, world_y, size, origin, scale)
+    return pixel_to_cell(px, py, size, origin, interval)
+
+
+def cells_to_box(start_col, start_row, end_col, end_row, size, origin, interval):
+    """
+    Прямоугольник (left, top, right, bottom) в пикселях карты, покрывающий ячейки
+    от (start_col, start_row) до (end_col, end_row) включительно, обрезанный по карте.
+    """
+    flip_x, flip_y = _flips(origin)
+    width, height = size
+    if flip_x:
+        left, right = width - (end_col + 1) * interval, width - start_col * interval
+    else:
+        left, right = start_col * interval, (end_col + 1) * interval
+    if flip_y:
+        top, bottom = height - (end_row + 1) * interval, height - start_row * interval
+    else:
+        top, bottom = start_row * interval, (end_row + 1) * interval
+    return (max(0, min(left, width)), max(0, min(top, height)),
+            max(0, min(right, width)), max(0, min(bottom, height)))
+
+
+def box_to_world(box, size, origin, scale=1.0):
+    """Прямоугольник в пикселях (left, top, right, bottom) -> (xmin, ymin, xmax, ymax) в метрах."""
+    xs, ys = pixel_to_world((box[0], box[2]), (box[1], box[3]), size, origin, scale)
+    return float(xs.min()), float(ys.min()), float(xs.max()), float(ys.max())
@@ -1,5 +1,9 @@
+import hashlib
 import sqlite3
 import os
+import threading
+
+from profiler import profiled
 
 DB_SCHEMA = """
 CREATE TABLE IF NOT EXISTS names (
@@ -9,71 +13,217 @@ CREATE TABLE IF NOT EXISTS names (
     x REAL,
     y REAL
 );
+CREATE TABLE IF NOT EXISTS db_meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER
+);
+"""
+
+# Пространственный индекс по названиям: R*Tree, синхронизируемый с names триггерами
+SPATIAL_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS names_rtree USING rtree(id, xmin, xmax, ymin, ymax);
+CREATE TRIGGER IF NOT EXISTS names_rtree_insert AFTER INSERT ON names
+WHEN new.x IS NOT NULL AND new.y IS NOT NULL BEGIN
+    INSERT OR REPLACE INTO names_rtree VALUES (new.id, new.x, new.x, new.y, new.y);
+END;
+CREATE TRIGGER IF NOT EXISTS names_rtree_update AFTER UPDATE OF x, y ON names
+WHEN new.x IS NOT NULL AND new.y IS NOT NULL BEGIN
+    INSERT OR REPLACE INTO names_rtree VALUES (new.id, new.x, new.x, new.y, new.y);
+END;
+CREATE TRIGGER IF NOT EXISTS names_rtree_delete AFTER DELETE ON names BEGIN
+    DELETE FROM names_rtree WHERE id = old.id;
+END;
 """
 
+# Базы, на которых SQLite без модуля R*Tree уже отказал в создании индекса
+_spatial_ready = {}
+
+def ensure_spatial_index(conn, db_path, log_func=None):
+    """
+    Создаёт R*Tree-индекс и заполняет его существующими записями, если его ещё нет.
+    Возвращает False, если SQLite собран без модуля rtree.
+    Наличие таблицы проверяется при каждом вызове (один запрос к sqlite_master): файл базы
+    могут удалить и создать заново, и запомненный результат указывал бы на несуществующий индекс.
+    """
+    key = os.path.abspath(db_path)
+    if _spatial_ready.get(key) is False:
+        return False
+    try:
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'names_rtree'").fetchone()
+        if not exists:
+            conn.executescript(SPATIAL_SCHEMA)
+            conn.execute(
+                "INSERT OR REPLACE INTO names_rtree SELECT id, x, x, y, y FROM names "
+                "WHERE x IS NOT NULL AND y IS NOT NULL"
+            )
+            conn.commit()
+            if log_func:
+                log_func(f"Создан пространственный индекс названий: {db_path}")
+        _spatial_ready[key] = True
+    except sqlite3.OperationalError as e:
+        if log_func:
+            log_func(f"R*Tree недоступен, поиск по области без индекса: {e}")
+        _spatial_ready[key] = False
+    return _spatial_ready[key]
+
+def bump_db_revision(cur):
+    """Увеличивает номер ревизии базы; вызывается в той же транзакции, что и изменение names."""
+    cur.execute("CREATE TABLE IF NOT EXISTS db_meta (key TEXT PRIMARY KEY, value INTEGER)")
+    cur.execute(
+        "INSERT INTO db_meta (key, value) VALUES ('revision', 1) "
+        "ON CONFLICT(key) DO UPDATE SET value = value + 1"
+    )
+
+def get_db_revision(db_path):
+    """
+    Номер ревизии таблицы names. Меняется при каждой записи через функции этого модуля,
+    используется кэшами отрисованных участков для проверки актуальности.
+    """
+    if not os.path.exists(db_path):
+        return 0
+    conn = sqlite3.connect(db_path)
+    try:
+        row = conn.execute("SELECT value FROM db_meta WHERE key = 'revision'").fetchone()
+    except sqlite3.OperationalError:
+        row = None
+    finally:
+        conn.close()
+    return row[0] if row else 0
+
 def create_db(db_path, log_func=None):
     conn = sqlite3.connect(db_path)
     cur = conn.cursor()
-    cur.execute(DB_SCHEMA)
+    cur.executescript(DB_SCHEMA)
     conn.commit()
+    ensure_natural_key(conn, log_func)
+    ensure_spatial_index(conn, db_path, log_func)
     conn.close()
     if log_func:
         log_func(f"База создана или уже существует: {db_path}")
 
-def parse_names_file(file_path, db_path, log_func=None):
+def ensure_natural_key(conn, log_func=None):
+    """
+    Уникальный индекс по (name, type, x, y), чтобы повторный импорт не плодил дубликаты.
+    Дубликаты, накопленные до появления индекса, удаляются (остаётся запись с меньшим id).
+    """
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'names_natural_key'").fetchone()
+    if exists:
+        return
+    cur = conn.cursor()
+    cur.execute("DELETE FROM names WHERE id NOT IN (SELECT MIN(id) FROM names GROUP BY name, type, x, y)")
+    removed = cur.rowcount
+    cur.execute("CREATE UNIQUE INDEX names_natural_key ON names (name, type, x, y)")
+    if removed:
+        bump_db_revision(cur)
+    conn.commit()
+    if log_func and removed:
+        log_func(f"Удалено дубликатов названий: {removed}")
+
+def parse_name_line(line):
+    """
+    Разбирает строку name.txt вида
+      1:05:07 "Локация: Черногорск | Тип: NameCityCapital | Позиция: [6731.21,2554.13]"
+    Возвращает (name, type, x, y) или None, если в строке нет записи. При ошибке формата – исключение.
+    """
+    # Находим содержимое внутри кавычек
+    first_quote = line.find('"')
+    last_quote = line.rfind('"')
+    if first_quote == -1 or last_quote == -1 or first_quote == last_quote:
+        return None
+    content = line[first_quote+1:last_quote]
+    # Разбиваем по разделителю " | "
+    parts = [p.strip() for p in content.split("|")]
+    # Ожидаемый формат:
+    # "Локация: Черногорск", "Тип: NameCityCapital", "Позиция: [6731.21,2554.13]"
+    name = parts[0].split(":", 1)[1].strip()
+    type_val = parts[1].split(":", 1)[1].strip()
+    pos_str = parts[2].split(":", 1)[1].strip()  # "[6731.21,2554.13]"
+    pos_str = pos_str.strip("[]")
+    coords = pos_str.split(',')
+    # Согласно инструкции: первая координата – X, вторая – Y
+    x = round(float(coords[0].strip()))
+    y = round(float(coords[1].strip()))
+    return name, type_val, x, y
+
+def parse_names_file(file_path, db_path, log_func=None, force=False):
     """
     Читает файл name.txt, где каждая строка имеет формат:
       1:05:07 "Локация: Черногорск | Тип: NameCityCapital | Позиция: [6731.21,2554.13]"
     и вставляет данные в базу данных.
     Координаты округляются до целого числа.
     Временная метка отброшена.
+    Импорт идемпотентный: записи вставляются одной транзакцией через executemany, уже существующие
+    (по name, type, x, y) пропускаются, а если файл не менялся с прошлого импорта
+    (размер, время изменения или SHA-1), работа не выполняется вовсе. force=True – импортировать заново.
     """
     if not os.path.exists(file_path):
         if log_func:
             log_func(f"Файл с именами {file_path} не найден.")
         return
 
-    create_db(db_path, log_func)
+    create_db(db_path)
 
     conn = sqlite3.connect(db_path)
     cur = conn.cursor()
+    cur.execute(
+        "CREATE TABLE IF NOT EXISTS imports (file_path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, sha1 TEXT)")
+    st = os.stat(file_path)
+    key = os.path.abspath(file_path)
+    prev = cur.execute("SELECT size, mtime_ns, sha1 FROM imports WHERE file_path = ?", (key,)).fetchone()
+    if not force and prev and prev[0] == st.st_size and prev[1] == st.st_mtime_ns:
+        conn.close()
+        return
+    with open(file_path, "rb") as f:
+        file_hash = hashlib.sha1(f.read()).hexdigest()
+    if not force and prev and prev[2] == file_hash:
+        # Файл «тронули», но содержимое то же: запоминаем новое время и выходим
+        cur.execute("UPDATE imports SET size = ?, mtime_ns = ? WHERE file_path = ?", (st.st_size, st.st_mtime_ns, key))
+        conn.commit()
+        conn.close()
+        return
+
+    stats = {"lines": 0, "errors": 0}
+    first_error = []
 
-    with open(file_path, encoding="utf-8") as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-            try:
-                # Находим содержимое внутри кавычек
-                first_quote = line.find('"')
-                last_quote = line.rfind('"')
-                if first_quote == -1 or last_quote == -1 or first_quote == last_quote:
+    def records():
+        with open(file_path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
                     continue
-                content = line[first_quote+1:last_quote]
-                # Разбиваем по разделителю " | "
-                parts = [p.strip() for p in content.split("|")]
-                # Ожидаемый формат:
-                # "Локация: Черногорск", "Тип: NameCityCapital", "Позиция: [6731.21,2554.13]"
-                name = parts[0].split(":", 1)[1].strip()
-                type_val = parts[1].split(":", 1)[1].strip()
-                pos_str = parts[2].split(":", 1)[1].strip()  # "[6731.21,2554.13]"
-                pos_str = pos_str.strip("[]")
-                coords = pos_str.split(',')
-                # Согласно инструкции: первая координата – X, вторая – Y
-                x = round(float(coords[0].strip()))
-                y = round(float(coords[1].strip()))
-                cur.execute("INSERT INTO names (name, type, x, y) VALUES (?, ?, ?, ?)",
-                            (name, type_val, x, y))
-                if log_func:
-                    log_func(f"Добавлена запись: {name}, {type_val}, x={x}, y={y}")
-            except Exception as e:
-                if log_func:
-                    log_func(f"Ошибка при разборе строки: '{line}': {e}")
+                try:
+                    rec = parse_name_line(line)
+                except Exception as e:
+                    stats["errors"] += 1
+                    if not first_error:
+                        first_error.append(f"'{line}': {e}")
+                    continue
+                if rec is not None:
+                    stats["lines"] += 1
+                    yield rec
+
+    before = cur.execute("SELECT COUNT(*) FROM names").fetchone()[0]
+    cur.executemany("INSERT OR IGNORE INTO names (name, type, x, y) VALUES (?, ?, ?, ?)", records())
+    inserted = cur.execute("SELECT COUNT(*) FROM names").fetchone()[0] - before
+    if inserted:
+        bump_db_revision(cur)
+    cur.execute(
+        "INSERT OR REPLACE INTO imports (file_path, size, mtime_ns, sha1) VALUES (?, ?, ?, ?)",
+        (key, st.st_size, st.st_mtime_ns, file_hash)
+    )
     conn.commit()
     conn.close()
     if log_func:
-        log_func("Парсинг файла с именами завершен.")
+        if first_error:
+            log_func(f"Ошибок разбора: {stats['errors']}, первая: {first_error[0]}")
+        log_func(
+            f"Парсинг файла с именами завершен: записей {stats['lines']}, добавлено {inserted}, "
+            f"уже были в базе {stats['lines'] - inserted}"
+        )
 
+@profiled()
 def get_names(db_path, log_func=None):
     """
     Возвращает список записей из таблицы names в виде списка словарей.
@@ -89,12 +239,103 @@ def get_names(db_path, log_func=None):
     rows = cur.fetchall()
     conn.close()
     return [dict(row) for row in rows]
+
+@profiled()
+def get_names_in_bbox(db_path, xmin, ymin, xmax, ymax, log_func=None):
+    """
+    Возвращает записи names, чьи мировые координаты лежат в прямоугольнике [xmin, xmax] x [ymin, ymax].
+    Использует R*Tree-индекс, поэтому читаются только строки внутри области.
+    """
+    if not os.path.exists(db_path):
+        if log_func:
+            log_func(f"База {db_path} не найдена.")
+        return []
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    try:
+        if ensure_spatial_index(conn, db_path, log_func):
+            # R*Tree хранит float32 с округлением наружу, точную проверку делаем по самим координатам
+            rows = conn.execute(
+                "SELECT n.* FROM names_rtree r JOIN names n ON n.id = r.id "
+                "WHERE r.xmax >= ? AND r.xmin <= ? AND r.ymax >= ? AND r.ymin <= ? "
+                "AND n.x BETWEEN ? AND ? AND n.y BETWEEN ? AND ?",
+                (xmin, xmax, ymin, ymax, xmin, xmax, ymin, ymax)
+            ).fetchall()
+        else:
+            rows = conn.execute(
+                "SELECT * FROM names WHERE x BETWEEN ? AND ? AND y BETWEEN ? AND ?",
+                (xmin, xmax, ymin, ymax)
+            ).fetchall()
+    finally:
+        conn.close()
+    return [dict(row) for row in rows]
     
+# Пул соединений для правок: одно долгоживущее соединение на базу, запись под замком
+_write_pool = {}
+_write_pool_lock = threading.Lock()
+
+def _file_identity(db_path):
+    try:
+        st = os.stat(db_path)
+    except OSError:
+        return None
+    return st.st_dev, st.st_ino
+
+def _write_connection(db_path):
+    """
+    (соединение, замок) для правок базы. Соединение переоткрывается, если файл базы подменили
+    (удалили и создали заново): старое писало бы в уже удалённый файл, и правки терялись бы.
+    """
+    key = os.path.abspath(db_path)
+    identity = _file_identity(db_path)
+    with _write_pool_lock:
+        entry = _write_pool.get(key)
+        if entry is not None and entry[2] != identity:
+            old_conn, old_lock, _ = entry
+            with old_lock:  # дожидаемся правки, идущей на старом соединении
+                old_conn.close()
+            entry = None
+        if entry is None:
+            conn = sqlite3.connect(db_path, check_same_thread=False)
+            entry = (conn, threading.Lock(), _file_identity(db_path))
+            _write_pool[key] = entry
+    return entry[:2]
+
+def update_name_positions(db_path, updates, log_func=None):
+    """
+    Пакетно обновляет позиции: updates – итерируемое (id, x, y).
+    Все изменения применяются одним executemany в одной транзакции на соединении из пула.
+    Возвращает множество id, у которых позиция действительно изменилась.
+    """
+    updates = {int(rec_id): (float(x), float(y)) for rec_id, x, y in updates}
+    if not updates:
+        return set()
+    conn, lock = _write_connection(db_path)
+    with lock:
+        try:
+            current = {}
+            ids = list(updates)
+            for i in range(0, len(ids), 500):
+                chunk = ids[i:i + 500]
+                rows = conn.execute(
+                    f"SELECT id, x, y FROM names WHERE id IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                current.update((rec_id, (x, y)) for rec_id, x, y in rows)
+            changed = [(x, y, rec_id) for rec_id, (x, y) in updates.items()
+                       if rec_id in current and current[rec_id] != (x, y)]
+            if changed:
+                cur = conn.cursor()
+                cur.executemany("UPDATE names SET x = ?, y = ? WHERE id = ?", changed)
+                bump_db_revision(cur)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    if log_func:
+        log_func(f"Обновлены позиции названий: {len(changed)} из {len(updates)}")
+    return {rec_id for _, _, rec_id in changed}
+
 def update_name_position(db_path, rec_id, x, y, log_func=None):
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    cursor.execute("UPDATE names SET x = ?, y = ? WHERE id = ?", (x, y, rec_id))
-    conn.commit()
-    conn.close()
+    update_name_positions(db_path, [(rec_id, x, y)])
     if log_func:
         log_func(f"Обновлена позиция для id={rec_id}: x={x}, y={y}")
@@ -0,0 +1,128 @@
+import os
+import struct
+import zlib
+
+import numpy as np
+
+from profiler import profiled
+
+STRIP_HEIGHT = 256
+IDAT_SIZE = 1024 * 1024
+
+# Форматы сохранения: расширение -> описание для диалога
+FORMATS = {
+    "png": "PNG",
+    "webp": "WebP без потерь",
+    "jpg": "JPEG (для LLM)",
+}
+
+
+def format_for_path(file_path, default="png"):
+    ext = os.path.splitext(file_path)[1].lower().lstrip(".")
+    if ext == "jpeg":
+        ext = "jpg"
+    return ext if ext in FORMATS else default
+
+
+def iter_strips(source, strip_height=STRIP_HEIGHT):
+    """
+    Полосы RGBA (h, w, 4) uint8 сверху вниз. source – PIL.Image или TileStore:
+    в памяти одновременно только одна полоса, полный кадр не копируется.
+    """
+    width, height = source.size
+    for top in range(0, height, strip_height):
+        bottom = min(height, top + strip_height)
+        if hasattr(source, "read_region"):
+            strip = source.read_region((0, top, width, bottom))
+        else:
+            strip = source.crop((0, top, width, bottom))
+            if strip.mode != "RGBA":
+                strip = strip.convert("RGBA")
+        yield top, np.asarray(strip)
+
+
+def _chunk(tag, data):
+    return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xffffffff)
+
+
+@profiled()
+def write_png(source, file_path, level=1, dpi=None, strip_height=STRIP_HEIGHT, progress=None):
+    """
+    Потоковый PNG-кодировщик: строки фильтруются (Up) и сжимаются zlib полосами,
+    IDAT пишутся по мере готовности. level – уровень zlib 0..9 (1 – быстро, 9 – компактно).
+    progress(доля) вызывается после каждой полосы и может прервать запись исключением.
+    """
+    width, height = source.size
+    tmp_path = file_path + ".tmp"
+    compressor = zlib.compressobj(level)
+    prev_row = np.zeros((width * 4,), dtype=np.uint8)
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(b"\x89PNG\r\n\x1a\n")
+            f.write(_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)))
+            if dpi:
+                # pHYs хранит пиксели на метр
+                ppm = [int(round(v / 0.0254)) for v in dpi[:2]]
+                f.write(_chunk(b"pHYs", struct.pack(">IIB", ppm[0], ppm[1], 1)))
+            pending = []
+            pending_size = 0
+            for top, strip in iter_strips(source, strip_height):
+                rows = strip.reshape(strip.shape[0], width * 4)
+                # Фильтр Up: разность с предыдущей строкой по модулю 256
+                filtered = np.empty((rows.shape[0], width * 4 + 1), dtype=np.uint8)
+                filtered[:, 0] = 2
+                np.subtract(rows[0], prev_row, out=filtered[0, 1:])
+                np.subtract(rows[1:], rows[:-1], out=filtered[1:, 1:])
+                prev_row = rows[-1].copy()
+                data = compressor.compress(filtered.tobytes())
+                if data:
+                    pending.append(data)
+                    pending_size += len(data)
+                if pending_size >= IDAT_SIZE:
+                    f.write(_chunk(b"IDAT", b"".join(pending)))
+                    pending, pending_size = [], 0
+                if progress:
+                    progress(min(1.0, (top + strip.shape[0]) / height))
+            pending.append(compressor.flush())
+            f.write(_chunk(b"IDAT", b"".join(pending)))
+            f.write(_chunk(b"IEND", b""))
+        os.replace(tmp_path, file_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return file_path
+
+
+@profiled()
+def export_image(source, file_path, fmt=None, level=1, quality=90, dpi=None, progress=None, log_func=None):
+    """
+    Сохраняет карту или участок. fmt – "png", "webp" или "jpg" (по умолчанию по расширению).
+    PNG пишется полосами без копии кадра; WebP и JPEG кодирует PIL целиком
+    (libwebp не умеет писать по частям), для них level задаёт усилие сжатия WebP.
+    """
+    fmt = fmt or format_for_path(file_path)
+    if fmt == "png":
+        write_png(source, file_path, level=level, dpi=dpi, progress=progress)
+    else:
+        image = source.to_image() if hasattr(source, "to_image") else source
+        tmp_path = file_path + ".tmp"
+        try:
+            if fmt == "webp":
+                # Для lossless WebP quality задаёт усилие сжатия, а не качество;
+                # method выше 0 резко дорожает, поэтому включается только с уровня 4
+                level = min(9, max(0, level))
+                image.save(tmp_path, format="WEBP", lossless=True, method=min(6, max(0, level - 3)),
+                           quality=round(level * 100 / 9))
+            elif fmt == "jpg":
+                image.convert("RGB").save(tmp_path, format="JPEG", quality=quality, dpi=dpi or (72, 72))
+            else:
+                raise ValueError(f"Неизвестный формат: {fmt}")
+            os.replace(tmp_path, file_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        if progress:
+            progress(1.0)
+    if log_func:
+        log_func(f"Сохранено ({FORMATS[fmt]}): {file_path}, {os.path.getsize(file_path) / (1024 * 1024):.1f} МБ")
+    return file_path
@@ -1,7 +1,8 @@
 import sys
 import os
 from PyQt5.QtWidgets import QApplication, QMainWindow, QTabWidget, QGraphicsScene
-from widgets import MapSettingsTab, MapTab, LogTab, ZoomableGraphicsView
+from widgets import MapSettingsTab, MapTab, LogTab, ProfileTab, ZoomableGraphicsView
+from log_sink import LogSink
 
 
 class MainWindow(QMainWindow):
@@ -13,7 +14,10 @@ class MainWindow(QMainWindow):
         self.view = ZoomableGraphicsView(self.scene, self)
 
         self.log_tab = LogTab(self)
-        self.log_text_edit = self.log_tab.text_edit
+        # Сообщения копятся в буфере и выводятся в лог пачками; log_text_edit.append остаётся точкой входа
+        self.log_sink = LogSink(self.log_tab.text_edit, file_path=os.path.join("logs", "app.log"))
+        self.log_tab.set_sink(self.log_sink)
+        self.log_text_edit = self.log_sink
 
         self.map_settings_tab = MapSettingsTab(self)
         self.map_tab = MapTab(self, self.map_settings_tab)
@@ -22,6 +26,8 @@ class MainWindow(QMainWindow):
         self.tabs.addTab(self.map_settings_tab, "Настройки карты")
         self.tabs.addTab(self.map_tab, "Карта")
         self.tabs.addTab(self.log_tab, "Лог")
+        self.profile_tab = ProfileTab(self)
+        self.tabs.addTab(self.profile_tab, "Профиль")
 
         self.setCentralWidget(self.tabs)
 
@@ -0,0 +1,122 @@
+import logging
+import logging.handlers
+import os
+import threading
+import time
+from collections import deque
+
+DEBUG = logging.DEBUG
+INFO = logging.INFO
+WARNING = logging.WARNING
+ERROR = logging.ERROR
+
+LEVEL_NAMES = {DEBUG: "DEBUG", INFO: "INFO", WARNING: "WARNING", ERROR: "ERROR"}
+
+
+def debug_logger(log_func):
+    """
+    Функция для отладочных сообщений в горячих циклах или None, если они отключены.
+    Проверка делается до форматирования: при выключенной отладке f-строка даже не строится.
+    Обычный callable (например, print) возвращается как есть.
+    """
+    if log_func is None:
+        return None
+    sink = getattr(log_func, "__self__", None)
+    if isinstance(sink, LogSink):
+        return sink.debug if sink.is_enabled_for(DEBUG) else None
+    return log_func
+
+
+class LogSink:
+    """
+    Буферизованный журнал: сообщения из любых потоков складываются в кольцевой буфер,
+    а в QTextEdit (и, при желании, в файл с ротацией) уходят пачками по таймеру GUI-потока.
+    append(text) совместим с QTextEdit.append, поэтому может передаваться как log_func.
+    Без виджета Qt не нужен: flush() тогда вызывается вручную.
+    """
+
+    def __init__(self, text_edit=None, level=INFO, capacity=5000, flush_interval_ms=200,
+                 file_path=None, max_file_bytes=1024 * 1024, backup_count=3):
+        self.text_edit = text_edit
+        self.level = level
+        self.records = deque(maxlen=capacity)  # (время, уровень, текст)
+        self._pending = deque(maxlen=capacity)
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+        self._file_logger = None
+        if file_path:
+            os.makedirs(os.path.dirname(file_path) or ".", exist_ok=True)
+            handler = logging.handlers.RotatingFileHandler(
+                file_path, maxBytes=max_file_bytes, backupCount=backup_count, encoding="utf-8"
+            )
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self._file_logger = logging.getLogger(f"log_sink.{id(self)}")
+            self._file_logger.propagate = False
+            self._file_logger.setLevel(DEBUG)
+            self._file_logger.addHandler(handler)
+
+        self._timer = None
+        if text_edit is not None:
+            from PyQt5.QtCore import QTimer
+            # Документ виджета тоже ограничен, иначе каждая вставка дорожает с ростом лога
+            text_edit.document().setMaximumBlockCount(capacity)
+            self._timer = QTimer(text_edit)
+            self._timer.setInterval(flush_interval_ms)
+            self._timer.timeout.connect(self.flush)
+            self._timer.start()
+
+    def is_enabled_for(self, level):
+        return level >= self.level
+
+    def set_level(self, level):
+        self.level = level
+
+    def log(self, level, text):
+        if level < self.level:
+            return
+        record = (time.time(), level, str(text))
+        with self._lock:
+            if len(self._pending) == self._pending.maxlen:
+                self.dropped += 1
+            self.records.append(record)
+            self._pending.append(record)
+
+    def debug(self, text):
+        self.log(DEBUG, text)
+
+    def info(self, text):
+        self.log(INFO, text)
+
+    def warning(self, text):
+        self.log(WARNING, text)
+
+    def error(self, text):
+        self.log(ERROR, text)
+
+    def append(self, text):
+        self.log(INFO, text)
+
+    def flush(self):
+        """Переносит накопленные сообщения в виджет и файл одной вставкой."""
+        with self._lock:
+            if not self._pending:
+                return
+            batch = list(self._pending)
+            self._pending.clear()
+            dropped, self.dropped = self.dropped, 0
+        lines = [text if level == INFO else f"[{LEVEL_NAMES.get(level, level)}] {text}" for _, level, text in batch]
+        if dropped:
+            lines.insert(0, f"... пропущено сообщений: {dropped}")
+        if self.text_edit is not None:
+            self.text_edit.append("\n".join(lines))
+        if self._file_logger is not None:
+            self._file_logger.info("\n".join(
+                f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(t))} {LEVEL_NAMES.get(level, level)} {text}"
+                for t, level, text in batch
+            ))
+
+    def text(self):
+        """Весь текст из кольцевого буфера (для копирования и проверок)."""
+        with self._lock:
+            return "\n".join(text for _, _, text in self.records)
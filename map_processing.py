@@ -1,18 +1,151 @@
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw
+import numpy as np
 import math
-import os
+from text_cache import fonts, label_sprites
+from log_sink import debug_logger
+from profiler import profiled
+from resize_cache import resize_from_pyramid
+import coords
 
+@profiled()
 def resize_image(input_image, output_size):
-    return input_image.resize(output_size, resample=Image.LANCZOS)
+    # TileStore уменьшается от ближайшего уровня пирамиды, PIL.Image – через reduce и финальный Lanczos
+    return resize_from_pyramid(input_image, output_size)
 
+def _blend_color(pixels, color):
+    """
+    Накладывает сплошной цвет на массив пикселей RGBA (..., 4).
+    Целочисленная формула совпадает с Image.alpha_composite бит в бит.
+    """
+    sr, sg, sb, sa = (int(v) for v in color)
+    if sa == 0:
+        return pixels
+    dst = pixels.astype(np.int64)
+    outa255 = sa * 255 + dst[..., 3] * (255 - sa)
+    coef1 = sa * 255 * 255 * 128 // outa255
+    coef2 = 255 * 128 - coef1
+    out = np.empty_like(pixels)
+    for i, src in enumerate((sr, sg, sb)):
+        tmp = src * coef1 + dst[..., i] * coef2 + (0x80 << 7)
+        out[..., i] = (((tmp >> 8) + tmp) >> 8) >> 7
+    tmp = outa255 + 0x80
+    out[..., 3] = ((tmp >> 8) + tmp) >> 8
+    return out
+
+def _line_cover(limit, lines):
+    """
+    Индексы строк/столбцов, покрытых линиями, как у ImageDraw.line(width=w):
+    линия в позиции pos занимает [int(pos) - (w-1)//2, int(pos) + w//2].
+    lines – список (pos, thickness, color); более поздние линии перекрывают ранние.
+    Возвращает (массив номеров цвета длиной limit, -1 – нет линии; список цветов).
+    """
+    cover = np.full(limit, -1, dtype=np.int32)
+    if not lines:
+        return cover, []
+    colors = []
+    color_ids = {}
+    pos = np.trunc(np.array([line[0] for line in lines], dtype=np.float64)).astype(np.int64)
+    thickness = np.array([line[1] for line in lines], dtype=np.int64)
+    starts = np.clip(pos - (thickness - 1) // 2, 0, limit)
+    ends = np.clip(pos + thickness // 2 + 1, 0, limit)
+    for start, end, (_, _, color) in zip(starts, ends, lines):
+        color = tuple(color)
+        if color not in color_ids:
+            color_ids[color] = len(colors)
+            colors.append(color)
+        cover[start:end] = color_ids[color]
+    return cover, colors
+
+def _runs(cover):
+    """Непрерывные участки одинакового цвета в cover: (start, end, color_id)."""
+    if not len(cover):
+        return []
+    bounds = np.flatnonzero(np.diff(cover)) + 1
+    starts = np.concatenate(([0], bounds))
+    ends = np.concatenate((bounds, [len(cover)]))
+    return [(int(a), int(b), int(cover[a])) for a, b in zip(starts, ends) if cover[a] >= 0]
+
+def _blend_grid_lines(image, x_lines, y_lines):
+    """
+    Накладывает линии сетки на RGBA-изображение на месте.
+    x_lines – вертикальные линии (позиция по X), y_lines – горизонтальные (позиция по Y).
+    Как и при рисовании на общем слое, на пересечениях остаётся цвет горизонтальной линии.
+    Обрабатываются только полосы под линиями, без полнокадровых слоёв.
+    """
+    width, height = image.size
+    x_cover, x_colors = _line_cover(width, x_lines)
+    y_cover, y_colors = _line_cover(height, y_lines)
+    free_rows = y_cover < 0
+    for x0, x1, color_id in _runs(x_cover):
+        band = np.array(image.crop((x0, 0, x1, height)))
+        band[free_rows] = _blend_color(band[free_rows], x_colors[color_id])
+        image.paste(Image.fromarray(band, "RGBA"), (x0, 0))
+    for y0, y1, color_id in _runs(y_cover):
+        band = np.array(image.crop((0, y0, width, y1)))
+        image.paste(Image.fromarray(_blend_color(band, y_colors[color_id]), "RGBA"), (0, y0))
+
+def _composite_labels(image, labels, font, font_key, fill):
+    """
+    Накладывает метки сетки [(xy, текст)] готовыми спрайтами. Пересекающиеся метки (в углу карты
+    встречаются метки обеих осей) рисуются вместе на общем слое, как на прежнем полнокадровом
+    слое текста: последовательное наложение спрайтов смешало бы их пиксели иначе.
+    """
+    placed = []
+    for xy, text in labels:
+        sprite = label_sprites.get(font, font_key, text, fill)
+        if sprite is not None:
+            layer, (dx, dy) = sprite
+            x, y = round(xy[0]) + dx, round(xy[1]) + dy
+            placed.append((xy, text, layer, (x, y, x + layer.width, y + layer.height)))
+    if not placed:
+        return
+    boxes = np.array([box for _, _, _, box in placed])
+    overlaps = ((boxes[:, None, 0] < boxes[None, :, 2]) & (boxes[None, :, 0] < boxes[:, None, 2]) &
+                (boxes[:, None, 1] < boxes[None, :, 3]) & (boxes[None, :, 1] < boxes[:, None, 3]))
+    group = np.full(len(placed), -1)
+    for i in range(len(placed)):
+        if group[i] >= 0:
+            continue
+        # Связная группа пересекающихся меток; обычно это одна метка
+        group[i] = i
+        members, stack = [i], [i]
+        while stack:
+            for j in np.flatnonzero(overlaps[stack.pop()] & (group < 0)).tolist():
+                group[j] = i
+                members.append(j)
+                stack.append(j)
+        if len(members) == 1:
+            _, _, layer, box = placed[i]
+            _composite_at(image, layer, box[0], box[1])
+            continue
+        members.sort()
+        left, top = boxes[members, 0].min(), boxes[members, 1].min()
+        shared = Image.new("RGBA", (int(boxes[members, 2].max() - left), int(boxes[members, 3].max() - top)),
+                           (0, 0, 0, 0))
+        draw = ImageDraw.Draw(shared)
+        for k in members:
+            xy, text = placed[k][:2]
+            draw.text((xy[0] - left, xy[1] - top), text, font=font, fill=tuple(fill))
+        _composite_at(image, shared, int(left), int(top))
+
+def _composite_at(image, layer, x, y):
+    """alpha_composite слоя в точку (x, y) с обрезкой по границам изображения."""
+    src_box = (max(0, -x), max(0, -y),
+               min(layer.width, image.width - x), min(layer.height, image.height - y))
+    if src_box[2] <= src_box[0] or src_box[3] <= src_box[1]:
+        return
+    image.alpha_composite(layer, dest=(max(0, x), max(0, y)), source=src_box)
+
+@profiled()
 def draw_grid(image, pixels_per_100m, grid_thickness_100, grid_thickness_1km, 
               color_100, color_1km, label_mode_h, label_mode_v, 
               font_size, font_path, font_color, margin, origin="top-left", 
               offset_x=0, offset_y=0, log_func=None):
-    from PIL import Image, ImageDraw, ImageFont
-    import math
-    import os
-
+    """
+    Накладывает на карту сетку 100 м с километровыми линиями и метки ячеек, считая от края origin.
+    RGBA-изображение дополняется на месте (возвращается тот же объект); остальные режимы
+    сначала переводятся в RGBA-копию, исходное изображение тогда не меняется.
+    """
     width, height = image.size
     interval = pixels_per_100m
     total_cols = math.floor(width / interval) + (1 if width % interval > 0 else 0)
@@ -22,19 +155,9 @@ def draw_grid(image, pixels_per_100m, grid_thickness_100, grid_thickness_1km,
         log_func(f"draw_grid: size=({width},{height}), interval={interval}, total_cols={total_cols}, total_rows={total_rows}, origin={origin}, offset_x={offset_x}, offset_y={offset_y}")
     
     # Подготовка шрифта
-    if not os.path.exists(font_path):
-        if log_func:
-            log_func(f"Шрифт не найден по пути: {font_path}, использую шрифт по умолчанию")
-        font = ImageFont.load_default()
-    else:
-        try:
-            font = ImageFont.truetype(font_path, font_size)
-            if log_func:
-                log_func(f"Шрифт успешно загружен: size={font_size}, path={font_path}")
-        except Exception as e:
-            if log_func:
-                log_func(f"Ошибка загрузки шрифта '{font_path}': {e}, использую шрифт по умолчанию")
-            font = ImageFont.load_default()
+    font = fonts.get(font_path, font_size, log_func)
+    # Подробные сообщения о каждой линии и метке – только при включённой отладке
+    debug = debug_logger(log_func)
     
     # Определяем позиции линий и меток
     if origin in ("top-left", "bottom-left"):
@@ -55,16 +178,18 @@ def draw_grid(image, pixels_per_100m, grid_thickness_100, grid_thickness_1km,
         v_label_positions = [height - (i * interval + interval / 2) for i in range(total_rows)]
         v_labels = [offset_y + i for i in range(total_rows)]
     
-    if log_func:
-        log_func(f"Горизонтальные линии: позиции={h_line_positions}")
-        log_func(f"Горизонтальные метки: значения={h_labels}")
-        log_func(f"Горизонтальные метки: позиции={h_label_positions}")
-        log_func(f"Вертикальные линии: позиции={v_line_positions}")
-        log_func(f"Вертикальные метки: значения={v_labels}")
-        log_func(f"Вертикальные метки: позиции={v_label_positions}")
+    if debug:
+        debug(f"Горизонтальные линии: позиции={h_line_positions}")
+        debug(f"Горизонтальные метки: значения={h_labels}")
+        debug(f"Горизонтальные метки: позиции={h_label_positions}")
+        debug(f"Вертикальные линии: позиции={v_line_positions}")
+        debug(f"Вертикальные метки: значения={v_labels}")
+        debug(f"Вертикальные метки: позиции={v_label_positions}")
     
-    overlay = Image.new("RGBA", image.size, (0, 0, 0, 0))
-    draw_overlay = ImageDraw.Draw(overlay)
+    # Изображение дополняется на месте, без полнокадровых слоёв
+    combined = image if image.mode == "RGBA" else image.convert("RGBA")
+    x_lines = []
+    y_lines = []
     
     # Отрисовка линий
     for pos in h_line_positions:
@@ -76,9 +201,9 @@ def draw_grid(image, pixels_per_100m, grid_thickness_100, grid_thickness_1km,
         is_km_line = (global_x % 10 == 0)
         thickness = grid_thickness_1km if is_km_line else grid_thickness_100
         line_color = color_1km if is_km_line else color_100
-        if log_func:
-            log_func(f"Рисую горизонтальную линию: pos X={pos:.1f}, global_x={global_x}, км-линия={is_km_line}")
-        draw_overlay.line([(pos, 0), (pos, height)], fill=line_color, width=thickness)
+        if debug:
+            debug(f"Рисую горизонтальную линию: pos X={pos:.1f}, global_x={global_x}, км-линия={is_km_line}")
+        x_lines.append((pos, thickness, line_color))
     
     for pos in v_line_positions:
         if origin in ("top-left", "top-right"):
@@ -89,14 +214,14 @@ def draw_grid(image, pixels_per_100m, grid_thickness_100, grid_thickness_1km,
         is_km_line = (global_y % 10 == 0)
         thickness = grid_thickness_1km if is_km_line else grid_thickness_100
         line_color = color_1km if is_km_line else color_100
-        if log_func:
-            log_func(f"Рисую вертикальную линию: pos Y={pos:.1f}, global_y={global_y}, км-линия={is_km_line}")
-        draw_overlay.line([(0, pos), (width, pos)], fill=line_color, width=thickness)
+        if debug:
+            debug(f"Рисую вертикальную линию: pos Y={pos:.1f}, global_y={global_y}, км-линия={is_km_line}")
+        y_lines.append((pos, thickness, line_color))
     
-    # Отрисовка текста на отдельном слое
-    text_layer = Image.new("RGBA", image.size, (0, 0, 0, 0))
-    draw_text = ImageDraw.Draw(text_layer)
+    _blend_grid_lines(combined, x_lines, y_lines)
     
+    # Метки накладываются только в пределах своих рамок
+    labels = []
     for i, cx in enumerate(h_label_positions):
         if -margin <= cx <= width + margin:
             label = f"{(h_labels[i] if label_mode_h == '0' else h_labels[i] + 1):03d}"
@@ -104,9 +229,9 @@ def draw_grid(image, pixels_per_100m, grid_thickness_100, grid_thickness_1km,
             text_width = bbox[2] - bbox[0]
             text_x = max(0, min(width - text_width, cx - text_width / 2))
             text_y = margin
-            draw_text.text((text_x, text_y), label, font=font, fill=font_color)
-            if log_func:
-                log_func(f"Рисую горизонтальную метку: label='{label}', pos X={cx:.1f}, global_x={h_labels[i]}")
+            labels.append(((text_x, text_y), label))
+            if debug:
+                debug(f"Рисую горизонтальную метку: label='{label}', pos X={cx:.1f}, global_x={h_labels[i]}")
     
     for j, cy in enumerate(v_label_positions):
         if -margin <= cy <= height + margin:
@@ -115,64 +240,69 @@ def draw_grid(image, pixels_per_100m, grid_thickness_100, grid_thickness_1km,
             text_height = bbox[3] - bbox[1]
             text_x = margin
             text_y = max(0, min(height - text_height, cy - text_height / 2))
-            draw_text.text((text_x, text_y), label, font=font, fill=font_color)
-            if log_func:
-                log_func(f"Рисую вертикальную метку: label='{label}', pos Y={cy:.1f}, global_y={v_labels[j]}")
+            labels.append(((text_x, text_y), label))
+            if debug:
+                debug(f"Рисую вертикальную метку: label='{label}', pos Y={cy:.1f}, global_y={v_labels[j]}")
+    _composite_labels(combined, labels, font, (font_path, font_size), font_color)
     
-    # Комбинируем слои
-    combined = Image.alpha_composite(image.convert("RGBA"), overlay)
-    combined = Image.alpha_composite(combined, text_layer)
     if log_func:
         log_func("Сетка и метки успешно наложены на карту")
     return combined
 
-# Аналогично обновим draw_grid_region
+def _region_axis(length, interval, offset, flip):
+    """
+    Линии и метки участка по одной оси длиной length пикселей. Ячейка offset прилегает к краю
+    отсчёта (к правому/нижнему при flip), неполная ячейка – у противоположного края;
+    остаток меньше полупикселя от округления размера участка ячейкой не считается.
+    Возвращает (позиции линий, центры меток, номера меток); линия i – начало ячейки offset + i.
+    """
+    cells = max(1, math.ceil((length - 0.5) / interval))
+    lines = [min(i * interval, length) for i in range(cells)] + [length]
+    centers = [(lines[i] + lines[i + 1]) / 2 for i in range(cells)]
+    if flip:
+        lines = [length - pos for pos in lines]
+        centers = [length - pos for pos in centers]
+    return lines, centers, [offset + i for i in range(cells)]
+
+@profiled()
 def draw_grid_region(image, pixels_per_100m, grid_thickness_100, grid_thickness_1km, 
                      color_100, color_1km, label_mode_h, label_mode_v, 
                      font_size, font_path, font_color, margin, origin="bottom-left", 
                      offset_x=0, offset_y=0, log_func=None):
+    """
+    Сетка и метки для вырезанного участка; offset_x, offset_y – номера его первых ячеек на полной карте.
+    Как и draw_grid, дополняет RGBA-изображение на месте, остальные режимы – в RGBA-копии.
+    """
     width, height = image.size
     interval = pixels_per_100m
 
     if log_func:
         log_func(f"Запуск draw_grid_region: width={width}, height={height}, interval={interval}, offset_x={offset_x}, offset_y={offset_y}, origin={origin}")
 
-    overlay = Image.new("RGBA", image.size, (0, 0, 0, 0))
-    draw_overlay = ImageDraw.Draw(overlay)
+    combined = image if image.mode == "RGBA" else image.convert("RGBA")
+    x_lines = []
+    y_lines = []
+    labels = []
 
-    if not os.path.exists(font_path):
-        if log_func:
-            log_func(f"Шрифт не найден по пути: {font_path}, использую шрифт по умолчанию")
-        font = ImageFont.load_default()
-    else:
-        try:
-            font = ImageFont.truetype(font_path, font_size)
-            if log_func:
-                log_func(f"Шрифт успешно загружен: size={font_size}, path={font_path}")
-        except Exception as e:
-            if log_func:
-                log_func(f"Ошибка загрузки шрифта '{font_path}': {e}, использую шрифт по умолчанию")
-            font = ImageFont.load_default()
+    font = fonts.get(font_path, font_size, log_func)
 
     def format_label(n, mode):
         base = n if mode == "0" else n + 1
         return f"{base:03d}"
 
-    region_cols = int(width // interval) + (1 if width % interval > 0 else 0)
-    h_line_positions = [i * interval for i in range(region_cols)]
-    h_line_positions.append(width)
-    h_labels = [offset_x + i for i in range(region_cols)]
-    h_label_positions = [i * interval + interval / 2 for i in range(region_cols - 1)]
-    last_label_x = ((region_cols - 1) * interval + width) / 2
-    h_label_positions.append(last_label_x)
+    # Ячейки нумеруются от края отсчёта origin, как в draw_grid и cells_to_box:
+    # для правых начал – справа налево, для нижних – снизу вверх
+    flip_x = origin in ("top-right", "bottom-right")
+    flip_y = origin in ("bottom-left", "bottom-right")
+    h_line_positions, h_label_positions, h_labels = _region_axis(width, interval, offset_x, flip_x)
+    v_line_positions, v_label_positions, v_labels = _region_axis(height, interval, offset_y, flip_y)
 
-    for pos in h_line_positions:
-        local_index = int(pos // interval)
-        global_x = offset_x + local_index
+    for i, pos in enumerate(h_line_positions):
+        global_x = offset_x + i
         is_km_line = (global_x % 10 == 0)
         thickness = grid_thickness_1km if is_km_line else grid_thickness_100
         line_color = color_1km if is_km_line else color_100
-        draw_overlay.line([(pos, 0), (pos, height)], fill=line_color, width=thickness)
+        x_lines.append((pos, thickness, line_color))
 
     for i, cx in enumerate(h_label_positions):
         if -margin <= cx <= width + margin:
@@ -181,39 +311,14 @@ def draw_grid_region(image, pixels_per_100m, grid_thickness_100, grid_thickness_
             text_width = bbox[2] - bbox[0]
             text_x = max(0, min(width - text_width, cx - text_width / 2))
             text_y = margin
-            draw_overlay.text((text_x, text_y), label, font=font, fill=font_color)
-
-    if origin == "bottom-left":
-        full_rows = int(height // interval)
-        remainder = height - full_rows * interval
-        if remainder > 0:
-            region_rows = full_rows + 1
-            v_line_positions = [height - i * interval for i in range(full_rows)]
-            v_line_positions.append(height - full_rows * interval)
-            v_line_positions.append(0)
-        else:
-            region_rows = full_rows
-            v_line_positions = [height - i * interval for i in range(full_rows)]
-            v_line_positions.append(0)
-        v_label_positions = [(v_line_positions[i] + v_line_positions[i+1]) / 2 for i in range(len(v_line_positions)-1)]
-        v_labels = [offset_y + i for i in range(len(v_label_positions))]
-    else:
-        region_rows = int(height // interval) + (1 if height % interval > 0 else 0)
-        v_line_positions = [j * interval for j in range(region_rows + 1)]
-        v_label_positions = [j * interval + interval / 2 for j in range(region_rows)]
-        v_labels = [offset_y + j for j in range(region_rows)]
+            labels.append(((text_x, text_y), label))
 
-    for pos in v_line_positions:
-        if origin == "bottom-left":
-            local_index = int((height - pos) // interval)
-            global_y = offset_y + local_index
-        else:
-            local_index = int(pos // interval)
-            global_y = offset_y + local_index
+    for j, pos in enumerate(v_line_positions):
+        global_y = offset_y + j
         is_km_line = (global_y % 10 == 0)
         thickness = grid_thickness_1km if is_km_line else grid_thickness_100
         line_color = color_1km if is_km_line else color_100
-        draw_overlay.line([(0, pos), (width, pos)], fill=line_color, width=thickness)
+        y_lines.append((pos, thickness, line_color))
 
     for j, cy in enumerate(v_label_positions):
         label = format_label(v_labels[j], label_mode_v)
@@ -221,9 +326,10 @@ def draw_grid_region(image, pixels_per_100m, grid_thickness_100, grid_thickness_
         text_height = bbox[3] - bbox[1]
         text_x = margin
         text_y = max(0, min(height - text_height, cy - text_height / 2))
-        draw_overlay.text((text_x, text_y), label, font=font, fill=font_color)
+        labels.append(((text_x, text_y), label))
 
-    combined = Image.alpha_composite(image.convert("RGBA"), overlay)
+    _blend_grid_lines(combined, x_lines, y_lines)
+    _composite_labels(combined, labels, font, (font_path, font_size), font_color)
     return combined
 
 # Другие функции (resize_image, world_to_pixel, etc.) остаются без изменений
@@ -231,150 +337,359 @@ def draw_grid_region(image, pixels_per_100m, grid_thickness_100, grid_thickness_
 def world_to_pixel(world_x, world_y, image_width, image_height, origin, scale=1.0):
     """
     Преобразует мировые координаты (в метрах) в пиксельные координаты на изображении.
-    scale – коэффициент масштабирования.
-    """
-    if origin == "bottom-left":
-        pixel_x = world_x * scale
-        pixel_y = image_height - (world_y * scale)
-    elif origin == "top-left":
-        pixel_x = world_x * scale
-        pixel_y = world_y * scale
-    elif origin == "top-right":
-        pixel_x = image_width - (world_x * scale)
-        pixel_y = world_y * scale
-    elif origin == "bottom-right":
-        pixel_x = image_width - (world_x * scale)
-        pixel_y = image_height - (world_y * scale)
-    else:
-        pixel_x, pixel_y = world_x * scale, world_y * scale
-    return pixel_x, pixel_y
+    scale – коэффициент масштабирования. Для массивов точек – coords.world_to_pixel.
+    """
+    px, py = coords.world_to_pixel(world_x, world_y, (image_width, image_height), origin, scale)
+    return float(px), float(py)
 
-def draw_names(image, db_path, type_settings, origin, scale=1.0, crop_offset=None, 
-               global_width=None, global_height=None, log_func=None):
-    from PIL import ImageDraw, ImageFont
-    import os
+def pixel_to_world(pixel_x, pixel_y, image_width, image_height, origin, scale=1.0):
+    """
+    Обратное преобразование к world_to_pixel: пиксели глобальной карты -> мировые координаты (м).
+    """
+    world_x, world_y = coords.pixel_to_world(pixel_x, pixel_y, (image_width, image_height), origin, scale)
+    return float(world_x), float(world_y)
+
+def box_to_world(box, image_width, image_height, origin, scale=1.0):
+    """Прямоугольник в пикселях (left, top, right, bottom) -> (xmin, ymin, xmax, ymax) в мировых координатах."""
+    return coords.box_to_world(box, (image_width, image_height), origin, scale)
+
+def query_names(db_path, image_size, origin, scale=1.0, crop_offset=None,
+                global_width=None, global_height=None, log_func=None):
+    """Записи названий для изображения: для участка – только попадающие в его мировые границы."""
     try:
-        from db_handler import get_names
+        from db_handler import get_names, get_names_in_bbox
     except Exception as e:
         if log_func:
             log_func(f"Ошибка импорта db_handler: {e}")
-        return image
+        return []
 
-    names = get_names(db_path, log_func)
-    
-    # Создаём слой для текста
-    text_layer = Image.new("RGBA", image.size, (0, 0, 0, 0))
-    draw = ImageDraw.Draw(text_layer)
-    
     if global_width is None or global_height is None:
-        global_width, global_height = image.width, image.height
+        global_width, global_height = image_size
+
+    if crop_offset is None:
+        return get_names(db_path, log_func)
+    # Для участка читаем из базы только названия внутри его мировых границ
+    crop_box = (crop_offset[0], crop_offset[1], crop_offset[0] + image_size[0], crop_offset[1] + image_size[1])
+    xmin, ymin, xmax, ymax = box_to_world(crop_box, global_width, global_height, origin, scale)
+    pad = 1 / scale  # пиксель запаса на округление; точная проверка границ в layout_names
+    return get_names_in_bbox(db_path, xmin - pad, ymin - pad, xmax + pad, ymax + pad, log_func)
 
+def _world_points(names, log_func=None):
+    """(записи с корректными координатами, массив (N, 2) их мировых координат)."""
+    try:
+        return names, np.array([(rec["x"], rec["y"]) for rec in names], dtype=np.float64).reshape(-1, 2)
+    except (KeyError, TypeError, ValueError):
+        pass
+    # Есть битые записи: отбрасываем их по одной
+    records, points = [], []
     for rec in names:
         try:
-            name = rec["name"]
-            rec_type = rec["type"]
-            world_x = float(rec["x"])
-            world_y = float(rec["y"])
-
-            px, py = world_to_pixel(world_x, world_y, global_width, global_height, origin, scale)
-            if crop_offset is not None:
-                px -= crop_offset[0]
-                py -= crop_offset[1]
-            if not (0 <= px <= image.width and 0 <= py <= image.height):
-                continue
-
-            settings = type_settings.get(rec_type, {"font_size": 12, "font_color": (0, 0, 0, 255)})
+            points.append((float(rec["x"]), float(rec["y"])))
+            records.append(rec)
+        except (KeyError, TypeError, ValueError) as e:
+            if log_func:
+                log_func(f"Ошибка при отрисовке записи {rec}: {e}")
+    return records, np.array(points, dtype=np.float64).reshape(-1, 2)
+
+@profiled()
+def layout_names(names, image_size, type_settings, origin, scale=1.0, crop_offset=None,
+                 global_width=None, global_height=None, log_func=None):
+    """
+    Раскладка названий без рисования: список (спрайт, x, y) для compose_sprites.
+    Это и есть «слой названий»: он не занимает полный кадр и пересчитывается отдельно от сетки.
+    """
+    width, height = image_size
+    if global_width is None or global_height is None:
+        global_width, global_height = image_size
+
+    # Координаты всех записей переводятся в пиксели одним проходом NumPy,
+    # спрайты ищутся только для попавших в изображение
+    records, world = _world_points(names, log_func)
+    if not records:
+        return []
+    px, py = coords.world_to_pixel(world[:, 0], world[:, 1], (global_width, global_height), origin, scale,
+                                   crop_offset or (0, 0))
+    inside = np.flatnonzero((px >= 0) & (px <= width) & (py >= 0) & (py <= height))
+    xs = np.round(px[inside]).astype(np.int64).tolist()
+    ys = np.round(py[inside]).astype(np.int64).tolist()
+
+    placements = []
+    for i, x, y in zip(inside.tolist(), xs, ys):
+        rec = records[i]
+        try:
+            settings = type_settings.get(rec["type"], {"font_size": 12, "font_color": (0, 0, 0, 255)})
             font_path = settings.get("font", "C:/Windows/Fonts/arial.ttf")
-            if not os.path.exists(font_path):
-                if log_func:
-                    log_func(f"Шрифт не найден по пути: {font_path}, использую шрифт по умолчанию")
-                font = ImageFont.load_default()
-            else:
-                try:
-                    font = ImageFont.truetype(font_path, settings["font_size"])
-                except Exception as e:
-                    if log_func:
-                        log_func(f"Ошибка загрузки шрифта '{font_path}': {e}, использую шрифт по умолчанию")
-                    font = ImageFont.load_default()
-            draw.text((px, py), name, font=font, fill=settings["font_color"])
+            font_key = (font_path, settings["font_size"])
+            font = fonts.get(font_path, settings["font_size"], log_func)
+            sprite = label_sprites.get(font, font_key, rec["name"], settings["font_color"])
+            if sprite is not None:
+                layer, (dx, dy) = sprite
+                placements.append((layer, x + dx, y + dy))
         except Exception as e:
             if log_func:
                 log_func(f"Ошибка при отрисовке записи {rec}: {e}")
+    return placements
+
+def label_boxes(names, image_size, type_settings, origin, scale=1.0, log_func=None):
+    """Рамки (left, top, right, bottom) спрайтов надписей в пикселях карты – ровно то, что займёт layout_names."""
+    return [(x, y, x + layer.width, y + layer.height)
+            for layer, x, y in layout_names(names, image_size, type_settings, origin, scale, log_func=log_func)]
+
+@profiled()
+def compose_sprites(image, placements):
+    """Накладывает разложенные спрайты на RGBA-изображение на месте."""
+    for layer, x, y in placements:
+        _composite_at(image, layer, x, y)
+    return image
+
+@profiled()
+def draw_names(image, db_path, type_settings, origin, scale=1.0, crop_offset=None, 
+               global_width=None, global_height=None, log_func=None):
+    """
+    Наносит названия из базы на изображение и возвращает его.
+    RGBA-изображение дополняется на месте (возвращается тот же объект); остальные режимы
+    сначала переводятся в RGBA-копию, исходное изображение тогда не меняется.
+    """
+    names = query_names(db_path, image.size, origin, scale, crop_offset, global_width, global_height, log_func)
+    
+    # Названия накладываются на месте готовыми спрайтами, без полнокадрового слоя текста
+    combined = image if image.mode == "RGBA" else image.convert("RGBA")
+    placements = layout_names(names, image.size, type_settings, origin, scale, crop_offset,
+                              global_width, global_height, log_func)
+    compose_sprites(combined, placements)
     
-    # Комбинируем слой текста с изображением
-    combined = Image.alpha_composite(image.convert("RGBA"), text_layer)
     if log_func:
         log_func("Названия успешно нанесены на карту")
     return combined
 
-def extract_region(image, center_cell, n_cells, pixels_per_100m, origin="bottom-left", log_func=None):
+DEFAULT_NAME_SETTINGS = {
+    "NameCityCapital": {"font_size": 16, "font_color": (255, 0, 0, 255)},
+    "NameCity": {"font_size": 14, "font_color": (0, 0, 255, 255)},
+    "NameVillage": {"font_size": 12, "font_color": (0, 128, 0, 255)},
+    "Hill": {"font_size": 10, "font_color": (128, 128, 128, 255)},
+    "NameLocal": {"font_size": 10, "font_color": (128, 0, 128, 255)},
+    "NameMarine": {"font_size": 10, "font_color": (0, 128, 128, 255)}
+}
+
+def normalize_params(params):
     """
-    Извлекает регион из глобальной карты, сохраняя глобальную нумерацию ячеек.
-    Возвращает кортеж: (region, start_col, start_row, total_cols, total_rows, crop_box)
+    Приводит параметры, прочитанные из JSON (списки), к виду get_parameters() (кортежи).
+    Возвращает новый словарь, исходный не меняется.
+    """
+    params = dict(params)
+    for key in ("output_resolution", "color_100", "color_1km", "font_color"):
+        if key in params and params[key] is not None:
+            params[key] = tuple(params[key])
+    if "name_settings" in params:
+        params["name_settings"] = {
+            t: dict(sett, font_color=tuple(sett.get("font_color", (0, 0, 0, 255))))
+            for t, sett in params["name_settings"].items()
+        }
+    return params
+
+def region_geometry(map_size, center_cell, n_cells, pixels_per_100m, origin="bottom-left"):
+    """
+    Считает границы региона по геометрии сетки, не трогая пиксели.
+    Возвращает кортеж: (start_col, start_row, total_cols, total_rows, crop_box)
     где crop_box = (left, top, right, bottom) в пикселях глобальной карты.
     """
     interval = pixels_per_100m
     col, row = center_cell
 
-    width, height = image.size
+    width, height = map_size
     total_cols = math.floor(width / interval) + (1 if width % interval > 0 else 0)
     total_rows = math.floor(height / interval) + (1 if height % interval > 0 else 0)
     
+    # Участок из 2 * n_cells + 1 ячеек вокруг центра, прижатый к краям карты
+    start_col, end_col = _clamp_span(col, n_cells, total_cols)
+    start_row, end_row = _clamp_span(row, n_cells, total_rows)
+    crop_box = coords.cells_to_box(start_col, start_row, end_col, end_row, map_size, origin, interval)
+    return start_col, start_row, total_cols, total_rows, crop_box
+
+def _clamp_span(center, n_cells, total):
+    """Первая и последняя ячейки отрезка center ± n_cells, сдвинутого внутрь [0, total)."""
     cells = 2 * n_cells + 1
+    start = center - n_cells
+    end = center + n_cells
+    if start < 0:
+        start = 0
+        end = cells - 1
+    if end >= total:
+        end = total - 1
+        start = end - (cells - 1)
+        if start < 0:
+            start = 0
+    return start, end
 
-    # Расчет по оси X
-    start_col = col - n_cells
-    end_col = col + n_cells
-    if start_col < 0:
-        start_col = 0
-        end_col = cells - 1
-    if end_col >= total_cols:
-        end_col = total_cols - 1
-        start_col = end_col - (cells - 1)
-        if start_col < 0:
-            start_col = 0
-
-    # Расчет по оси Y
-    start_row = row - n_cells
-    end_row = row + n_cells
-    if origin == "bottom-left":
-        if start_row < 0:
-            start_row = 0
-            end_row = cells - 1
-        if end_row >= total_rows:
-            end_row = total_rows - 1
-            start_row = end_row - (cells - 1)
-            if start_row < 0:
-                start_row = 0
-        # Для bottom-left: 0 – нижняя строка
-        top = height - (end_row + 1) * interval
-        bottom = height - start_row * interval
-    else:  # top-left
-        if start_row < 0:
-            start_row = 0
-            end_row = cells - 1
-        if end_row >= total_rows:
-            end_row = total_rows - 1
-            start_row = end_row - (cells - 1)
-            if start_row < 0:
-                start_row = 0
-        top = start_row * interval
-        bottom = (end_row + 1) * interval
-
-    left = start_col * interval
-    right = (end_col + 1) * interval
-    left = max(0, min(left, width))
-    right = max(0, min(right, width))
-    top = max(0, min(top, height))
-    bottom = max(0, min(bottom, height))
+@profiled()
+def extract_region(image, center_cell, n_cells, pixels_per_100m, origin="bottom-left", log_func=None):
+    """
+    Извлекает регион из глобальной карты, сохраняя глобальную нумерацию ячеек.
+    image – PIL.Image или TileStore: читаются только пиксели внутри crop_box.
+    Возвращает кортеж: (region, start_col, start_row, total_cols, total_rows, crop_box)
+    где crop_box = (left, top, right, bottom) в пикселях глобальной карты.
+    """
+    start_col, start_row, total_cols, total_rows, crop_box = region_geometry(
+        image.size, center_cell, n_cells, pixels_per_100m, origin)
 
     if log_func:
         log_func(
-            f"Extract region: image size=({width},{height}), interval={interval}, total_cols={total_cols}, total_rows={total_rows}, "
-            f"center_cell={center_cell}, n_cells={n_cells}, start_col={start_col}, end_col={end_col}, start_row={start_row}, end_row={end_row}, "
-            f"crop box=({left}, {top}, {right}, {bottom})"
+            f"Extract region: image size=({image.size[0]},{image.size[1]}), interval={pixels_per_100m}, total_cols={total_cols}, total_rows={total_rows}, "
+            f"center_cell={center_cell}, n_cells={n_cells}, start_col={start_col}, start_row={start_row}, "
+            f"crop box={crop_box}"
         )
     
-    region = image.crop((left, top, right, bottom))
-    crop_box = (left, top, right, bottom)
-    return region, start_col, start_row, total_cols, total_rows, crop_box
\ No newline at end of file
+    region = image.crop(crop_box)
+    return region, start_col, start_row, total_cols, total_rows, crop_box
+
+@profiled()
+def render_region(source, params, db_path, center_cell=None, n_cells=None, log_func=None):
+    """
+    Полный цикл подготовки участка без GUI: вырезка -> сетка -> названия.
+    source – исходная карта (PIL.Image или TileStore), params – словарь как у get_parameters().
+    Геометрия считается в выходном разрешении, из источника читается только нужный прямоугольник,
+    поэтому стоимость зависит от размера участка, а не карты.
+    Возвращает (изображение участка, crop_box в пикселях выходной карты).
+    """
+    if center_cell is None:
+        center_cell = (params["center_col"], params["center_row"])
+    if n_cells is None:
+        n_cells = params["n_cells"]
+    params = normalize_params(params)
+    output_resolution = tuple(params["output_resolution"])
+    scale_factor = output_resolution[0] / source.size[0]
+    pixels_per_100m_output = params["pixels_per_100m"] * scale_factor
+
+    start_col, start_row, total_cols, total_rows, crop_box = region_geometry(
+        output_resolution, center_cell, n_cells, pixels_per_100m_output, params["origin"])
+    left, top, right, bottom = crop_box
+    region_size = (max(1, round(right - left)), max(1, round(bottom - top)))
+    if scale_factor == 1:
+        region = source.crop(crop_box)
+    else:
+        # Вырезаем соответствующий прямоугольник исходника и масштабируем только его
+        sl, st, sr, sb = (v / scale_factor for v in crop_box)
+        read_box = (math.floor(sl), math.floor(st), math.ceil(sr), math.ceil(sb))
+        region = source.crop(read_box).resize(
+            region_size, resample=Image.LANCZOS,
+            box=(sl - read_box[0], st - read_box[1], sr - read_box[0], sb - read_box[1])
+        )
+    if log_func:
+        log_func(
+            f"Extract region: output size={output_resolution}, interval={pixels_per_100m_output}, "
+            f"total_cols={total_cols}, total_rows={total_rows}, center_cell={center_cell}, n_cells={n_cells}, "
+            f"start_col={start_col}, start_row={start_row}, crop box={crop_box}"
+        )
+
+    region_with_grid = draw_grid_region(
+        region,
+        pixels_per_100m_output,
+        params["grid_thickness_100"],
+        params["grid_thickness_1km"],
+        params["color_100"],
+        params["color_1km"],
+        params.get("label_mode_h", "0"),
+        params.get("label_mode_v", "0"),
+        params["font_size"],
+        params["font_path"],
+        params["font_color"],
+        params["margin"],
+        params["origin"],
+        offset_x=start_col,
+        offset_y=start_row,
+        log_func=log_func
+    )
+
+    region_with_names = draw_names(
+        region_with_grid,
+        db_path,
+        params.get("name_settings", DEFAULT_NAME_SETTINGS),
+        params["origin"],
+        scale=scale_factor,
+        crop_offset=(left, top),  # Учитываем смещение для участка
+        global_width=output_resolution[0],
+        global_height=output_resolution[1],
+        log_func=log_func
+    )
+    return region_with_names, crop_box
+
+def render_region_multiscale(source, params, db_path, center_cell=None, budgets=(1024,), log_func=None):
+    """
+    Несколько отрисовок участка вокруг center_cell за один вызов – например, обзор и детальный вид.
+    budgets – список сторон в пикселях или пар (n_cells, сторона): участок из n_cells ячеек
+    в каждую сторону вписывается в квадрат с этой стороной.
+    Область источника читается один раз (с подходящего уровня пирамиды TileStore),
+    названия запрашиваются из базы один раз; сетка и надписи рисуются сразу в целевом масштабе
+    с исходными размерами шрифтов, без отрисовки в полном размере и последующего уменьшения.
+    Возвращает список (изображение, crop_box в пикселях выходной карты) в порядке budgets.
+    """
+    if center_cell is None:
+        center_cell = (params["center_col"], params["center_row"])
+    params = normalize_params(params)
+    output_resolution = tuple(params["output_resolution"])
+    scale_factor = output_resolution[0] / source.size[0]
+    pixels_per_100m_output = params["pixels_per_100m"] * scale_factor
+    origin = params["origin"]
+
+    # Геометрия каждой отрисовки в пикселях выходной карты и её масштаб относительно неё
+    specs = []
+    for budget in budgets:
+        n_cells, max_side = budget if isinstance(budget, (tuple, list)) else (params["n_cells"], budget)
+        start_col, start_row, _, _, crop_box = region_geometry(
+            output_resolution, center_cell, n_cells, pixels_per_100m_output, origin)
+        left, top, right, bottom = crop_box
+        k = max_side / max(right - left, bottom - top, 1)
+        size = (max(1, round((right - left) * k)), max(1, round((bottom - top) * k)))
+        specs.append((start_col, start_row, crop_box, k, size))
+    if not specs:
+        return []
+
+    # Одно чтение источника: объединение всех участков с уровня пирамиды, которого хватает
+    # для самой детальной отрисовки
+    union = (min(s[2][0] for s in specs), min(s[2][1] for s in specs),
+             max(s[2][2] for s in specs), max(s[2][3] for s in specs))
+    level = source.best_level(min(1.0, scale_factor * max(s[3] for s in specs))) \
+        if hasattr(source, "best_level") else 0
+    f = 2 ** level
+    src_box = [v / scale_factor / f for v in union]
+    read_box = (math.floor(src_box[0]), math.floor(src_box[1]), math.ceil(src_box[2]), math.ceil(src_box[3]))
+    base = source.read_region(read_box, level) if level else source.crop(read_box)
+
+    names = query_names(db_path, (union[2] - union[0], union[3] - union[1]), origin, scale_factor,
+                        crop_offset=union[:2], global_width=output_resolution[0],
+                        global_height=output_resolution[1], log_func=log_func)
+    name_settings = params.get("name_settings", DEFAULT_NAME_SETTINGS)
+
+    results = []
+    for start_col, start_row, crop_box, k, size in specs:
+        box = tuple(v / scale_factor / f - read_box[i % 2] for i, v in enumerate(crop_box))
+        region = base.resize(size, resample=Image.LANCZOS, box=box, reducing_gap=2.0)
+        region = draw_grid_region(
+            region,
+            pixels_per_100m_output * k,
+            params["grid_thickness_100"],
+            params["grid_thickness_1km"],
+            params["color_100"],
+            params["color_1km"],
+            params.get("label_mode_h", "0"),
+            params.get("label_mode_v", "0"),
+            params["font_size"],
+            params["font_path"],
+            params["font_color"],
+            params["margin"],
+            origin,
+            offset_x=start_col,
+            offset_y=start_row,
+            log_func=log_func
+        )
+        # Названия раскладываются в координатах карты, увеличенной в k раз
+        placements = layout_names(
+            names, region.size, name_settings, origin, scale=scale_factor * k,
+            crop_offset=(crop_box[0] * k, crop_box[1] * k),
+            global_width=output_resolution[0] * k, global_height=output_resolution[1] * k, log_func=log_func
+        )
+        results.append((compose_sprites(region, placements), crop_box))
+    if log_func:
+        log_func(f"Участок {center_cell} отрисован в {len(results)} масштабах: "
+                 f"{', '.join(f'{im.size[0]}x{im.size[1]}' for im, _ in results)}")
+    return results
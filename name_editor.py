@@ -1,9 +1,22 @@
 from PyQt5.QtWidgets import QGraphicsTextItem, QGraphicsRectItem
-from PyQt5.QtCore import Qt, QPointF, QRectF
+from PyQt5.QtCore import Qt, QPointF, QRectF, QTimer
 from PyQt5.QtGui import QFont, QPen, QColor, QBrush
 import os
-from db_handler import get_names, update_name_position
-from utils import pil_image_to_qpixmap
+import time
+import numpy as np
+from db_handler import get_names, update_name_positions, get_db_revision
+from map_processing import label_boxes
+from render_pipeline import render_params_equal
+import coords
+from tiled_view import TiledImageItem
+from log_sink import debug_logger
+
+# Сторона ячейки пространственного индекса надписей, пиксели карты
+BUCKET_SIZE = 256
+# Запас вокруг видимой области, в котором надписи создаются заранее (доля размера окна)
+VIEW_MARGIN = 0.5
+# Больше элементов одновременно не создаётся: при сильном отдалении надписи всё равно не читаются
+MAX_LIVE_ITEMS = 3000
 
 class NameEditor:
     def __init__(self, map_tab, image_with_grid, image_without_names, db_path, type_settings, origin, scale, global_width, global_height, params, log_func=None):
@@ -16,99 +29,249 @@ class NameEditor:
         self.scale = scale
         self.global_width = global_width
         self.global_height = global_height
+        self.params = params
         self.log_func = log_func
         self.names = get_names(db_path, log_func)
-        self.editable_items = {}  # Словарь для хранения надписей по id
+        self.editable_items = {}  # Созданные (видимые) надписи по id
         self.modified_items = {}  # Словарь для изменённых позиций
         self.scene = map_tab.scene
         self.is_editing = False
         self.selected_item = None
+        # Слой надписей виртуальный: элементы есть только у записей рядом с видимой областью,
+        # вышедшие из неё возвращаются в пул и переиспользуются
+        self._positions = None  # numpy (N, 2): пиксельные позиции записей self.names
+        self._index_of = {}  # id -> номер записи в self.names
+        self._buckets = {}  # (bx, by) -> множество номеров записей
+        self._free_items = []
+        self._fonts = {}
+        self._max_label_size = (0.0, 0.0)
+        self._refresh_timer = QTimer()
+        self._refresh_timer.setSingleShot(True)
+        self._refresh_timer.setInterval(30)
+        self._refresh_timer.timeout.connect(self.refresh_visible)
+        self._background = None
+        # Для перерисовки по изменённым областям: ревизия базы, при которой отрисована карта,
+        # ожидаемая ревизия после своих сохранений и рамки надписей до и после переноса
+        self._base_revision = None
+        self._revision = None
+        self.dirty_boxes = []
 
     def start_editing(self):
         if self.is_editing:
             return
         self.is_editing = True
-        self.scene.clear()
         self.editable_items.clear()  # Очищаем перед загрузкой
+        self._free_items = []
+        self._base_revision = self._revision = get_db_revision(self.db_path)
+        self.dirty_boxes = []
+        # Готовую карту не удаляем, а прячем: после редактирования её тайлы перестраиваются
+        # только в изменённых областях
+        if self.map_tab.map_item is not None:
+            self.map_tab.map_item.hide()
 
-        # Добавляем карту как фон
-        pixmap_item = self.scene.addPixmap(pil_image_to_qpixmap(self.image_with_grid))
-        pixmap_item.setZValue(-1)  # Фон ниже надписей
+        # Добавляем карту как фон (тайлами, без полнокадрового QPixmap)
+        self._background = TiledImageItem(self.image_with_grid)
+        self._background.setZValue(-1)  # Фон ниже надписей
+        self.scene.addItem(self._background)
 
-        # Загружаем надписи из базы
-        for rec in self.names:
-            name = rec["name"]
-            rec_type = rec["type"]
-            world_x = float(rec["x"])
-            world_y = float(rec["y"])
-            px, py = self.world_to_pixel(world_x, world_y)
+        self.build_index()
+        view = self.map_tab.view
+        view.view_changed.connect(self._refresh_timer.start)
+        self.refresh_visible()
+        if self.log_func:
+            self.log_func(f"Режим редактирования: {len(self.names)} надписей в индексе, "
+                          f"создано элементов: {len(self.editable_items)}")
 
-            settings = self.type_settings.get(rec_type, {"font_size": 12, "font_color": (0, 0, 0, 255)})
-            font_size = settings["font_size"]
-
-            # Создаём текстовый элемент
-            text_item = QGraphicsTextItem(name)
-            text_item.setFont(QFont("Arial", int(font_size * 0.6)))  # Уменьшаем шрифт
-            text_item.setDefaultTextColor(QColor(*settings["font_color"]))
-            text_item.setPos(px, py)
-            text_item.setFlag(QGraphicsTextItem.ItemIsSelectable, True)
-            text_item.setFlag(QGraphicsTextItem.ItemIsMovable, False)
-            text_item.rec_id = rec["id"]  # Уникальный ID из базы
-            text_item.setZValue(1)  # Надпись поверх фона
+    def build_index(self):
+        """Пиксельные позиции всех записей и сетка ячеек BUCKET_SIZE для поиска по области."""
+        self._index_of = {rec["id"]: i for i, rec in enumerate(self.names)}
+        world = np.array([self.modified_items.get(rec["id"], (rec["x"], rec["y"])) for rec in self.names],
+                         dtype=np.float64).reshape(-1, 2)
+        px, py = coords.world_to_pixel(world[:, 0], world[:, 1], (self.global_width, self.global_height),
+                                       self.origin, self.scale)
+        positions = np.column_stack((px, py))
+        self._positions = positions
+        self._buckets = {}
+        cells = np.floor(positions / BUCKET_SIZE).astype(np.int64)
+        for i, (bx, by) in enumerate(cells.tolist()):
+            self._buckets.setdefault((bx, by), set()).add(i)
 
-            if self.log_func:
-                self.log_func(f"Создаётся надпись '{name}' с boundingRect: {text_item.boundingRect()} и pos: {text_item.pos()}")
+    def query(self, x0, y0, x1, y1):
+        """Номера записей, чья точка привязки лежит в прямоугольнике (пиксели карты)."""
+        bx0, by0 = int(x0 // BUCKET_SIZE), int(y0 // BUCKET_SIZE)
+        bx1, by1 = int(x1 // BUCKET_SIZE), int(y1 // BUCKET_SIZE)
+        found = []
+        for bx in range(bx0, bx1 + 1):
+            for by in range(by0, by1 + 1):
+                bucket = self._buckets.get((bx, by))
+                if bucket:
+                    found.extend(bucket)
+        if not found:
+            return []
+        found = np.fromiter(found, dtype=np.int64, count=len(found))
+        pts = self._positions[found]
+        inside = (pts[:, 0] >= x0) & (pts[:, 0] <= x1) & (pts[:, 1] >= y0) & (pts[:, 1] <= y1)
+        return found[inside].tolist()
 
-            # Создаём рамку как дочерний элемент (изначально скрыта)
-            bbox = text_item.boundingRect()
-            rect_item = QGraphicsRectItem(bbox)
-            rect_item.setPen(QPen(Qt.NoPen))  # Без обводки по умолчанию
-            rect_item.setBrush(QBrush(Qt.NoBrush))
-            rect_item.setZValue(2)  # Рамка выше надписи
-            rect_item.setParentItem(text_item)  # Привязываем к надписи
-            rect_item.setAcceptedMouseButtons(Qt.NoButton)  # Отключаем прием событий мыши для рамки
+    def refresh_visible(self):
+        """Подгоняет набор элементов под видимую область окна с запасом VIEW_MARGIN."""
+        if not self.is_editing:
+            return
+        view = self.map_tab.view
+        rect = view.mapToScene(view.viewport().rect()).boundingRect()
+        dx, dy = rect.width() * VIEW_MARGIN, rect.height() * VIEW_MARGIN
+        # Надпись тянется вправо-вниз от точки привязки, поэтому слева и сверху запас шире
+        wanted = self.query(rect.left() - dx - self._max_label_size[0], rect.top() - dy - self._max_label_size[1],
+                            rect.right() + dx, rect.bottom() + dy)
+        if len(wanted) > MAX_LIVE_ITEMS:
+            debug = debug_logger(self.log_func)
+            if debug:
+                debug(f"В области {len(wanted)} надписей, показаны первые {MAX_LIVE_ITEMS}")
+            wanted = wanted[:MAX_LIVE_ITEMS]
+        wanted_ids = {self.names[i]["id"] for i in wanted}
 
-            self.scene.addItem(text_item)
-            self.editable_items[rec["id"]] = text_item
+        for rec_id in [rec_id for rec_id in self.editable_items if rec_id not in wanted_ids]:
+            item = self.editable_items[rec_id]
+            if item is self.selected_item:
+                continue  # Выбранную надпись не отдаём, пока её тащат или она подсвечена
+            del self.editable_items[rec_id]
+            item.hide()
+            self._free_items.append(item)
+        for i in wanted:
+            if self.names[i]["id"] not in self.editable_items:
+                self._bind_item(self._take_item(), i)
 
-            if self.log_func:
-                self.log_func(f"Добавлена надпись: id={rec['id']}, текст='{name}', pos=({px}, {py})")
+    def _take_item(self):
+        if self._free_items:
+            return self._free_items.pop()
+        text_item = QGraphicsTextItem()
+        text_item.setFlag(QGraphicsTextItem.ItemIsSelectable, True)
+        text_item.setFlag(QGraphicsTextItem.ItemIsMovable, False)
+        text_item.setZValue(1)  # Надпись поверх фона
+        # Рамка – дочерний элемент (изначально скрыта)
+        rect_item = QGraphicsRectItem()
+        rect_item.setPen(QPen(Qt.NoPen))  # Без обводки по умолчанию
+        rect_item.setBrush(QBrush(Qt.NoBrush))
+        rect_item.setZValue(2)  # Рамка выше надписи
+        rect_item.setParentItem(text_item)  # Привязываем к надписи
+        rect_item.setAcceptedMouseButtons(Qt.NoButton)  # Отключаем прием событий мыши для рамки
+        text_item.frame = rect_item
+        self.scene.addItem(text_item)
+        return text_item
+
+    def _font_for(self, rec_type):
+        entry = self._fonts.get(rec_type)
+        if entry is None:
+            settings = self.type_settings.get(rec_type, {"font_size": 12, "font_color": (0, 0, 0, 255)})
+            entry = (QFont("Arial", int(settings["font_size"] * 0.6)), QColor(*settings["font_color"]))  # Уменьшаем шрифт
+            self._fonts[rec_type] = entry
+        return entry
+
+    def _bind_item(self, text_item, i):
+        rec = self.names[i]
+        font, color = self._font_for(rec["type"])
+        text_item.setPlainText(rec["name"])
+        text_item.setFont(font)
+        text_item.setDefaultTextColor(color)
+        text_item.setPos(*self._positions[i])
+        text_item.rec_id = rec["id"]  # Уникальный ID из базы
+        bbox = text_item.boundingRect()
+        text_item.frame.setRect(bbox)
+        text_item.frame.setPen(QPen(Qt.NoPen))
+        text_item.show()
+        self._max_label_size = (max(self._max_label_size[0], bbox.width()),
+                                max(self._max_label_size[1], bbox.height()))
+        self.editable_items[rec["id"]] = text_item
+
+    def item_at(self, scene_pos):
+        """Надпись под точкой сцены: кандидаты берутся из индекса, а не перебором элементов сцены."""
+        if not self.is_editing or self._positions is None:
+            return None
+        w, h = self._max_label_size
+        x, y = scene_pos.x(), scene_pos.y()
+        for i in reversed(self.query(x - w, y - h, x, y)):
+            item = self.editable_items.get(self.names[i]["id"])
+            if item is not None and item.sceneBoundingRect().contains(scene_pos):
+                return item
+        # Выбранная надпись могла уехать от точки привязки, записанной в индексе
+        if self.selected_item is not None and self.selected_item.sceneBoundingRect().contains(scene_pos):
+            return self.selected_item
+        return None
 
     def stop_editing(self):
         if not self.is_editing:
             return
         self.is_editing = False
         self.selected_item = None
-        # Скрываем рамки. Оборачиваем в try/except для безопасного доступа к удалённым объектам.
-        for item in list(self.editable_items.values()):
+        self._refresh_timer.stop()
+        try:
+            self.map_tab.view.view_changed.disconnect(self._refresh_timer.start)
+        except TypeError:
+            pass
+        # Убираем слой редактирования. Оборачиваем в try/except для безопасного доступа к удалённым объектам.
+        for item in list(self.editable_items.values()) + self._free_items + [self._background]:
             try:
-                for child in item.childItems():
-                    if isinstance(child, QGraphicsRectItem):
-                        child.setPen(QPen(Qt.NoPen))
+                if item is not None and item.scene() is self.scene:
+                    self.scene.removeItem(item)
             except RuntimeError as e:
                 if self.log_func:
-                    self.log_func(f"Ошибка при скрытии рамки для элемента {item}: {e}")
-        # Перерисовываем карту, чтобы отобразить надписи на новых местах
-        self.map_tab.apply_grid()
+                    self.log_func(f"Ошибка при удалении элемента {item}: {e}")
+        self.editable_items.clear()
+        self._free_items = []
+        self._background = None
+        # Перерисовываем только области, где надписи были или оказались; если это невозможно
+        # (карта перерисовывается, сменились настройки или база менялась не отсюда) – полная отрисовка
+        if not self.redraw_dirty():
+            self.map_tab.apply_grid()
         if self.log_func:
             self.log_func("Режим редактирования завершён")
 
+    def redraw_dirty(self):
+        map_tab = self.map_tab
+        map_item = map_tab.map_item
+        # Карта дорисовывается на месте: не во время её отрисовки и не пока её сохраняет экспорт
+        busy = map_tab.render_worker.busy_channels()
+        if map_item is None or any(c == "grid" or c.startswith("export:") for c in busy):
+            return False
+        if get_db_revision(self.db_path) != self._revision:
+            return False
+        # Рамки надписей посчитаны по настройкам и карте, с которыми создан редактор
+        params = map_tab.map_settings_tab.get_parameters()
+        if map_tab.map_store is not self.image_without_names or not render_params_equal(params, self.params):
+            return False
+        start = time.perf_counter()
+        updated = []
+        if self.dirty_boxes:
+            updated = map_tab.render_pipeline.patch_names(
+                map_tab.map_store, params, self._base_revision, self.dirty_boxes,
+                composite=map_tab.processed_map, log_func=self.log_func
+            )
+            if updated is None:
+                return False
+        try:
+            map_item.show()
+            for left, top, right, bottom in updated:
+                map_item.invalidate(QRectF(left, top, right - left, bottom - top))
+        except RuntimeError:
+            return False  # Элемент карты удалён вместе со сценой
+        self.dirty_boxes = []
+        if self.log_func and updated:
+            self.log_func(f"Карта обновлена по {len(updated)} областям за "
+                          f"{(time.perf_counter() - start) * 1000:.0f} мс")
+        return True
+
     def select_item(self, item):
-        if self.is_editing and item in self.editable_items.values():
+        if self.is_editing and self.editable_items.get(getattr(item, "rec_id", None)) is item:
             if self.selected_item == item:
                 return
             # Сбрасываем предыдущий выбор
             if self.selected_item:
                 self.selected_item.setFlag(QGraphicsTextItem.ItemIsMovable, False)
-                for child in self.selected_item.childItems():
-                    if isinstance(child, QGraphicsRectItem):
-                        child.setPen(QPen(Qt.NoPen))
+                self.selected_item.frame.setPen(QPen(Qt.NoPen))
             self.selected_item = item
             self.selected_item.setFlag(QGraphicsTextItem.ItemIsMovable, True)
             # Показываем рамку
-            for child in self.selected_item.childItems():
-                if isinstance(child, QGraphicsRectItem):
-                    child.setPen(QPen(QColor(255, 0, 0, 255), 2))
+            self.selected_item.frame.setPen(QPen(QColor(255, 0, 0, 255), 2))
             if self.log_func:
                 self.log_func(f"Выбрана надпись: id={item.rec_id}, текст='{item.toPlainText()}', pos={item.pos()}")
 
@@ -117,29 +280,68 @@ class NameEditor:
             new_pos = item.pos()
             world_x, world_y = self.pixel_to_world(new_pos.x(), new_pos.y())
             self.modified_items[item.rec_id] = (world_x, world_y)
-            if self.log_func:
-                self.log_func(f"Надпись перемещена: id={item.rec_id}, новые координаты=({world_x:.2f}, {world_y:.2f})")
+            self._move_in_index(item.rec_id, new_pos.x(), new_pos.y())
+            debug = debug_logger(self.log_func)
+            if debug:
+                debug(f"Надпись перемещена: id={item.rec_id}, новые координаты=({world_x:.2f}, {world_y:.2f})")
+
+    def _move_in_index(self, rec_id, px, py):
+        i = self._index_of.get(rec_id)
+        if i is None or self._positions is None:
+            return
+        old_cell = tuple(int(v) for v in np.floor(self._positions[i] / BUCKET_SIZE))
+        self._positions[i] = (px, py)
+        new_cell = (int(px // BUCKET_SIZE), int(py // BUCKET_SIZE))
+        if new_cell != old_cell:
+            self._buckets.get(old_cell, set()).discard(i)
+            self._buckets.setdefault(new_cell, set()).add(i)
 
     def save_changes(self):
         if not self.modified_items:
             if self.log_func:
                 self.log_func("Нет изменений для сохранения")
             return
-        for rec_id, (world_x, world_y) in self.modified_items.items():
-            update_name_position(self.db_path, rec_id, world_x, world_y, self.log_func)
+        old_positions = {rec["id"]: (float(rec["x"]), float(rec["y"])) for rec in self.names}
+        # Все правки – одной транзакцией; в ответ приходят id, чья позиция действительно изменилась
+        changed_ids = update_name_positions(
+            self.db_path,
+            [(rec_id, world_x, world_y) for rec_id, (world_x, world_y) in self.modified_items.items()],
+            self.log_func
+        )
+        changed_points = []
+        moved = []
+        records = {rec["id"]: rec for rec in self.names}
+        for rec_id in changed_ids:
+            if rec_id in old_positions:
+                changed_points.append(old_positions[rec_id])
+                moved.append(dict(records[rec_id], x=old_positions[rec_id][0], y=old_positions[rec_id][1]))
+            changed_points.append(self.modified_items[rec_id])
+            if rec_id in records:
+                moved.append(dict(records[rec_id], x=self.modified_items[rec_id][0], y=self.modified_items[rec_id][1]))
+        # Рамки спрайтов на готовой карте до и после переноса – их и нужно перерисовать
+        self.dirty_boxes.extend(label_boxes(moved, (self.global_width, self.global_height),
+                                            self.type_settings, self.origin, self.scale))
+        for rec in self.names:
+            if rec["id"] in self.modified_items:
+                rec["x"], rec["y"] = self.modified_items[rec["id"]]
         self.modified_items.clear()
+        if changed_ids:
+            self._revision = get_db_revision(self.db_path)
+        # Сбрасываем в кэше только участки, где надпись была или оказалась
+        region_cache = getattr(self.map_tab, "region_cache", None)
+        if region_cache is not None and changed_points:
+            removed = region_cache.invalidate_points(changed_points, self._revision)
+            if self.log_func:
+                self.log_func(f"Сброшено участков в кэше: {removed}")
         if self.log_func:
             self.log_func("Изменения сохранены в базу")
 
     def world_to_pixel(self, world_x, world_y):
-        if self.origin == "bottom-left":
-            px = world_x * self.scale
-            py = self.global_height - world_y * self.scale
-        # Добавьте другие варианты origin, если используются
-        return px, py
+        px, py = coords.world_to_pixel(world_x, world_y, (self.global_width, self.global_height),
+                                       self.origin, self.scale)
+        return float(px), float(py)
 
     def pixel_to_world(self, px, py):
-        if self.origin == "bottom-left":
-            world_x = px / self.scale
-            world_y = (self.global_height - py) / self.scale
-        return world_x, world_y
+        world_x, world_y = coords.pixel_to_world(px, py, (self.global_width, self.global_height),
+                                                 self.origin, self.scale)
+        return float(world_x), float(world_y)
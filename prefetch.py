@@ -0,0 +1,105 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from map_processing import normalize_params, region_geometry
+from region_cache import region_key, render_region_cached
+
+# Порядок упреждающей отрисовки: сначала соседи по сторонам, затем по диагоналям
+NEIGHBOURS = ((1, 0), (-1, 0), (0, 1), (0, -1), (1, 1), (-1, 1), (1, -1), (-1, -1))
+
+
+def _lower_priority():
+    # В Linux nice действует на отдельный поток: фоновая отрисовка уступает процессор запросам
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 10)
+    except (AttributeError, OSError):
+        pass
+
+
+class RegionPrefetcher:
+    """
+    Упреждающая отрисовка участков: после каждого запрошенного участка в фоне рисуются
+    8 соседних (центры в соседних ячейках, тот же n_cells и настройки) и кладутся в общий
+    RegionCache, ограниченный по памяти и диску. Следующий шаг при обходе карты по ячейкам
+    берётся из кэша.
+    Новый вызов schedule() отменяет ещё не начатые задачи прежнего: при смене настроек
+    они бесполезны, а при смене центра важнее соседи нового.
+    """
+
+    def __init__(self, region_cache, db_path, workers=1, log_func=None):
+        self.region_cache = region_cache
+        self.db_path = db_path
+        self.log_func = log_func
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch",
+                                            initializer=_lower_priority)
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._in_flight = {}  # ключ участка -> threading.Event, выставляемый по готовности
+        self.rendered = 0
+        self.skipped = 0
+        self.cancelled = 0
+
+    def schedule(self, source, map_hash, params, center_cell, n_cells):
+        """Ставит в очередь соседей участка center_cell; возвращает их число."""
+        params = normalize_params(params)
+        output_resolution = params["output_resolution"]
+        interval = params["pixels_per_100m"] * output_resolution[0] / source.size[0]
+        _, _, total_cols, total_rows, _ = region_geometry(
+            output_resolution, center_cell, n_cells, interval, params["origin"])
+        with self._lock:
+            self._generation += 1
+            generation = self._generation
+        col, row = center_cell
+        queued = 0
+        for dc, dr in NEIGHBOURS:
+            cell = (col + dc, row + dr)
+            if not (0 <= cell[0] < total_cols and 0 <= cell[1] < total_rows):
+                continue
+            # Наличие в кэше проверяет сама задача: schedule не ждёт замка кэша
+            key = region_key(map_hash, params, cell, n_cells)
+            self._executor.submit(self._run, generation, key, source, map_hash, params, cell, n_cells)
+            queued += 1
+        return queued
+
+    def cancel(self):
+        """Отменяет все ещё не начатые задачи (например, после смены настроек или карты)."""
+        with self._lock:
+            self._generation += 1
+
+    def wait(self, key, timeout=None):
+        """Если участок key сейчас рисуется в фоне, дожидается его, чтобы не рисовать второй раз."""
+        with self._lock:
+            event = self._in_flight.get(key)
+        if event is not None:
+            event.wait(timeout)
+
+    def stats(self):
+        return {"rendered": self.rendered, "skipped": self.skipped, "cancelled": self.cancelled,
+                "in_flight": len(self._in_flight)}
+
+    def shutdown(self):
+        self.cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, generation, key, source, map_hash, params, cell, n_cells):
+        with self._lock:
+            if generation != self._generation:
+                self.cancelled += 1
+                return
+            if key in self._in_flight:
+                return
+            event = self._in_flight[key] = threading.Event()
+        try:
+            if self.region_cache.contains(key):
+                self.skipped += 1
+                return
+            render_region_cached(self.region_cache, source, map_hash, params, self.db_path, cell, n_cells)
+            self.rendered += 1
+        except Exception as e:
+            if self.log_func:
+                self.log_func(f"Ошибка упреждающей отрисовки участка {cell}: {e}")
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            event.set()
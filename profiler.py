@@ -0,0 +1,127 @@
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+# Профилирование выключено по умолчанию: обёртка тогда сводится к проверке одного флага
+_enabled = False
+_lock = threading.Lock()
+# (имя, начало, длительность, собственное время, глубина, поток, пиксели, байты, попадания в кэши)
+_events = deque(maxlen=20000)
+_counters = {}  # имя счётчика -> функция без аргументов, возвращающая текущее значение
+_t0 = time.perf_counter()
+# Стек вложенных стадий текущего потока: суммарная длительность уже завершённых дочерних вызовов
+_local = threading.local()
+
+
+def enable(flag=True):
+    global _enabled
+    _enabled = flag
+
+
+def is_enabled():
+    return _enabled
+
+
+def clear():
+    with _lock:
+        _events.clear()
+
+
+def register_counter(name, func):
+    """Регистрирует счётчик (например, попадания в кэш), приращение которого пишется для каждого вызова."""
+    _counters[name] = func
+
+
+def _measure(value):
+    """(пиксели, байты) результата: изображение или кортеж с изображением первым."""
+    image = value[0] if isinstance(value, tuple) and value else value
+    size = getattr(image, "size", None)
+    if isinstance(size, tuple) and len(size) == 2:
+        pixels = size[0] * size[1]
+        return pixels, pixels * len(getattr(image, "mode", "RGBA"))
+    return 0, 0
+
+
+def profiled(name=None):
+    """
+    Декоратор стадии: при включённом профилировании пишет длительность, число пикселей
+    результата, оценку выделенной под него памяти и приращения зарегистрированных счётчиков.
+    Стадии могут вкладываться (render_region вызывает draw_grid_region и draw_names): для каждой
+    пишется и собственное время без вложенных стадий, и глубина вложенности.
+    """
+    def decorator(func):
+        stage = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            stack = getattr(_local, "stack", None)
+            if stack is None:
+                stack = _local.stack = []
+            before = {key: counter() for key, counter in _counters.items()}
+            stack.append(0.0)
+            start = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            finally:
+                duration = time.perf_counter() - start
+                children = stack.pop()
+                if stack:
+                    stack[-1] += duration
+            pixels, nbytes = _measure(result)
+            deltas = {key: counter() - before[key] for key, counter in _counters.items()}
+            with _lock:
+                _events.append((stage, start - _t0, duration, duration - children, len(stack),
+                                threading.get_ident(), pixels, nbytes, deltas))
+            return result
+        return wrapper
+    return decorator
+
+
+def events():
+    with _lock:
+        return list(_events)
+
+
+def summary():
+    """
+    Сводка по стадиям: {стадия: {"calls", "total", "self", "mean", "max", "nested", "pixels", "bytes", <счётчики>}}.
+    total включает вложенные стадии, поэтому по стадиям не суммируется; self – без них.
+    nested – сколько вызовов стадии пришлось внутри другой стадии.
+    """
+    result = {}
+    for stage, _, duration, self_time, depth, _, pixels, nbytes, deltas in events():
+        row = result.setdefault(stage, {"calls": 0, "total": 0.0, "self": 0.0, "max": 0.0, "nested": 0,
+                                        "pixels": 0, "bytes": 0})
+        row["calls"] += 1
+        row["total"] += duration
+        row["self"] += self_time
+        row["nested"] += depth > 0
+        row["max"] = max(row["max"], duration)
+        row["pixels"] += pixels
+        row["bytes"] += nbytes
+        for key, delta in deltas.items():
+            row[key] = row.get(key, 0) + delta
+    for row in result.values():
+        row["mean"] = row["total"] / row["calls"]
+    return result
+
+
+def export_chrome_trace(file_path):
+    """Сохраняет события в формате Chrome trace (chrome://tracing, Perfetto)."""
+    pid = os.getpid()
+    trace = [
+        {
+            "name": stage, "cat": "render", "ph": "X", "pid": pid, "tid": tid,
+            "ts": round(start * 1e6, 1), "dur": round(duration * 1e6, 1),
+            "args": dict(pixels=pixels, bytes=nbytes, self_ms=round(self_time * 1000, 3), **deltas),
+        }
+        for stage, start, duration, self_time, _, tid, pixels, nbytes, deltas in events()
+    ]
+    with open(file_path, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, f)
+    return len(trace)
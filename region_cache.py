@@ -0,0 +1,222 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from PIL import Image
+
+from db_handler import get_db_revision
+from map_processing import box_to_world, normalize_params, render_region
+from profiler import profiled
+
+CACHE_DIR = os.path.join("cache", "regions")
+
+# Параметры get_parameters(), от которых зависит картинка участка
+RENDER_PARAM_KEYS = (
+    "output_resolution", "pixels_per_100m", "grid_thickness_100", "grid_thickness_1km",
+    "margin", "color_100", "color_1km", "font_size", "font_color", "font_path",
+    "origin", "label_mode_h", "label_mode_v", "name_settings",
+)
+
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    file TEXT,
+    size INTEGER,
+    last_access REAL,
+    crop_box TEXT,
+    xmin REAL, ymin REAL, xmax REAL, ymax REAL
+);
+CREATE TABLE IF NOT EXISTS state (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def region_key(map_hash, params, center_cell, n_cells):
+    """Ключ участка: хэш карты, значимые параметры отрисовки, центр и размер."""
+    params = normalize_params(params)
+    relevant = {k: params.get(k) for k in RENDER_PARAM_KEYS}
+    raw = json.dumps([map_hash, relevant, list(center_cell), n_cells], sort_keys=True, default=list)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class RegionCache:
+    """
+    Кэш отрисованных участков: маленький LRU в памяти поверх LRU на диске с ограничением по размеру.
+    Для каждой записи хранятся мировые границы участка, чтобы при правке названия
+    сбрасывать только участки, которые его содержат.
+    Ревизия базы названий хранится в самом кэше: если база изменилась в обход кэша, он очищается целиком.
+    Возвращаемые изображения общие для всех вызывающих и не должны изменяться.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_disk_bytes=512 * 1024 * 1024, max_memory_items=64):
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.max_memory_items = max_memory_items
+        self._memory = OrderedDict()  # key -> (image, crop_box)
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(cache_dir, "index.db"), check_same_thread=False)
+        self._conn.executescript(INDEX_SCHEMA)
+        self._conn.commit()
+
+    def get(self, key):
+        """Возвращает (изображение, crop_box) или None."""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return entry
+            row = self._conn.execute("SELECT file, crop_box FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            path = os.path.join(self.cache_dir, row[0])
+            try:
+                with Image.open(path) as im:
+                    image = im.convert("RGBA")
+            except OSError:
+                self._delete(key, row[0])
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            entry = (image, tuple(json.loads(row[1])))
+            self._remember(key, entry)
+            self.hits += 1
+            return entry
+
+    def contains(self, key):
+        """Есть ли участок в кэше; изображение не читается, счётчики попаданий не меняются."""
+        with self._lock:
+            if key in self._memory:
+                return True
+            return self._conn.execute("SELECT 1 FROM entries WHERE key = ?", (key,)).fetchone() is not None
+
+    def put(self, key, image, crop_box, world_box, revision=None):
+        """
+        Сохраняет участок в обоих уровнях. world_box = (xmin, ymin, xmax, ymax) в метрах.
+        revision - ревизия базы, с которой участок начинали рисовать: если за время отрисовки
+        кэш принял более новую ревизию (invalidate_points после правки), участок может содержать
+        старые названия и не сохраняется. Возвращает True, если участок сохранён.
+        """
+        with self._lock:
+            if revision is not None and self._revision() != revision:
+                return False
+            self._remember(key, (image, tuple(crop_box)))
+            file_name = f"{key}.png"
+            path = os.path.join(self.cache_dir, file_name)
+            image.save(path, format="PNG", compress_level=1)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (key, file, size, last_access, crop_box, xmin, ymin, xmax, ymax) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, file_name, os.path.getsize(path), time.time(), json.dumps(list(crop_box)), *world_box)
+            )
+            self._conn.commit()
+            self._evict_disk()
+            return True
+
+    def sync_db_revision(self, revision):
+        """Проверяет ревизию базы названий; при расхождении сбрасывает весь кэш."""
+        with self._lock:
+            current = self._revision()
+            if current == revision:
+                return
+            if current is not None:
+                self.clear()
+            self._set_revision(revision)
+
+    def invalidate_points(self, points, revision):
+        """
+        Сбрасывает участки, содержащие любую из точек (world_x, world_y), и принимает новую ревизию базы.
+        Вызывается после правки названий: передаются старые и новые позиции.
+        Возвращает число сброшенных участков.
+        """
+        removed = 0
+        with self._lock:
+            for x, y in points:
+                rows = self._conn.execute(
+                    "SELECT key, file FROM entries WHERE xmin <= ? AND xmax >= ? AND ymin <= ? AND ymax >= ?",
+                    (x, x, y, y)
+                ).fetchall()
+                for key, file_name in rows:
+                    self._delete(key, file_name)
+                    removed += 1
+            self._set_revision(revision)
+        return removed
+
+    def clear(self):
+        with self._lock:
+            for key, file_name in self._conn.execute("SELECT key, file FROM entries").fetchall():
+                self._delete(key, file_name)
+            self._memory.clear()
+
+    def _revision(self):
+        row = self._conn.execute("SELECT value FROM state WHERE key = 'db_revision'").fetchone()
+        return int(row[0]) if row is not None else None
+
+    def _set_revision(self, revision):
+        self._conn.execute("INSERT OR REPLACE INTO state (key, value) VALUES ('db_revision', ?)", (str(revision),))
+        self._conn.commit()
+
+    def _remember(self, key, entry):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def _delete(self, key, file_name):
+        self._memory.pop(key, None)
+        self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+        self._conn.commit()
+        try:
+            os.remove(os.path.join(self.cache_dir, file_name))
+        except OSError:
+            pass
+
+    def _evict_disk(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_disk_bytes:
+            return
+        for key, file_name, size in self._conn.execute(
+                "SELECT key, file, size FROM entries ORDER BY last_access").fetchall():
+            if total <= self.max_disk_bytes:
+                break
+            self._delete(key, file_name)
+            total -= size
+
+
+@profiled()
+def render_region_cached(cache, source, map_hash, params, db_path, center_cell=None, n_cells=None, log_func=None):
+    """
+    render_region с кэшем: повторный запрос того же участка с теми же настройками
+    отдаётся из памяти или с диска без перерисовки.
+    """
+    if center_cell is None:
+        center_cell = (params["center_col"], params["center_row"])
+    if n_cells is None:
+        n_cells = params["n_cells"]
+    # Ревизия запоминается до отрисовки: если база изменится, пока участок рисуется, он не попадёт в кэш
+    revision = get_db_revision(db_path)
+    cache.sync_db_revision(revision)
+    key = region_key(map_hash, params, center_cell, n_cells)
+    entry = cache.get(key)
+    if entry is not None:
+        if log_func:
+            log_func(f"Участок {center_cell} (n={n_cells}) взят из кэша")
+        return entry
+    image, crop_box = render_region(source, params, db_path, center_cell, n_cells, log_func)
+    output_resolution = params["output_resolution"]
+    scale = output_resolution[0] / source.size[0]
+    world_box = box_to_world(crop_box, output_resolution[0], output_resolution[1], params["origin"], scale)
+    if not cache.put(key, image, crop_box, world_box, revision) and log_func:
+        log_func(f"Участок {center_cell} (n={n_cells}) не сохранён в кэш: база названий изменилась во время отрисовки")
+    return image, crop_box
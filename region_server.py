@@ -0,0 +1,288 @@
+"""
+HTTP-сервис участков карты для LLM-агентов (без GUI).
+
+Пример:
+    python region_server.py maps/chernarus.png --settings last_settings.json --port 8765
+
+Запросы:
+    GET /region?col=68&row=24&n=5&fmt=png|webp|jpg   – изображение участка
+    GET /names?bbox=xmin,ymin,xmax,ymax              – названия в мировых координатах (JSON)
+    GET /health                                      – состояние сервиса (JSON)
+
+HTTP/1.1 с keep-alive; ответы с ETag (If-None-Match -> 304) и потоковой отдачей
+(Transfer-Encoding: chunked), клиентам HTTP/1.0 – с Content-Length. Отрисовка и кодирование
+идут в пуле потоков, цикл событий занят только сетью.
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+from db_handler import get_db_revision, get_names_in_bbox
+from map_processing import normalize_params
+from prefetch import RegionPrefetcher
+from region_cache import RegionCache, region_key, render_region_cached
+from tile_store import TileStore
+
+CHUNK_SIZE = 64 * 1024
+MAX_HEADER_BYTES = 64 * 1024
+KEEP_ALIVE_TIMEOUT = 30
+
+CONTENT_TYPES = {"png": "image/png", "webp": "image/webp", "jpg": "image/jpeg"}
+REASONS = {200: "OK", 304: "Not Modified", 400: "Bad Request", 404: "Not Found",
+           405: "Method Not Allowed", 500: "Internal Server Error"}
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def encode_image(image, fmt):
+    """Кодирует изображение участка в байты выбранного формата."""
+    buf = io.BytesIO()
+    if fmt == "jpg":
+        image.convert("RGB").save(buf, format="JPEG", quality=90)
+    elif fmt == "webp":
+        image.save(buf, format="WEBP", lossless=True, method=2)
+    else:
+        image.save(buf, format="PNG", compress_level=3)
+    return buf.getvalue()
+
+
+class RegionServer:
+    """
+    Обработчик запросов поверх render_region_cached: общий кэш участков,
+    ограниченный пул потоков для отрисовки и кодирования.
+    """
+
+    def __init__(self, store, params, db_path=os.path.join("db", "name.db"), workers=4,
+                 region_cache=None, prefetch=True, log_func=None):
+        self.store = store
+        self.params = normalize_params(params)
+        if not self.params.get("output_resolution"):
+            self.params["output_resolution"] = store.size
+        self.db_path = db_path
+        self.region_cache = region_cache or RegionCache()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="region")
+        # Агент обходит карту по соседним ячейкам: их участки рисуются заранее
+        self.prefetcher = RegionPrefetcher(self.region_cache, db_path, log_func=log_func) if prefetch else None
+        self.log_func = log_func
+        self.started = time.time()
+        self.requests = 0
+
+    async def run_blocking(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    # --- маршруты ---
+
+    async def handle_region(self, query, headers):
+        try:
+            col, row = int(query["col"]), int(query["row"])
+            n_cells = int(query.get("n", self.params.get("n_cells", 5)))
+        except (KeyError, ValueError):
+            raise HttpError(400, "ожидаются целые параметры col, row и необязательный n")
+        fmt = query.get("fmt", "png").lower()
+        if fmt == "jpeg":
+            fmt = "jpg"
+        if fmt not in CONTENT_TYPES:
+            raise HttpError(400, f"неизвестный формат: {fmt}")
+        if n_cells < 0:
+            raise HttpError(400, "n должен быть неотрицательным")
+
+        revision = await self.run_blocking(get_db_revision, self.db_path)
+        key = region_key(self.store.map_hash, self.params, (col, row), n_cells)
+        etag = f'"{key}-{revision}-{fmt}"'
+        if etag in _etags(headers):
+            self.prefetch((col, row), n_cells)
+            return 304, {"ETag": etag}, None
+
+        def render():
+            if self.prefetcher is not None:
+                self.prefetcher.wait(key)
+            image, crop_box = render_region_cached(
+                self.region_cache, self.store, self.store.map_hash, self.params, self.db_path,
+                (col, row), n_cells
+            )
+            return encode_image(image, fmt), crop_box
+
+        body, crop_box = await self.run_blocking(render)
+        self.prefetch((col, row), n_cells)
+        return 200, {
+            "Content-Type": CONTENT_TYPES[fmt],
+            "ETag": etag,
+            "X-Crop-Box": ",".join(f"{v:.2f}" for v in crop_box),
+        }, body
+
+    def prefetch(self, center_cell, n_cells):
+        if self.prefetcher is not None:
+            self.prefetcher.schedule(self.store, self.store.map_hash, self.params, center_cell, n_cells)
+
+    async def handle_names(self, query, headers):
+        try:
+            xmin, ymin, xmax, ymax = (float(v) for v in query["bbox"].split(","))
+        except (KeyError, ValueError):
+            raise HttpError(400, "ожидается bbox=xmin,ymin,xmax,ymax в метрах")
+        revision = await self.run_blocking(get_db_revision, self.db_path)
+        etag = f'"names-{revision}-{xmin}-{ymin}-{xmax}-{ymax}"'
+        if etag in _etags(headers):
+            return 304, {"ETag": etag}, None
+        names = await self.run_blocking(get_names_in_bbox, self.db_path, xmin, ymin, xmax, ymax)
+        body = json.dumps({"revision": revision, "names": names}, ensure_ascii=False).encode("utf-8")
+        return 200, {"Content-Type": "application/json; charset=utf-8", "ETag": etag}, body
+
+    async def handle_health(self, query, headers):
+        body = json.dumps({
+            "status": "ok",
+            "map": self.store.source_path,
+            "map_size": list(self.store.size),
+            "output_resolution": list(self.params["output_resolution"]),
+            "uptime": round(time.time() - self.started, 1),
+            "requests": self.requests,
+            "region_cache": {"hits": self.region_cache.hits, "misses": self.region_cache.misses},
+            "prefetch": self.prefetcher.stats() if self.prefetcher is not None else None,
+        }, ensure_ascii=False).encode("utf-8")
+        return 200, {"Content-Type": "application/json; charset=utf-8", "Cache-Control": "no-cache"}, body
+
+    ROUTES = {"/region": handle_region, "/names": handle_names, "/health": handle_health}
+
+    # --- HTTP ---
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), KEEP_ALIVE_TIMEOUT)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except asyncio.LimitOverrunError:
+                    await self.send(writer, 400, {}, b"header too large", keep_alive=False)
+                    break
+                keep_alive = await self.handle_request(head, writer)
+                if not keep_alive:
+                    break
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def handle_request(self, head, writer):
+        self.requests += 1
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, version = lines[0].split(" ", 2)
+        except ValueError:
+            await self.send(writer, 400, {}, b"bad request line", keep_alive=False)
+            return False
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        connection = headers.get("connection", "").lower()
+        keep_alive = connection != "close" if version == "HTTP/1.1" else connection == "keep-alive"
+        # Тела запросов не читаются: после запроса с телом поток не разобрать, соединение закрывается
+        if headers.get("transfer-encoding") or headers.get("content-length", "0").strip() not in ("", "0"):
+            keep_alive = False
+
+        url = urlsplit(target)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        handler = self.ROUTES.get(url.path)
+        start = time.perf_counter()
+        try:
+            if handler is None:
+                raise HttpError(404, f"нет такого ресурса: {url.path}")
+            if method not in ("GET", "HEAD"):
+                raise HttpError(405, "поддерживаются только GET и HEAD")
+            status, extra_headers, body = await handler(self, query, headers)
+        except HttpError as e:
+            status, extra_headers, body = e.status, {"Content-Type": "text/plain; charset=utf-8"}, \
+                str(e).encode("utf-8")
+        except Exception as e:
+            if self.log_func:
+                self.log_func(f"Ошибка обработки {target}: {e}")
+            status, extra_headers, body = 500, {"Content-Type": "text/plain; charset=utf-8"}, \
+                str(e).encode("utf-8")
+        await self.send(writer, status, extra_headers, body, keep_alive, head_only=method == "HEAD",
+                        version=version)
+        if self.log_func:
+            self.log_func(f"{method} {target} -> {status} за {(time.perf_counter() - start) * 1000:.0f} мс")
+        return keep_alive
+
+    async def send(self, writer, status, headers, body, keep_alive=True, head_only=False, version="HTTP/1.1"):
+        """
+        Пишет ответ с ожиданием дренажа сокета. Для HTTP/1.1 тело отдаётся кусками
+        Transfer-Encoding: chunked; HTTP/1.0 chunked не знает, ему – Content-Length и та же версия в ответе.
+        """
+        http10 = version == "HTTP/1.0"
+        lines = [f"{'HTTP/1.0' if http10 else 'HTTP/1.1'} {status} {REASONS.get(status, '')}"]
+        headers = dict(headers)
+        headers["Connection"] = "keep-alive" if keep_alive else "close"
+        if keep_alive:
+            headers["Keep-Alive"] = f"timeout={KEEP_ALIVE_TIMEOUT}"
+        has_body = body is not None and status != 304
+        chunked = has_body and not http10
+        if chunked:
+            headers["Transfer-Encoding"] = "chunked"
+        elif status != 304:
+            headers["Content-Length"] = str(len(body) if has_body else 0)
+        lines += [f"{k}: {v}" for k, v in headers.items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        if has_body and not head_only:
+            view = memoryview(body)
+            for offset in range(0, len(view), CHUNK_SIZE):
+                chunk = view[offset:offset + CHUNK_SIZE]
+                if chunked:
+                    writer.write(b"%x\r\n" % len(chunk))
+                writer.write(chunk)
+                if chunked:
+                    writer.write(b"\r\n")
+                await writer.drain()
+            if chunked:
+                writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+
+def _etags(headers):
+    value = headers.get("if-none-match", "")
+    return {tag.strip() for tag in value.split(",") if tag.strip()}
+
+
+async def serve(server, host="127.0.0.1", port=8765):
+    tcp = await asyncio.start_server(server.handle_connection, host, port, limit=MAX_HEADER_BYTES)
+    if server.log_func:
+        server.log_func(f"Сервис участков слушает http://{host}:{port}")
+    async with tcp:
+        await tcp.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="HTTP-сервис отрисованных участков карты")
+    parser.add_argument("map", help="исходная карта (PNG)")
+    parser.add_argument("--settings", default="last_settings.json", help="файл настроек в формате MapSettingsTab")
+    parser.add_argument("--db", default=os.path.join("db", "name.db"), help="база названий")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=4, help="потоков для отрисовки и кодирования")
+    parser.add_argument("--no-prefetch", action="store_true", help="не рисовать соседние участки заранее")
+    args = parser.parse_args(argv)
+
+    with open(args.settings, encoding="utf-8") as f:
+        params = json.load(f)
+    store = TileStore.open_map(args.map, log_func=print)
+    server = RegionServer(store, params, args.db, args.workers, prefetch=not args.no_prefetch, log_func=print)
+    try:
+        asyncio.run(serve(server, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+import json
+import math
+import os
+
+from db_handler import get_db_revision
+from map_processing import (
+    compose_sprites, draw_grid, layout_names, normalize_params, query_names, DEFAULT_NAME_SETTINGS
+)
+from resize_cache import resized_maps
+
+# Параметры get_parameters(), от которых зависит каждая стадия
+RESIZE_KEYS = ("output_resolution",)
+GRID_KEYS = (
+    "pixels_per_100m", "grid_thickness_100", "grid_thickness_1km", "color_100", "color_1km",
+    "label_mode_h", "label_mode_v", "font_size", "font_path", "font_color", "margin", "origin",
+)
+NAMES_KEYS = ("output_resolution", "origin", "name_settings")
+
+
+def render_params_equal(a, b):
+    """Совпадают ли параметры, от которых зависит полная карта (разрешение, сетка, названия)."""
+    a, b = normalize_params(a), normalize_params(b)
+    return all(a.get(k) == b.get(k) for k in RESIZE_KEYS + GRID_KEYS + NAMES_KEYS)
+
+
+def _stage_key(params, keys, *extra):
+    return json.dumps([[params.get(k) for k in keys], list(extra)], sort_keys=True, default=list)
+
+
+class RenderPipeline:
+    """
+    Поэтапная отрисовка полной карты: resize -> сетка -> раскладка названий -> композиция.
+    Результат каждой стадии запоминается вместе с подмножеством параметров, от которых она зависит,
+    поэтому смена, например, цвета надписей пересчитывает только названия и композицию,
+    а смена цвета сетки не трогает ресэмплинг.
+    Уменьшенную карту конвейер не держит: она нужна только для построения сетки и хранится
+    на диске в ResizeCache, так что после отрисовки в памяти остаются два полнокадровых изображения
+    (сетка и композиция), а не три.
+    """
+
+    def __init__(self, db_path=os.path.join("db", "name.db")):
+        self.db_path = db_path
+        self._stages = {}  # имя стадии -> (ключ, результат)
+
+    def clear(self):
+        self._stages.clear()
+
+    def _cached(self, name, key):
+        entry = self._stages.get(name)
+        if entry is not None and entry[0] == key:
+            return entry[1]
+        return None
+
+    def _store(self, name, key, value):
+        self._stages[name] = (key, value)
+        return value
+
+    def _keys(self, source, params, revision):
+        """Ключи стадий resize, grid и names для нормализованных params и ревизии базы названий."""
+        source_id = getattr(source, "map_hash", None) or id(source)
+        resize_key = _stage_key(params, RESIZE_KEYS, source_id)
+        grid_key = _stage_key(params, GRID_KEYS, resize_key)
+        names_key = _stage_key(params, NAMES_KEYS, source_id, revision)
+        return resize_key, grid_key, names_key
+
+    def render(self, source, params, log_func=None, progress=None):
+        """
+        source – исходная карта (PIL.Image или TileStore), params – словарь как у get_parameters().
+        progress(stage) вызывается перед каждой стадией и может прервать отрисовку исключением;
+        уже посчитанные стадии при этом остаются в кэше.
+        Возвращает (карта только с сеткой, карта с сеткой и названиями).
+        Возвращаемые изображения принадлежат конвейеру и не должны изменяться вызывающим.
+        Композицию на месте меняет только patch_names; кто читает её в фоне (экспорт),
+        не должен совпадать по времени с патчем.
+        """
+        params = normalize_params(params)
+        output_resolution = params["output_resolution"]
+        scale_factor = output_resolution[0] / source.size[0]
+        _, grid_key, names_key = self._keys(source, params, get_db_revision(self.db_path))
+
+        image_with_grid = self._cached("grid", grid_key)
+        if image_with_grid is None:
+            if progress:
+                progress("resize")
+            # Уменьшенная карта берётся из кэша по (хэш карты, размер) или строится от уровня пирамиды;
+            # draw_grid рисует на месте, поэтому сетка строится на копии, общей с кэшем она не станет
+            resized = resized_maps.get(source, output_resolution, log_func).copy()
+            if log_func:
+                log_func(f"Стадия resize: {source.size} -> {output_resolution}")
+            if progress:
+                progress("grid")
+            image_with_grid = self._store("grid", grid_key, draw_grid(
+                resized,
+                params["pixels_per_100m"] * scale_factor,
+                params["grid_thickness_100"],
+                params["grid_thickness_1km"],
+                params["color_100"],
+                params["color_1km"],
+                params.get("label_mode_h", "0"),
+                params.get("label_mode_v", "0"),
+                params["font_size"],
+                params["font_path"],
+                params["font_color"],
+                params["margin"],
+                params["origin"],
+                log_func=log_func
+            ))
+
+        placements = self._cached("names", names_key)
+        if placements is None:
+            if progress:
+                progress("names")
+            names = query_names(self.db_path, image_with_grid.size, params["origin"], scale_factor, log_func=log_func)
+            placements = self._store("names", names_key, layout_names(
+                names,
+                image_with_grid.size,
+                params.get("name_settings", DEFAULT_NAME_SETTINGS),
+                params["origin"],
+                scale=scale_factor,
+                log_func=log_func
+            ))
+            if log_func:
+                log_func(f"Стадия названий: размещено {len(placements)} надписей")
+
+        composite_key = grid_key + names_key
+        processed = self._cached("composite", composite_key)
+        if processed is None:
+            if progress:
+                progress("composite")
+            processed = self._store("composite", composite_key,
+                                    compose_sprites(image_with_grid.copy(), placements))
+            if log_func:
+                log_func("Названия успешно нанесены на карту")
+        return image_with_grid, processed
+
+    def patch_names(self, source, params, base_revision, boxes, composite=None, log_func=None):
+        """
+        Перерисовывает названия только в прямоугольниках boxes (пиксели карты) поверх закэшированной
+        сетки, без полной раскладки и композиции.
+        Применимо, если композиция построена с теми же параметрами при ревизии базы base_revision
+        (и, если задан composite, является именно этим изображением); иначе возвращает None,
+        и нужна полная отрисовка render().
+        Области вставляются в закэшированную композицию на месте: копия всего кадра стоила бы
+        сотни мегабайт на каждое завершение редактирования. Поэтому вызывающий не должен патчить,
+        пока композицию читает фоновая задача (экспорт); полная отрисовка в этом случае
+        строит новую композицию, а старая остаётся экспорту нетронутой.
+        Возвращает список обновлённых прямоугольников (left, top, right, bottom).
+        """
+        params = normalize_params(params)
+        _, grid_key, names_key = self._keys(source, params, base_revision)
+        image_with_grid = self._cached("grid", grid_key)
+        processed = self._cached("composite", grid_key + names_key)
+        if image_with_grid is None or processed is None:
+            return None
+        if composite is not None and processed is not composite:
+            return None
+        width, height = processed.size
+        scale_factor = params["output_resolution"][0] / source.size[0]
+        name_settings = params.get("name_settings", DEFAULT_NAME_SETTINGS)
+        # Спрайт может задеть прямоугольник, даже если его точка привязки снаружи:
+        # запас – наибольший размер надписи на карте
+        placements = self._cached("names", names_key) or []
+        pad = max([max(layer.width, layer.height) for layer, _, _ in placements] +
+                  [max(b[2] - b[0], b[3] - b[1]) for b in boxes] + [0])
+
+        updated = []
+        for box in boxes:
+            left, top = max(0, math.floor(box[0])), max(0, math.floor(box[1]))
+            right, bottom = min(width, math.ceil(box[2])), min(height, math.ceil(box[3]))
+            if right <= left or bottom <= top:
+                continue
+            area = (max(0, left - pad), max(0, top - pad), min(width, right + pad), min(height, bottom + pad))
+            area_size = (area[2] - area[0], area[3] - area[1])
+            names = query_names(self.db_path, area_size, params["origin"], scale_factor, crop_offset=area[:2],
+                                global_width=width, global_height=height, log_func=log_func)
+            # Порядок наложения тот же, что у полной отрисовки (по id)
+            names.sort(key=lambda rec: rec["id"])
+            layout = layout_names(names, area_size, name_settings, params["origin"], scale=scale_factor,
+                                  crop_offset=area[:2], global_width=width, global_height=height, log_func=log_func)
+            patch = image_with_grid.crop((left, top, right, bottom))
+            compose_sprites(patch, [(layer, x + area[0] - left, y + area[1] - top) for layer, x, y in layout])
+            processed.paste(patch, (left, top))
+            updated.append((left, top, right, bottom))
+
+        # Раскладка устарела и будет пересчитана при следующем render(), а исправленная
+        # композиция соответствует уже новой ревизии базы
+        self._stages.pop("names", None)
+        _, _, new_names_key = self._keys(source, params, get_db_revision(self.db_path))
+        self._store("composite", grid_key + new_names_key, processed)
+        if log_func:
+            log_func(f"Названия перерисованы в {len(updated)} областях")
+        return updated
@@ -0,0 +1,162 @@
+import threading
+import traceback
+
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+
+
+class RenderCancelled(Exception):
+    """Отрисовка прервана: пришёл более свежий запрос."""
+
+
+class CancelToken:
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def check(self):
+        if self._event.is_set():
+            raise RenderCancelled()
+
+
+class _JobSignals(QObject):
+    progress = pyqtSignal(int, str)
+    finished = pyqtSignal(int, object)
+    failed = pyqtSignal(int, str)
+
+
+class _RenderJob(QRunnable):
+    def __init__(self, job_id, func, token, signals, log_func):
+        super().__init__()
+        self.job_id = job_id
+        self.func = func
+        self.token = token
+        self.signals = signals
+        self.log_func = log_func
+
+    def run(self):
+        def progress(stage):
+            # Точка прерывания: между стадиями проверяем, не устарел ли запрос
+            self.token.check()
+            self.signals.progress.emit(self.job_id, stage)
+
+        try:
+            result = self.func(progress, self.log_func)
+            self.token.check()
+        except RenderCancelled:
+            self.signals.failed.emit(self.job_id, "")
+        except Exception as e:
+            self.signals.failed.emit(self.job_id, f"{e}\n{traceback.format_exc()}")
+        else:
+            self.signals.finished.emit(self.job_id, result)
+
+
+class _Channel:
+    def __init__(self):
+        self.running = None  # (job_id, token, колбэки)
+        self.pending = None  # (func, колбэки) – только самый свежий запрос
+
+
+class RenderWorker(QObject):
+    """
+    Фоновая отрисовка для GUI. Задачи группируются по каналам ("grid", "region"):
+    в канале одновременно выполняется не больше одной задачи, а из запросов,
+    пришедших за время её работы, выполняется только последний. Текущая задача
+    при этом получает отмену и прерывается на ближайшей стадии.
+    Колбэки вызываются в GUI-потоке. log_func передаётся задачам как есть и должен быть
+    потокобезопасным (например, LogSink.append).
+    """
+
+    def __init__(self, log_func=None, max_threads=2, parent=None):
+        super().__init__(parent)
+        self.log_func = log_func
+        self._pool = QThreadPool(self)
+        self._pool.setMaxThreadCount(max_threads)
+        self._channels = {}
+        self._next_id = 0
+
+    def submit(self, channel, func, on_done, on_failed=None, on_progress=None):
+        """
+        func(progress, log_func) выполняется в фоне; progress(stage) сообщает о стадии
+        и прерывает задачу, если она устарела. on_done(result) получает результат.
+        """
+        state = self._channels.setdefault(channel, _Channel())
+        callbacks = (on_done, on_failed, on_progress)
+        if state.running is not None:
+            state.running[1].cancel()
+            state.pending = (func, callbacks)
+            return
+        self._start(channel, state, func, callbacks)
+
+    def cancel(self, channel):
+        state = self._channels.get(channel)
+        if state is None:
+            return
+        state.pending = None
+        if state.running is not None:
+            state.running[1].cancel()
+
+    def is_busy(self, channel=None):
+        channels = [self._channels.get(channel)] if channel else self._channels.values()
+        return any(s is not None and (s.running or s.pending) for s in channels)
+
+    def busy_channels(self):
+        """Каналы, в которых задача выполняется или ждёт очереди."""
+        return [name for name, s in self._channels.items() if s.running or s.pending]
+
+    def wait(self, msecs=-1):
+        return self._pool.waitForDone(msecs)
+
+    def _start(self, channel, state, func, callbacks):
+        self._next_id += 1
+        job_id = self._next_id
+        token = CancelToken()
+        state.running = (job_id, token, callbacks)
+        signals = _JobSignals()
+        signals.progress.connect(lambda jid, stage: self._on_progress(state, jid, stage))
+        signals.finished.connect(lambda jid, result: self._on_finished(channel, state, jid, result))
+        signals.failed.connect(lambda jid, error: self._on_failed(channel, state, jid, error))
+        job = _RenderJob(job_id, func, token, signals, self.log_func)
+        job.signals_ref = signals  # сигналы должны жить до конца задачи
+        self._pool.start(job)
+
+    def _current(self, state, job_id):
+        return state.running is not None and state.running[0] == job_id
+
+    def _on_progress(self, state, job_id, stage):
+        if self._current(state, job_id) and not state.running[1].cancelled:
+            on_progress = state.running[2][2]
+            if on_progress:
+                on_progress(stage)
+
+    def _on_finished(self, channel, state, job_id, result):
+        if not self._current(state, job_id):
+            return
+        token, (on_done, _, _) = state.running[1], state.running[2]
+        state.running = None
+        if not token.cancelled:
+            on_done(result)
+        self._start_pending(channel, state)
+
+    def _on_failed(self, channel, state, job_id, error):
+        if not self._current(state, job_id):
+            return
+        on_failed = state.running[2][1]
+        state.running = None
+        if error:
+            if on_failed:
+                on_failed(error)
+            elif self.log_func:
+                self.log_func(f"Ошибка фоновой отрисовки: {error}")
+        self._start_pending(channel, state)
+
+    def _start_pending(self, channel, state):
+        if state.pending is not None:
+            func, callbacks = state.pending
+            state.pending = None
+            self._start(channel, state, func, callbacks)
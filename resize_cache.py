@@ -0,0 +1,173 @@
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+from profiler import profiled
+
+CACHE_DIR = os.path.join("cache", "resized")
+
+
+@profiled()
+def resize_from_pyramid(source, output_size):
+    """
+    Масштабирует карту до output_size. Для TileStore ресэмплинг начинается с ближайшего
+    более крупного уровня пирамиды (уровни уже уменьшены reduce в 2**n раз), так что финальный
+    Lanczos работает с коэффициентом меньше 2. PIL.Image сначала уменьшается reduce
+    на целый множитель (reducing_gap), затем точный Lanczos.
+    """
+    output_size = tuple(output_size)
+    if not hasattr(source, "best_level"):
+        if source.size == output_size:
+            return source.copy()
+        return source.resize(output_size, resample=Image.LANCZOS, reducing_gap=2.0)
+    scale = min(output_size[0] / source.size[0], output_size[1] / source.size[1])
+    level = source.best_level(scale)
+    image = source.level_image(level)
+    if image.size == output_size:
+        return image
+    # Точная область исходника в пикселях уровня: последний пиксель уровня может быть неполным
+    f = 2 ** level
+    return image.resize(output_size, resample=Image.LANCZOS,
+                        box=(0, 0, source.size[0] / f, source.size[1] / f))
+
+
+class ResizeCache:
+    """
+    Кэш уменьшенных карт по (хэш карты, размер): raw-файлы на диске, которые читаются без
+    декодирования, и необязательный LRU в памяти с ограничением по объёму. Повторный выбор уже
+    использованного разрешения не пересчитывает ресэмплинг даже после перезапуска.
+    Память по умолчанию не используется (max_memory_bytes=0): кадр 15360x15360 занимает около
+    900 МБ, и держать его рядом с сеткой и композицией конвейера дороже, чем перечитать с диска.
+    Возвращаемые изображения могут быть общими и не должны изменяться.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_memory_bytes=0,
+                 max_disk_bytes=4 * 1024 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()  # (хэш, размер) -> изображение
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def get(self, source, output_size, log_func=None):
+        """Уменьшенная карта для source (TileStore или PIL.Image с атрибутом map_hash) или новый ресэмплинг."""
+        output_size = tuple(output_size)
+        map_hash = getattr(source, "map_hash", None)
+        if map_hash is None:
+            return resize_from_pyramid(source, output_size)
+        key = (map_hash, output_size)
+        with self._lock:
+            image = self._memory.get(key)
+            if image is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return image
+
+        path = os.path.join(self.cache_dir, f"{map_hash}_{output_size[0]}x{output_size[1]}.raw")
+        image = self._load(path, output_size)
+        if image is not None:
+            self.disk_hits += 1
+            if log_func:
+                log_func(f"Уменьшенная карта {output_size} прочитана из кэша")
+        else:
+            self.misses += 1
+            start = time.perf_counter()
+            image = resize_from_pyramid(source, output_size)
+            if image.mode != "RGBA":
+                image = image.convert("RGBA")
+            if log_func:
+                log_func(f"Ресэмплинг {source.size} -> {output_size}: {time.perf_counter() - start:.2f} с")
+            self._save(path, image)
+        self._remember(key, image)
+        return image
+
+    def clear(self, disk=False):
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+            if disk and os.path.isdir(self.cache_dir):
+                for name in os.listdir(self.cache_dir):
+                    if name.endswith(".raw"):
+                        os.remove(os.path.join(self.cache_dir, name))
+
+    def stats(self):
+        return {"items": len(self._memory), "bytes": self._memory_bytes,
+                "hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses}
+
+    def _remember(self, key, image):
+        size = image.width * image.height * 4
+        if size > self.max_memory_bytes:
+            return
+        with self._lock:
+            if key not in self._memory:
+                self._memory_bytes += size
+            self._memory[key] = image
+            self._memory.move_to_end(key)
+            while self._memory_bytes > self.max_memory_bytes:
+                _, old = self._memory.popitem(last=False)
+                self._memory_bytes -= old.width * old.height * 4
+
+    def _load(self, path, output_size):
+        try:
+            data = np.fromfile(path, dtype=np.uint8)
+        except OSError:
+            return None
+        if data.size != output_size[0] * output_size[1] * 4:
+            return None
+        try:
+            os.utime(path)  # время доступа для вытеснения
+        except OSError:
+            pass  # файл уже вытеснен другим потоком, прочитанные данные целы
+        return Image.frombuffer("RGBA", output_size, data, "raw", "RGBA", 0, 1)
+
+    def _save(self, path, image):
+        size = image.width * image.height * 4
+        if size > self.max_disk_bytes:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # Сохранение идёт без замка: у каждого писателя свой временный файл, на место он встаёт атомарно
+        fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=self.cache_dir)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.asarray(image).tofile(f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        self._evict_disk()
+
+    def _evict_disk(self):
+        files = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".raw"):
+                full = os.path.join(self.cache_dir, name)
+                try:
+                    st = os.stat(full)
+                except OSError:
+                    continue  # удалён параллельным вытеснением
+                files.append((st.st_mtime, st.st_size, full))
+        total = sum(size for _, size, _ in files)
+        for _, size, full in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(full)
+                total -= size
+            except OSError:
+                pass
+
+
+# Общий для процесса кэш: конвейер GUI и бенчмарк работают с одними и теми же картами
+resized_maps = ResizeCache()
@@ -0,0 +1,63 @@
+import os
+import sqlite3
+import sys
+
+import numpy as np
+import pytest
+from PIL import Image
+
+# Модули проекта лежат в корне репозитория
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db_handler import create_db  # noqa: E402
+
+# Несколько названий разных типов в мировых координатах карты 1000x1000
+NAMES = [
+    ("Черногорск", "NameCity", 250.0, 300.0),
+    ("Электрозаводск", "NameCity", 600.0, 150.0),
+    ("Пуста", "NameVillage", 120.0, 820.0),
+    ("Высота 305", "Hill", 700.0, 640.0),
+    ("Залив", "NameMarine", 880.0, 90.0),
+]
+
+
+@pytest.fixture
+def names_db(tmp_path):
+    db_path = str(tmp_path / "name.db")
+    create_db(db_path)
+    conn = sqlite3.connect(db_path)
+    conn.executemany("INSERT INTO names (name, type, x, y) VALUES (?, ?, ?, ?)", NAMES)
+    conn.commit()
+    conn.close()
+    return db_path
+
+
+@pytest.fixture
+def source_map():
+    rng = np.random.default_rng(0)
+    return Image.fromarray(rng.integers(0, 256, (1000, 1000, 4), dtype=np.uint8), "RGBA")
+
+
+@pytest.fixture
+def render_params():
+    return {
+        "output_resolution": (800, 800),
+        "pixels_per_100m": 100,
+        "grid_thickness_100": 1,
+        "grid_thickness_1km": 3,
+        "margin": 10,
+        "color_100": (98, 98, 98, 130),
+        "color_1km": (42, 42, 42, 130),
+        "font_size": 12,
+        "font_color": (0, 0, 0, 255),
+        "font_path": "",
+        "origin": "bottom-left",
+        "label_mode_h": "0",
+        "label_mode_v": "0",
+        "name_settings": {
+            "NameCity": {"font_size": 14, "font_color": (0, 0, 127, 180)},
+            "NameVillage": {"font_size": 12, "font_color": (56, 56, 56, 255)},
+            "Hill": {"font_size": 12, "font_color": (65, 65, 65, 180)},
+            "NameMarine": {"font_size": 12, "font_color": (0, 128, 128, 180)},
+        },
+    }
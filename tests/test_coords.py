@@ -0,0 +1,26 @@
+import numpy as np
+import pytest
+
+import coords
+
+
+@pytest.mark.parametrize("origin", coords.ORIGINS)
+def test_world_pixel_round_trip(origin):
+    size = (1536, 1024)
+    world_x = np.array([0.0, 12.5, 700.0, 1499.9])
+    world_y = np.array([0.0, 999.0, 333.3, 64.0])
+    for scale, offset in ((1.0, (0, 0)), (1.024, (0, 0)), (0.5, (100, 250))):
+        px, py = coords.world_to_pixel(world_x, world_y, size, origin, scale, offset)
+        back_x, back_y = coords.pixel_to_world(px, py, size, origin, scale, offset)
+        np.testing.assert_allclose(back_x, world_x)
+        np.testing.assert_allclose(back_y, world_y)
+
+
+@pytest.mark.parametrize("origin", coords.ORIGINS)
+def test_cells_to_box_matches_pixel_to_cell(origin):
+    size, interval = (1050, 950), 100
+    left, top, right, bottom = coords.cells_to_box(2, 3, 4, 5, size, origin, interval)
+    assert (right - left, bottom - top) == (300, 300)
+    cols, rows = coords.pixel_to_cell([left + 1, right - 1], [top + 1, bottom - 1], size, origin, interval)
+    assert sorted(cols.tolist()) == [2, 4]
+    assert sorted(rows.tolist()) == [3, 5]
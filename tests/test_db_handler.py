@@ -0,0 +1,35 @@
+import os
+import sqlite3
+
+from db_handler import create_db, get_names_in_bbox
+
+
+def test_names_in_bbox_after_db_recreated(tmp_path):
+    db_path = str(tmp_path / "name.db")
+    create_db(db_path)
+    assert get_names_in_bbox(db_path, 0, 0, 100, 100) == []
+    # Базу удалили и создали заново без индекса: он должен появиться при следующем запросе
+    os.remove(db_path)
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE names (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT, type TEXT, x REAL, y REAL)")
+    conn.execute("INSERT INTO names (name, type, x, y) VALUES ('Черногорск', 'NameCity', 50, 50)")
+    conn.commit()
+    conn.close()
+    assert [rec["name"] for rec in get_names_in_bbox(db_path, 0, 0, 100, 100)] == ["Черногорск"]
+
+
+def test_position_updates_reach_recreated_db(tmp_path):
+    from db_handler import get_names, update_name_positions
+
+    db_path = str(tmp_path / "name.db")
+    for attempt in range(2):
+        if attempt:
+            os.remove(db_path)  # база пересоздана, пока соединение для правок ещё открыто
+        create_db(db_path)
+        conn = sqlite3.connect(db_path)
+        conn.execute("INSERT INTO names (name, type, x, y) VALUES ('Пуста', 'NameVillage', 10, 10)")
+        conn.commit()
+        conn.close()
+        rec_id = get_names(db_path)[0]["id"]
+        assert update_name_positions(db_path, [(rec_id, 20 + attempt, 30)]) == {rec_id}
+        assert (get_names(db_path)[0]["x"], get_names(db_path)[0]["y"]) == (20 + attempt, 30)
@@ -0,0 +1,114 @@
+import math
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import coords
+import map_processing
+from map_processing import draw_grid, draw_grid_region, region_geometry
+
+SIZE = (1050, 950)
+INTERVAL = 100
+MARGIN = 5
+
+
+def _grid_args(origin):
+    return (INTERVAL, 1, 3, (98, 98, 98, 130), (42, 42, 42, 130), "0", "0",
+            12, "", (0, 0, 0, 255), MARGIN, origin)
+
+
+def _labels(monkeypatch, draw, image, *args, **kwargs):
+    """Метки сетки [(ось, номер, центр метки)], перехваченные при отрисовке."""
+    drawn = []
+
+    def record(image, labels, font, font_key, fill):
+        for xy, text in labels:
+            bbox = font.getbbox(text)
+            if xy[1] == MARGIN:
+                drawn.append(("h", int(text), xy[0] + (bbox[2] - bbox[0]) / 2))
+            else:
+                drawn.append(("v", int(text), xy[1] + (bbox[3] - bbox[1]) / 2))
+
+    monkeypatch.setattr(map_processing, "_composite_labels", record)
+    draw(image, *args, **kwargs)
+    return drawn
+
+
+def _check_labels(labels, origin, offset=(0, 0)):
+    """Каждая метка стоит в ячейке со своим номером в нумерации всей карты."""
+    assert labels
+    for axis, number, center in labels:
+        if axis == "h":
+            cols, _ = coords.pixel_to_cell(offset[0] + center, 0, SIZE, origin, INTERVAL)
+            assert int(cols) == number
+        else:
+            _, rows = coords.pixel_to_cell(0, offset[1] + center, SIZE, origin, INTERVAL)
+            assert int(rows) == number
+
+
+@pytest.mark.parametrize("origin", coords.ORIGINS)
+@pytest.mark.parametrize("center_cell", [(2, 2), (0, 0), (9, 8)])
+def test_region_labels_match_full_map(monkeypatch, origin, center_cell):
+    full = _labels(monkeypatch, draw_grid, Image.new("RGBA", SIZE), *_grid_args(origin))
+    _check_labels(full, origin)
+
+    start_col, start_row, _, _, crop_box = region_geometry(SIZE, center_cell, 1, INTERVAL, origin)
+    left, top, right, bottom = crop_box
+    region = Image.new("RGBA", (right - left, bottom - top))
+    labels = _labels(monkeypatch, draw_grid_region, region, *_grid_args(origin),
+                     offset_x=start_col, offset_y=start_row)
+    _check_labels(labels, origin, (left, top))
+    # Участок подписывает ровно те ячейки, что в нём видны на полной карте
+    assert sorted(n for axis, n, _ in labels if axis == "h") == list(range(start_col, start_col + 3))
+    assert sorted(n for axis, n, _ in labels if axis == "v") == list(range(start_row, start_row + 3))
+    full_cols = {n for axis, n, _ in full if axis == "h"}
+    assert {n for axis, n, _ in labels if axis == "h"} <= full_cols
+
+
+def _reference_grid(image, interval, thickness_100, thickness_1km, color_100, color_1km, font_color, origin):
+    """Растеризация сетки до векторизации: линии и метки на полнокадровых слоях ImageDraw."""
+    from PIL import ImageDraw, ImageFont
+
+    width, height = image.size
+    cols, rows = math.ceil(width / interval), math.ceil(height / interval)
+    flip_x, flip_y = origin in ("top-right", "bottom-right"), origin in ("bottom-left", "bottom-right")
+    font = ImageFont.load_default()
+    overlay = Image.new("RGBA", image.size, (0, 0, 0, 0))
+    text_layer = Image.new("RGBA", image.size, (0, 0, 0, 0))
+    draw, draw_text = ImageDraw.Draw(overlay), ImageDraw.Draw(text_layer)
+    for i in range(cols + 1):
+        pos = width - i * interval if flip_x else i * interval
+        km = i % 10 == 0
+        draw.line([(pos, 0), (pos, height)], fill=color_1km if km else color_100,
+                  width=thickness_1km if km else thickness_100)
+    for j in range(rows + 1):
+        pos = height - j * interval if flip_y else j * interval
+        km = j % 10 == 0
+        draw.line([(0, pos), (width, pos)], fill=color_1km if km else color_100,
+                  width=thickness_1km if km else thickness_100)
+    for i in range(cols):
+        cx = width - (i * interval + interval / 2) if flip_x else i * interval + interval / 2
+        bbox = font.getbbox(f"{i:03d}")
+        text_x = max(0, min(width - (bbox[2] - bbox[0]), cx - (bbox[2] - bbox[0]) / 2))
+        draw_text.text((text_x, MARGIN), f"{i:03d}", font=font, fill=font_color)
+    for j in range(rows):
+        cy = height - (j * interval + interval / 2) if flip_y else j * interval + interval / 2
+        bbox = font.getbbox(f"{j:03d}")
+        text_y = max(0, min(height - (bbox[3] - bbox[1]), cy - (bbox[3] - bbox[1]) / 2))
+        draw_text.text((MARGIN, text_y), f"{j:03d}", font=font, fill=font_color)
+    return Image.alpha_composite(Image.alpha_composite(image, overlay), text_layer)
+
+
+@pytest.mark.parametrize("origin", coords.ORIGINS)
+def test_draw_grid_matches_reference_rasterization(origin):
+    rng = np.random.default_rng(1)
+    image = Image.fromarray(rng.integers(0, 256, (SIZE[1], SIZE[0], 4), dtype=np.uint8), "RGBA")
+    expected = _reference_grid(image, INTERVAL, 1, 3, (98, 98, 98, 130), (42, 42, 42, 130), (0, 0, 0, 255), origin)
+    result = draw_grid(image.copy(), *_grid_args(origin))
+    assert np.array_equal(np.asarray(result), np.asarray(expected))
+
+
+def test_draw_grid_draws_on_rgba_input_in_place():
+    image = Image.new("RGBA", SIZE, (255, 255, 255, 255))
+    assert draw_grid(image, *_grid_args("top-left")) is image
@@ -0,0 +1,34 @@
+import time
+
+import pytest
+
+import profiler
+
+
+@pytest.fixture
+def profiling():
+    profiler.clear()
+    profiler.enable()
+    yield
+    profiler.enable(False)
+    profiler.clear()
+
+
+def test_nested_stages_report_self_time(profiling):
+    @profiler.profiled("inner")
+    def inner():
+        time.sleep(0.02)
+
+    @profiler.profiled("outer")
+    def outer():
+        inner()
+        inner()
+
+    outer()
+    summary = profiler.summary()
+    assert summary["inner"]["calls"] == 2 and summary["inner"]["nested"] == 2
+    assert summary["outer"]["nested"] == 0
+    assert summary["outer"]["total"] >= summary["inner"]["total"]
+    # Собственное время внешней стадии не включает вложенные вызовы
+    assert summary["outer"]["self"] < 0.01
+    assert summary["outer"]["self"] + summary["inner"]["self"] == pytest.approx(summary["outer"]["total"])
@@ -0,0 +1,15 @@
+from PIL import Image
+
+from region_cache import RegionCache
+
+
+def test_put_skips_region_rendered_before_edit(tmp_path):
+    cache = RegionCache(str(tmp_path))
+    cache.sync_db_revision(1)
+    image = Image.new("RGBA", (4, 4))
+    # Пока участок рисовался по ревизии 1, правка названий перевела кэш на ревизию 2
+    cache.invalidate_points([(50.0, 50.0)], 2)
+    assert not cache.put("stale", image, (0, 0, 4, 4), (0, 0, 100, 100), revision=1)
+    assert cache.get("stale") is None
+    assert cache.put("fresh", image, (0, 0, 4, 4), (0, 0, 100, 100), revision=2)
+    assert cache.get("fresh") is not None
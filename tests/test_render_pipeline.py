@@ -0,0 +1,43 @@
+import numpy as np
+
+from db_handler import get_db_revision, get_names, update_name_positions
+from map_processing import label_boxes
+from render_pipeline import RenderPipeline
+
+
+def test_patch_names_matches_full_render(names_db, source_map, render_params):
+    pipeline = RenderPipeline(names_db)
+    _, processed = pipeline.render(source_map, render_params)
+    before = np.asarray(processed).copy()
+    base_revision = get_db_revision(names_db)
+
+    scale = render_params["output_resolution"][0] / source_map.size[0]
+    size = render_params["output_resolution"]
+    settings = render_params["name_settings"]
+    moved = [rec for rec in get_names(names_db) if rec["name"] in ("Черногорск", "Высота 305")]
+    new_positions = [(rec["id"], rec["x"] + 60, rec["y"] - 35) for rec in moved]
+    update_name_positions(names_db, new_positions)
+    boxes = label_boxes(moved, size, settings, render_params["origin"], scale)
+    boxes += label_boxes([dict(rec, x=x, y=y) for rec, (_, x, y) in zip(moved, new_positions)],
+                         size, settings, render_params["origin"], scale)
+
+    updated = pipeline.patch_names(source_map, render_params, base_revision, boxes, composite=processed)
+    assert updated
+    # Композиция исправлена на месте, без копии кадра
+    assert not np.array_equal(np.asarray(processed), before)
+    _, fresh = RenderPipeline(names_db).render(source_map, render_params)
+    assert np.array_equal(np.asarray(processed), np.asarray(fresh))
+    # Следующий render() отдаёт уже исправленную композицию
+    assert pipeline.render(source_map, render_params)[1] is processed
+
+
+def test_patch_names_needs_cached_composite(names_db, source_map, render_params):
+    pipeline = RenderPipeline(names_db)
+    revision = get_db_revision(names_db)
+    assert pipeline.patch_names(source_map, render_params, revision, [(0, 0, 10, 10)]) is None
+    _, processed = pipeline.render(source_map, render_params)
+    # Другой кадр или другие настройки: патчить нечего, нужна полная отрисовка
+    assert pipeline.patch_names(source_map, render_params, revision, [(0, 0, 10, 10)],
+                                composite=processed.copy()) is None
+    changed = dict(render_params, color_100=(255, 0, 0, 130))
+    assert pipeline.patch_names(source_map, changed, revision, [(0, 0, 10, 10)]) is None
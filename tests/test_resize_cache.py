@@ -0,0 +1,20 @@
+import os
+import threading
+
+import numpy as np
+from PIL import Image
+
+from resize_cache import ResizeCache
+
+
+def test_concurrent_saves_of_same_entry(tmp_path):
+    cache = ResizeCache(str(tmp_path))
+    image = Image.fromarray(np.full((64, 64, 4), 200, dtype=np.uint8), "RGBA")
+    path = os.path.join(str(tmp_path), "map_64x64.raw")
+    threads = [threading.Thread(target=cache._save, args=(path, image)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(os.listdir(str(tmp_path))) == ["map_64x64.raw"]
+    assert np.array_equal(np.asarray(cache._load(path, (64, 64))), np.asarray(image))
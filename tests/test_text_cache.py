@@ -0,0 +1,29 @@
+import threading
+
+from PIL import ImageFont
+
+import text_cache
+from text_cache import SpriteCache
+
+
+def test_concurrent_misses_count_sprite_once(monkeypatch):
+    cache = SpriteCache()
+    font = ImageFont.load_default()
+    barrier = threading.Barrier(4)
+    render = text_cache.render_sprite
+
+    def slow_render(font, text, fill):
+        # Все потоки промахиваются по одному ключу и рисуют надпись одновременно
+        barrier.wait()
+        return render(font, text, fill)
+
+    monkeypatch.setattr(text_cache, "render_sprite", slow_render)
+    threads = [threading.Thread(target=cache.get, args=(font, ("", 12), "Черногорск", (0, 0, 0, 255)))
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    layer, _ = cache.get(font, ("", 12), "Черногорск", (0, 0, 0, 255))
+    assert cache.stats()["items"] == 1
+    assert cache.stats()["bytes"] == layer.width * layer.height * 4
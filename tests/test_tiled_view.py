@@ -0,0 +1,43 @@
+import numpy as np
+from PIL import Image
+from PyQt5.QtCore import QRectF
+
+from tiled_view import _TileSource
+
+
+def _source():
+    rng = np.random.default_rng(0)
+    return Image.fromarray(rng.integers(0, 256, (1000, 1300, 3), dtype=np.uint8), "RGB")
+
+
+def test_coarse_tiles_are_built_from_finer_level():
+    image = _source()
+    source = _TileSource(image, 64)
+    for level in range(source.level_count):
+        lw, lh = source.level_size(level)
+        cols, rows = source.tile_range(level, QRectF(0, 0, image.width, image.height))
+        for ty in rows:
+            for tx in cols:
+                tile = source._pil_tile(level, tx, ty, 0)
+                assert tile.size == (min(64, lw - tx * 64), min(64, lh - ty * 64))
+    # Верхний уровень совпадает с уменьшением всей карты с точностью до округления
+    # (кроме неполных блоков у края)
+    top = np.asarray(source._pil_tile(source.level_count - 1, 0, 0, 0), dtype=np.int16)
+    direct = np.asarray(image.reduce(2 ** (source.level_count - 1)), dtype=np.int16)
+    assert np.abs(top - direct)[:-1, :-1].max() <= 2
+
+
+def test_forget_drops_cached_tiles_under_changed_area():
+    image = _source()
+    source = _TileSource(image, 64)
+    level = source.level_count - 1
+    before = np.asarray(source._pil_tile(level, 0, 0, 0)).copy()
+    image.paste((255, 0, 0), (0, 0, 400, 400))
+    assert np.array_equal(np.asarray(source._pil_tile(level, 0, 0, 0)), before)
+    source.forget(QRectF(0, 0, 400, 400))
+    assert not np.array_equal(np.asarray(source._pil_tile(level, 0, 0, source._version)), before)
+    # Тайл, начатый до forget, в кэш не попадает
+    stale = source._version
+    source.forget(QRectF(0, 0, 10, 10))
+    source._pil_tile(2, 0, 0, stale)
+    assert (2, 0, 0) not in source._cache
@@ -0,0 +1,128 @@
+import os
+import threading
+from collections import OrderedDict
+
+from PIL import Image, ImageDraw, ImageFont
+
+import profiler
+
+
+class FontRegistry:
+    """
+    Общий для процесса реестр шрифтов: каждая пара (путь, размер) проверяется и загружается один раз.
+    Решение об откате на шрифт по умолчанию тоже кэшируется, поэтому сообщение о нём пишется однажды.
+    """
+
+    def __init__(self):
+        self._fonts = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.fallbacks = 0
+
+    def get(self, font_path, font_size, log_func=None):
+        key = (font_path, font_size)
+        with self._lock:
+            font = self._fonts.get(key)
+            if font is not None:
+                self.hits += 1
+                return font
+            self.misses += 1
+            if not font_path or not os.path.exists(font_path):
+                if log_func:
+                    log_func(f"Шрифт не найден по пути: {font_path}, использую шрифт по умолчанию")
+                font = ImageFont.load_default()
+                self.fallbacks += 1
+            else:
+                try:
+                    font = ImageFont.truetype(font_path, font_size)
+                    if log_func:
+                        log_func(f"Шрифт успешно загружен: size={font_size}, path={font_path}")
+                except Exception as e:
+                    if log_func:
+                        log_func(f"Ошибка загрузки шрифта '{font_path}': {e}, использую шрифт по умолчанию")
+                    font = ImageFont.load_default()
+                    self.fallbacks += 1
+            self._fonts[key] = font
+            return font
+
+    def clear(self):
+        with self._lock:
+            self._fonts.clear()
+
+    def stats(self):
+        return {"items": len(self._fonts), "hits": self.hits, "misses": self.misses, "fallbacks": self.fallbacks}
+
+
+class SpriteCache:
+    """
+    Кэш отрисованных надписей: (шрифт, размер, цвет, текст) -> RGBA-спрайт и смещение его рамки
+    относительно точки привязки текста. Отрисовка надписи сводится к наложению готового спрайта.
+    Размер ограничен по суммарному объёму пикселей, вытесняются давно не использованные спрайты.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._sprites = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, font, font_key, text, fill):
+        """
+        Возвращает (спрайт, (dx, dy)) или None для пустой надписи.
+        font_key – (путь к шрифту, размер), однозначно задающий font.
+        """
+        key = (font_key, tuple(fill), text)
+        with self._lock:
+            entry = self._sprites.get(key)
+            if entry is not None:
+                self._sprites.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+        sprite = render_sprite(font, text, fill)
+        size = sprite[0].width * sprite[0].height * 4 if sprite else 0
+        with self._lock:
+            existing = self._sprites.get(key)
+            if existing is not None:
+                # Другой поток успел нарисовать ту же надпись, пока замок был отпущен
+                self._sprites.move_to_end(key)
+                return existing[0]
+            self._sprites[key] = (sprite, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes and len(self._sprites) > 1:
+                _, (_, old_size) = self._sprites.popitem(last=False)
+                self._bytes -= old_size
+        return sprite
+
+    def clear(self):
+        with self._lock:
+            self._sprites.clear()
+            self._bytes = 0
+
+    def stats(self):
+        return {"items": len(self._sprites), "bytes": self._bytes, "hits": self.hits, "misses": self.misses}
+
+
+def render_sprite(font, text, fill):
+    """Рисует надпись на слое размером с её рамку и обрезает прозрачные поля."""
+    left, top, right, bottom = font.getbbox(text)
+    ox, oy = min(0, left), min(0, top)
+    layer = Image.new("RGBA", (max(1, right - ox + 1), max(1, bottom - oy + 1)), (0, 0, 0, 0))
+    ImageDraw.Draw(layer).text((-ox, -oy), text, font=font, fill=tuple(fill))
+    bbox = layer.getbbox()
+    if bbox is None:
+        return None
+    return layer.crop(bbox), (ox + bbox[0], oy + bbox[1])
+
+
+# Общие для процесса шрифты и кэш надписей для меток координат и названий
+fonts = FontRegistry()
+label_sprites = SpriteCache()
+
+# Попадания в кэши видны в профиле каждой стадии
+profiler.register_counter("font_hits", lambda: fonts.hits)
+profiler.register_counter("sprite_hits", lambda: label_sprites.hits)
+profiler.register_counter("sprite_misses", lambda: label_sprites.misses)
@@ -0,0 +1,207 @@
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+from PIL import Image
+
+TILE_SIZE = 512
+STORE_ROOT = os.path.join("cache", "tiles")
+STORE_VERSION = 1
+
+
+def _file_hash(file_path, chunk_size=1 << 20):
+    """SHA-1 содержимого файла, читается по частям."""
+    h = hashlib.sha1()
+    with open(file_path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _store_key(file_path):
+    """Ключ каталога хранилища: путь, размер и время изменения исходного файла."""
+    st = os.stat(file_path)
+    raw = f"{os.path.abspath(file_path)}|{st.st_size}|{st.st_mtime_ns}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class TileStore:
+    """
+    Тайловое хранилище карты на диске.
+    Исходный PNG один раз раскладывается в пирамиду уровней (уровень n уменьшен в 2**n раз),
+    каждый уровень – raw-файл из тайлов TILE_SIZE x TILE_SIZE RGBA, открываемый через memmap.
+    Чтение области затрагивает только нужные тайлы, поэтому память не зависит от размера карты.
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        self.meta = meta
+        self.tile_size = meta["tile_size"]
+        self.size = tuple(meta["size"])
+        self.info = {"dpi": tuple(meta["dpi"])} if meta.get("dpi") else {}
+        self.map_hash = meta["map_hash"]
+        self.source_path = meta["source_path"]
+        self.levels = []
+        for lvl in meta["levels"]:
+            tiles = np.memmap(
+                os.path.join(store_dir, lvl["file"]), dtype=np.uint8, mode="r",
+                shape=(lvl["rows"], lvl["cols"], self.tile_size, self.tile_size, 4)
+            )
+            self.levels.append((tuple(lvl["size"]), tiles))
+
+    @property
+    def width(self):
+        return self.size[0]
+
+    @property
+    def height(self):
+        return self.size[1]
+
+    @property
+    def level_count(self):
+        return len(self.levels)
+
+    def level_size(self, level):
+        return self.levels[level][0]
+
+    def level_scale(self, level):
+        """Масштаб уровня относительно исходной карты."""
+        return self.levels[level][0][0] / self.size[0]
+
+    def best_level(self, scale):
+        """Самый мелкий уровень, масштаб которого не меньше запрошенного."""
+        best = 0
+        for level in range(self.level_count):
+            if self.level_scale(level) >= scale:
+                best = level
+        return best
+
+    def preview_level(self, max_side):
+        """Первый уровень, у которого большая сторона не превышает max_side."""
+        for level in range(self.level_count):
+            w, h = self.level_size(level)
+            if max(w, h) <= max_side:
+                return level
+        return self.level_count - 1
+
+    def read_region(self, box, level=0):
+        """
+        Возвращает RGBA-изображение области box = (left, top, right, bottom) в пикселях уровня.
+        Читаются только тайлы, пересекающие область; всё, что за границей карты, прозрачно (как у PIL crop).
+        """
+        (lw, lh), tiles = self.levels[level]
+        ts = self.tile_size
+        left, top, right, bottom = (int(round(v)) for v in box)
+        out = np.zeros((max(0, bottom - top), max(0, right - left), 4), dtype=np.uint8)
+        cl, cr = max(0, min(left, lw)), max(0, min(right, lw))
+        ct, cb = max(0, min(top, lh)), max(0, min(bottom, lh))
+        if cr > cl and cb > ct:
+            for ty in range(ct // ts, (cb - 1) // ts + 1):
+                for tx in range(cl // ts, (cr - 1) // ts + 1):
+                    x0, y0 = tx * ts, ty * ts
+                    sx0, sy0 = max(cl, x0), max(ct, y0)
+                    sx1, sy1 = min(cr, x0 + ts), min(cb, y0 + ts)
+                    out[sy0 - top:sy1 - top, sx0 - left:sx1 - left] = \
+                        tiles[ty, tx, sy0 - y0:sy1 - y0, sx0 - x0:sx1 - x0]
+        return Image.fromarray(out, "RGBA")
+
+    def tile_array(self, level, tx, ty):
+        """Тайл уровня как срез memmap (h, w, 4) без копирования; краевые тайлы обрезаны по карте."""
+        (lw, lh), tiles = self.levels[level]
+        ts = self.tile_size
+        return tiles[ty, tx, :min(ts, lh - ty * ts), :min(ts, lw - tx * ts)]
+
+    def crop(self, box):
+        """Совместимость с PIL.Image.crop: вырезка из полного разрешения."""
+        return self.read_region(box, 0)
+
+    def level_image(self, level):
+        """Полное изображение уровня."""
+        w, h = self.level_size(level)
+        return self.read_region((0, 0, w, h), level)
+
+    def to_image(self):
+        """Полное изображение исходного разрешения (материализуется целиком)."""
+        return self.level_image(0)
+
+    @classmethod
+    def open_map(cls, map_path, root=STORE_ROOT, log_func=None):
+        """Открывает хранилище для карты, при необходимости строит его."""
+        store_dir = os.path.join(root, _store_key(map_path))
+        if os.path.exists(os.path.join(store_dir, "meta.json")):
+            try:
+                store = cls(store_dir)
+                if store.meta.get("version") == STORE_VERSION:
+                    if log_func:
+                        log_func(f"Тайловое хранилище открыто: {store_dir}")
+                    return store
+            except Exception as e:
+                if log_func:
+                    log_func(f"Хранилище {store_dir} повреждено, перестраиваю: {e}")
+        return cls.build(map_path, store_dir, log_func)
+
+    @classmethod
+    def build(cls, map_path, store_dir, log_func=None):
+        """Однократно раскладывает исходную карту в пирамиду тайлов."""
+        ts = TILE_SIZE
+        tmp_dir = store_dir + ".tmp"
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.makedirs(tmp_dir)
+        if log_func:
+            log_func(f"Построение тайлового хранилища для {map_path}...")
+
+        Image.MAX_IMAGE_PIXELS = None
+        source = Image.open(map_path)
+        dpi = source.info.get("dpi")
+        if source.mode != "RGBA":
+            source = source.convert("RGBA")
+
+        levels = []
+        level_source = source
+        level = 0
+        while True:
+            w, h = level_source.size
+            cols, rows = -(-w // ts), -(-h // ts)
+            file_name = f"level_{level}.raw"
+            tiles = np.memmap(os.path.join(tmp_dir, file_name), dtype=np.uint8, mode="w+",
+                              shape=(rows, cols, ts, ts, 4))
+            # Раскладываем полосами высотой в один тайл, не копируя весь кадр
+            for ty in range(rows):
+                y0, y1 = ty * ts, min(h, (ty + 1) * ts)
+                strip = np.asarray(level_source.crop((0, y0, w, y1)))
+                for tx in range(cols):
+                    x0, x1 = tx * ts, min(w, (tx + 1) * ts)
+                    tiles[ty, tx, :y1 - y0, :x1 - x0] = strip[:, x0:x1]
+            tiles.flush()
+            levels.append({"file": file_name, "size": [w, h], "rows": rows, "cols": cols})
+            del tiles
+            if max(w, h) <= ts:
+                break
+            level_source = level_source.reduce(2)
+            level += 1
+
+        meta = {
+            "version": STORE_VERSION,
+            "tile_size": ts,
+            "size": list(source.size),
+            "dpi": list(dpi) if dpi else None,
+            "map_hash": _file_hash(map_path),
+            "source_path": os.path.abspath(map_path),
+            "levels": levels,
+        }
+        with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=4)
+        if os.path.exists(store_dir):
+            shutil.rmtree(store_dir)
+        os.replace(tmp_dir, store_dir)
+        if log_func:
+            log_func(f"Тайловое хранилище построено: {store_dir}, уровней: {len(levels)}")
+        return cls(store_dir)
@@ -0,0 +1,245 @@
+import math
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+from PyQt5.QtWidgets import QGraphicsObject, QGraphicsItem, QStyleOptionGraphicsItem
+from PyQt5.QtCore import QObject, QRectF, QRunnable, QThreadPool, pyqtSignal
+from PyQt5.QtGui import QPixmap
+
+from utils import pil_image_to_qimage
+
+TILE_SIZE = 512
+
+# Отдельный пул для построения тайлов, чтобы не занимать глобальный пул Qt
+_tile_pool = QThreadPool()
+_tile_pool.setMaxThreadCount(2)
+
+
+class _TileSignals(QObject):
+    # (ключ тайла, поколение, QImage, прямоугольник в координатах элемента)
+    ready = pyqtSignal(object, int, object, object)
+
+
+class _TileJob(QRunnable):
+    def __init__(self, item_source, key, generation, signals):
+        super().__init__()
+        self.source = item_source
+        self.key = key
+        self.generation = generation
+        self.signals = signals
+
+    def run(self):
+        try:
+            qimage, rect = self.source.build_tile(*self.key)
+        except Exception:
+            qimage, rect = None, None
+        self.signals.ready.emit(self.key, self.generation, qimage, rect)
+
+
+class _TileSource:
+    """
+    Источник тайлов пирамиды: TileStore (готовые уровни на диске) или PIL.Image.
+    Для PIL уровни 0 и 1 вырезаются из исходника, а тайл уровня n >= 2 собирается
+    из четырёх тайлов уровня n-1 и уменьшается вдвое; такие тайлы хранятся в LRU,
+    так что отдалённый вид не перечитывает всю карту.
+    """
+
+    def __init__(self, source, tile_size, max_cache_bytes=128 * 1024 * 1024):
+        self.source = source
+        self.tile_size = tile_size
+        self.width, self.height = source.size
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()  # (level, tx, ty) -> PIL.Image
+        self._cache_bytes = 0
+        self._max_cache_bytes = max_cache_bytes
+        self._cache_lock = threading.Lock()
+        self._version = 0  # растёт при forget: тайлы, начатые до него, в кэш не попадают
+        if hasattr(source, "read_region"):
+            self.level_count = source.level_count
+        else:
+            self.level_count = max(1, math.ceil(math.log2(max(self.width, self.height) / tile_size)) + 1)
+
+    def level_scale(self, level):
+        if hasattr(self.source, "read_region"):
+            return self.source.level_scale(level)
+        return 1 / (2 ** level)
+
+    def level_size(self, level):
+        if hasattr(self.source, "read_region"):
+            return self.source.level_size(level)
+        f = 2 ** level
+        return -(-self.width // f), -(-self.height // f)
+
+    def tile_range(self, level, rect):
+        """Номера тайлов уровня, пересекающих прямоугольник rect в координатах исходника."""
+        ts = self.tile_size
+        s = self.level_scale(level)
+        lw, lh = self.level_size(level)
+        x0 = max(0, int(rect.left() * s) // ts)
+        y0 = max(0, int(rect.top() * s) // ts)
+        x1 = min((lw - 1) // ts, int(math.ceil(rect.right() * s)) // ts)
+        y1 = min((lh - 1) // ts, int(math.ceil(rect.bottom() * s)) // ts)
+        return range(x0, x1 + 1), range(y0, y1 + 1)
+
+    def tile_rect(self, level, tx, ty):
+        ts = self.tile_size
+        s = self.level_scale(level)
+        lw, lh = self.level_size(level)
+        left, top = tx * ts, ty * ts
+        right, bottom = min(lw, left + ts), min(lh, top + ts)
+        return QRectF(left / s, top / s, (right - left) / s, (bottom - top) / s)
+
+    def build_tile(self, level, tx, ty):
+        ts = self.tile_size
+        if hasattr(self.source, "tile_array") and self.source.tile_size == ts:
+            # Тайл хранилища совпадает с тайлом сцены: QImage строится прямо поверх memmap
+            tile = self.source.tile_array(level, tx, ty)
+        elif hasattr(self.source, "read_region"):
+            lw, lh = self.source.level_size(level)
+            box = (tx * ts, ty * ts, min(lw, (tx + 1) * ts), min(lh, (ty + 1) * ts))
+            tile = self.source.read_region(box, level)
+        else:
+            with self._cache_lock:
+                version = self._version
+            tile = self._pil_tile(level, tx, ty, version)
+        return pil_image_to_qimage(tile), self.tile_rect(level, tx, ty)
+
+    def forget(self, rect):
+        """Удаляет из кэша тайлы, пересекающие rect (в координатах исходника), после изменения карты."""
+        with self._cache_lock:
+            self._version += 1
+            for key in [k for k in self._cache if self.tile_rect(*k).intersects(rect)]:
+                tile = self._cache.pop(key)
+                self._cache_bytes -= _tile_bytes(tile)
+
+    def _pil_tile(self, level, tx, ty, version):
+        ts = self.tile_size
+        if level <= 1:
+            f = 2 ** level
+            box = (tx * ts * f, ty * ts * f, min(self.width, (tx + 1) * ts * f), min(self.height, (ty + 1) * ts * f))
+            with self._lock:
+                tile = self.source.crop(box)
+            return tile.reduce(f) if f > 1 else tile
+        key = (level, tx, ty)
+        with self._cache_lock:
+            tile = self._cache.get(key)
+            if tile is not None:
+                self._cache.move_to_end(key)
+                return tile
+        # Четыре тайла уровня ниже (у края карты их может быть меньше) складываются в холст
+        # и уменьшаются вдвое: размер результата совпадает с level_size
+        cw, ch = self.level_size(level - 1)
+        cols = range(2 * tx, min(2 * tx + 2, -(-cw // ts)))
+        rows = range(2 * ty, min(2 * ty + 2, -(-ch // ts)))
+        children = {(cx, cy): self._pil_tile(level - 1, cx, cy, version) for cy in rows for cx in cols}
+        width = sum(children[(cx, rows[0])].width for cx in cols)
+        height = sum(children[(cols[0], cy)].height for cy in rows)
+        canvas = Image.new(children[(cols[0], rows[0])].mode, (width, height))
+        for (cx, cy), child in children.items():
+            canvas.paste(child, ((cx - 2 * tx) * ts, (cy - 2 * ty) * ts))
+        tile = canvas.reduce(2)
+        size = _tile_bytes(tile)
+        with self._cache_lock:
+            if version == self._version and key not in self._cache and size <= self._max_cache_bytes:
+                self._cache[key] = tile
+                self._cache_bytes += size
+                while self._cache_bytes > self._max_cache_bytes:
+                    _, old = self._cache.popitem(last=False)
+                    self._cache_bytes -= _tile_bytes(old)
+        return tile
+
+
+def _tile_bytes(tile):
+    return tile.width * tile.height * len(tile.getbands())
+
+
+class TiledImageItem(QGraphicsObject):
+    """
+    Элемент сцены для очень больших карт: рисует только видимые тайлы уровня пирамиды,
+    соответствующего текущему масштабу. Тайлы строятся в фоновом потоке и хранятся
+    в ограниченном LRU; пока тайл не готов, на его месте рисуется более грубый уровень, если он есть.
+    """
+
+    def __init__(self, source, tile_size=TILE_SIZE, max_tiles=192, parent=None):
+        super().__init__(parent)
+        self._source = _TileSource(source, tile_size)
+        self._tiles = OrderedDict()  # (level, tx, ty) -> (QPixmap, QRectF)
+        self._pending = {}  # ключ тайла -> поколение, с которым он запрошен
+        self._generation = 0  # растёт при invalidate, устаревшие тайлы из потоков отбрасываются
+        self._max_tiles = max_tiles
+        self._signals = _TileSignals()
+        self._signals.ready.connect(self._on_tile_ready)
+        self.setFlag(QGraphicsItem.ItemUsesExtendedStyleOption, True)
+
+    def boundingRect(self):
+        return QRectF(0, 0, self._source.width, self._source.height)
+
+    def level_for_scale(self, scale):
+        """Уровень пирамиды, у которого на экранный пиксель приходится не меньше одного пикселя тайла."""
+        if scale <= 0:
+            return self._source.level_count - 1
+        level = 0
+        for lvl in range(self._source.level_count):
+            if self._source.level_scale(lvl) >= scale:
+                level = lvl
+        return level
+
+    def invalidate(self, rect=None):
+        """Сбрасывает тайлы, пересекающие rect (в координатах элемента), или все; перерисовывает область."""
+        rect = rect or self.boundingRect()
+        self._generation += 1
+        # Забываются только запросы тайлов внутри rect: их результат устарел, а после update(rect)
+        # они будут запрошены заново. Тайлы вне rect, которые ещё строятся, принимаются как обычно
+        for key in [k for k in self._pending if self._source.tile_rect(*k).intersects(rect)]:
+            del self._pending[key]
+        for key in [k for k, (_, r) in self._tiles.items() if r.intersects(rect)]:
+            del self._tiles[key]
+        self._source.forget(rect)
+        self.update(rect)
+
+    def paint(self, painter, option, widget=None):
+        lod = QStyleOptionGraphicsItem.levelOfDetailFromTransform(painter.worldTransform())
+        level = self.level_for_scale(lod)
+        exposed = option.exposedRect.intersected(self.boundingRect())
+        cols, rows = self._source.tile_range(level, exposed)
+        for ty in rows:
+            for tx in cols:
+                key = (level, tx, ty)
+                entry = self._tiles.get(key)
+                if entry is not None:
+                    self._tiles.move_to_end(key)
+                    pixmap, rect = entry
+                    painter.drawPixmap(rect, pixmap, QRectF(pixmap.rect()))
+                    continue
+                self._request(key)
+                self._paint_fallback(painter, level, self._source.tile_rect(level, tx, ty))
+
+    def _paint_fallback(self, painter, level, rect):
+        for coarse in range(level + 1, self._source.level_count):
+            cols, rows = self._source.tile_range(coarse, rect)
+            entries = [self._tiles.get((coarse, tx, ty)) for ty in rows for tx in cols]
+            if entries and all(entries):
+                painter.save()
+                painter.setClipRect(rect)
+                for pixmap, tile_rect in entries:
+                    painter.drawPixmap(tile_rect, pixmap, QRectF(pixmap.rect()))
+                painter.restore()
+                return
+
+    def _request(self, key):
+        if key in self._pending:
+            return
+        self._pending[key] = self._generation
+        _tile_pool.start(_TileJob(self._source, key, self._generation, self._signals))
+
+    def _on_tile_ready(self, key, generation, qimage, rect):
+        if self._pending.get(key) != generation:
+            return
+        del self._pending[key]
+        if qimage is None:
+            return
+        self._tiles[key] = (QPixmap.fromImage(qimage), rect)
+        while len(self._tiles) > self._max_tiles:
+            self._tiles.popitem(last=False)
+        self.update(rect)
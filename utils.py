@@ -1,13 +1,70 @@
 from PIL import Image
 from PyQt5.QtGui import QPixmap, QImage
+import numpy as np
 import os
+from PyQt5 import sip
+
+# Сколько байт пикселей скопировано при переводе изображений в Qt (для бенчмарков)
+bridge_stats = {"conversions": 0, "bytes_copied": 0}
+
+
+def reset_bridge_stats():
+    bridge_stats["conversions"] = 0
+    bridge_stats["bytes_copied"] = 0
+
+
+def _count_copy(nbytes):
+    bridge_stats["bytes_copied"] += nbytes
+
+
+def _rgba_array(image, box=None):
+    """
+    RGBA-пиксели изображения (или области box = (left, top, right, bottom)) как массив (h, w, 4).
+    Массив numpy и область внутри него отдаются срезом без копирования;
+    у PIL.Image копируется только нужная область, и только один раз.
+    """
+    if isinstance(image, np.ndarray):
+        arr = image
+        if box is not None:
+            left, top, right, bottom = box
+            arr = arr[top:bottom, left:right]
+        if arr.dtype != np.uint8 or arr.ndim != 3 or arr.shape[2] != 4 or arr.strides[1:] != (4, 1):
+            arr = np.ascontiguousarray(arr, dtype=np.uint8)
+            _count_copy(arr.nbytes)
+        return arr
+    if box is not None:
+        image = image.crop(box)
+        _count_copy(image.width * image.height * 4)
+    if image.mode != "RGBA":
+        image = image.convert("RGBA")
+        _count_copy(image.width * image.height * 4)
+    arr = np.asarray(image)
+    _count_copy(arr.nbytes)
+    return arr
+
+
+def pil_image_to_qimage(image, box=None):
+    """
+    QImage поверх RGBA-буфера без дополнительной копии в Qt.
+    image – PIL.Image или массив numpy (h, w, 4) uint8, box – необязательная область.
+    Буфер хранится в атрибуте QImage, поэтому живёт столько же, сколько сам объект;
+    QImage можно создавать вне GUI-потока; изменять его нельзя – буфер может быть только для чтения.
+    """
+    arr = _rgba_array(image, box)
+    h, w = arr.shape[:2]
+    if h == 0 or w == 0:
+        return QImage()
+    # Для среза строки идут с шагом исходного массива, пиксели внутри строки – подряд
+    qimage = QImage(sip.voidptr(arr.ctypes.data), w, h, arr.strides[0], QImage.Format_RGBA8888)
+    qimage._buffer = arr
+    bridge_stats["conversions"] += 1
+    return qimage
+
+
+def pil_image_to_qpixmap(image, box=None):
+    """QPixmap из PIL.Image или массива numpy (см. pil_image_to_qimage); box – область для частичного обновления."""
+    return QPixmap.fromImage(pil_image_to_qimage(image, box))
 
-def pil_image_to_qpixmap(pil_image):
-    pil_image = pil_image.convert("RGBA")
-    data = pil_image.tobytes("raw", "RGBA")
-    qimage = QImage(data, pil_image.width, pil_image.height, QImage.Format_RGBA8888)
-    return QPixmap.fromImage(qimage)
-    
 def find_font_path(font_family, bold=False, italic=False, default_path="C:/Windows/Fonts/arial.ttf"):
     """Поиск пути к файлу шрифта по имени семейства и стилю на Windows."""
     font_dir = "C:/Windows/Fonts/"
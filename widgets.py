@@ -1,17 +1,25 @@
 from PyQt5.QtWidgets import (
     QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QLabel, QTabWidget, QFileDialog,
     QTextEdit, QFormLayout, QSpinBox, QLineEdit, QGraphicsScene, QGraphicsView,
-    QComboBox, QColorDialog, QGroupBox, QGridLayout, QFontDialog, QGraphicsTextItem, QGraphicsItemGroup, QGraphicsRectItem
+    QComboBox, QColorDialog, QGroupBox, QGridLayout, QFontDialog, QGraphicsTextItem, QGraphicsItemGroup,
+    QCheckBox, QTableWidget, QTableWidgetItem, QHeaderView
 )
 from PyQt5.QtGui import QPixmap, QImage, QColor, QFont
-from PyQt5.QtCore import Qt, pyqtSignal, QEvent
-from PIL import Image
+from PyQt5.QtCore import Qt, pyqtSignal, QEvent, QTimer
 import json
 import os
 from utils import pil_image_to_qpixmap, find_font_path
-from map_processing import resize_image, draw_grid, draw_grid_region, extract_region, draw_names
 from db_handler import parse_names_file
 from name_editor import NameEditor
+from tile_store import TileStore
+from region_cache import RegionCache, region_key, render_region_cached
+from prefetch import RegionPrefetcher
+from render_pipeline import RenderPipeline
+from tiled_view import TiledImageItem
+from render_worker import RenderWorker
+from log_sink import debug_logger, DEBUG, INFO, WARNING, ERROR
+import profiler
+from export import FORMATS, export_image, format_for_path
 
 class CoordinateLabelSettingsWidget(QWidget):
     def __init__(self, default_font_size=20, default_color=(0, 0, 0, 255), default_font="Arial", parent=None):
@@ -137,6 +145,7 @@ class NameSettingsWidget(QWidget):
 
 class ZoomableGraphicsView(QGraphicsView):
     item_moved = pyqtSignal(object)
+    view_changed = pyqtSignal()  # Сдвиг, масштаб или размер окна: видимая область сцены изменилась
 
     def __init__(self, scene, parent=None):
         super().__init__(scene, parent)
@@ -162,23 +171,24 @@ class ZoomableGraphicsView(QGraphicsView):
             self._zoom = -10
             return
         self.scale(factor, factor)
+        self.view_changed.emit()
 
+    def scrollContentsBy(self, dx, dy):
+        super().scrollContentsBy(dx, dy)
+        self.view_changed.emit()
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.view_changed.emit()
 
     def mousePressEvent(self, event):
         parent_widget = self.parent()  # Получаем родительский объект (MapTab)
         if hasattr(parent_widget, 'name_editor') and parent_widget.name_editor and parent_widget.name_editor.is_editing:
             scene_pos = self.mapToScene(event.pos())
-            # Логируем все объекты под курсором
-            items_at_pos = self.scene().items(scene_pos)
-            if parent_widget.parent.log_text_edit:  # Обращаемся к логгеру через родителя MapTab (MainWindow)
-                types_list = [type(item).__name__ for item in items_at_pos]
-                parent_widget.parent.log_text_edit.append(f"Items at {scene_pos}: {types_list}")
-            item = self.scene().itemAt(scene_pos, self.transform())
-            # Если возвращается QGraphicsRectItem, а у него есть родительский QGraphicsTextItem, используем родителя
-            if item and isinstance(item, QGraphicsRectItem) and item.parentItem() and isinstance(item.parentItem(), QGraphicsTextItem):
-                if parent_widget.parent.log_text_edit:
-                    parent_widget.parent.log_text_edit.append(f"Item is QGraphicsRectItem, switching to parent QGraphicsTextItem with id={item.parentItem().rec_id}")
-                item = item.parentItem()
+            # Отладочный лог через родителя MapTab (MainWindow); при выключенной отладке сообщения не строятся
+            debug = debug_logger(parent_widget.parent.log_text_edit.append)
+            # Поиск надписи через пространственный индекс редактора, без перебора элементов сцены
+            item = parent_widget.name_editor.item_at(scene_pos)
             if item and isinstance(item, QGraphicsTextItem):
                 if parent_widget.name_editor.selected_item != item:
                     parent_widget.on_item_selected(item)
@@ -186,11 +196,11 @@ class ZoomableGraphicsView(QGraphicsView):
                 # Сохраняем смещение от точки клика до позиции элемента
                 self._drag_offset = scene_pos - item.pos()
                 self.setDragMode(QGraphicsView.NoDrag)
-                if parent_widget.parent.log_text_edit:
-                    parent_widget.parent.log_text_edit.append(f"Mouse pressed: pos={event.pos()}, scene_pos={scene_pos}, item id={item.rec_id}")
+                if debug:
+                    debug(f"Mouse pressed: pos={event.pos()}, scene_pos={scene_pos}, item id={item.rec_id}")
             else:
-                if parent_widget.parent.log_text_edit:
-                    parent_widget.parent.log_text_edit.append(f"Mouse pressed: pos={event.pos()}, scene_pos={scene_pos}, no valid QGraphicsTextItem, raw item: {item}")
+                if debug:
+                    debug(f"Mouse pressed: pos={event.pos()}, scene_pos={scene_pos}, надпись не найдена")
         super().mousePressEvent(event)
 
     def mouseMoveEvent(self, event):
@@ -201,8 +211,9 @@ class ZoomableGraphicsView(QGraphicsView):
                 new_pos = new_scene_pos - self._drag_offset
                 item.setPos(new_pos)
                 self.parent().name_editor.item_moved(item)
-                if self.parent().parent.log_text_edit:
-                    self.parent().parent.log_text_edit.append(f"Mouse moved: new_pos={new_pos}")
+                debug = debug_logger(self.parent().parent.log_text_edit.append)
+                if debug:
+                    debug(f"Mouse moved: new_pos={new_pos}")
         super().mouseMoveEvent(event)
 
     def mouseReleaseEvent(self, event):
@@ -210,8 +221,9 @@ class ZoomableGraphicsView(QGraphicsView):
             item = self.parent().name_editor.selected_item
             if item:
                 self.item_moved.emit(item)
-                if self.parent().parent.log_text_edit:
-                    self.parent().parent.log_text_edit.append(f"Mouse released: item id={item.rec_id}, pos={item.pos()}")
+                debug = debug_logger(self.parent().parent.log_text_edit.append)
+                if debug:
+                    debug(f"Mouse released: item id={item.rec_id}, pos={item.pos()}")
             self._dragging = False
             self._drag_offset = None
             self.setDragMode(QGraphicsView.ScrollHandDrag)
@@ -410,10 +422,10 @@ class MapSettingsTab(QWidget):
             label_font.setText(font.family())
 
     def apply_input_resolution(self):
-        if self.parent.map_tab.input_map is None:
+        if self.parent.map_tab.map_store is None:
             self.parent.log_text_edit.append("Карта не загружена!")
             return
-        w, h = self.parent.map_tab.input_map.size
+        w, h = self.parent.map_tab.map_store.size
         self.output_width.setMaximum(w)
         self.output_height.setMaximum(h)
         self.output_width.setValue(w)
@@ -533,13 +545,21 @@ class MapTab(QWidget):
         self.parent = parent
         self.map_settings_tab = map_settings_tab
 
-        self.input_map = None
+        self.map_store = None  # Тайловое хранилище исходной карты
         self.processed_map = None  # Карта с сеткой и надписями
         self.image_with_grid = None  # Карта только с сеткой
         self.region_windows = []
         self.last_map = None
         self._updating_combo = False
         self.name_editor = None
+        self.map_item = None
+        self.region_cache = RegionCache()
+        self.render_pipeline = RenderPipeline(os.path.join("db", "name.db"))
+        # Отрисовка идёт в фоне, GUI только подставляет готовый результат
+        self.render_worker = RenderWorker(self.parent.log_text_edit.append, parent=self)
+        # После каждого участка в фоне рисуются соседние: следующий шаг по карте берётся из кэша
+        self.prefetcher = RegionPrefetcher(self.region_cache, os.path.join("db", "name.db"),
+                                           log_func=self.parent.log_text_edit.append)
 
         layout = QVBoxLayout()
 
@@ -564,9 +584,16 @@ class MapTab(QWidget):
         btn_save.clicked.connect(self.save_names)
         layout.addWidget(btn_save)
 
+        save_layout = QHBoxLayout()
         btn_save_map = QPushButton("Сохранить карту")
         btn_save_map.clicked.connect(self.save_map)
-        layout.addWidget(btn_save_map)
+        save_layout.addWidget(btn_save_map)
+        save_layout.addWidget(QLabel("Сжатие (0-9):"))
+        self.export_level = QSpinBox()
+        self.export_level.setRange(0, 9)
+        self.export_level.setValue(1)  # Быстрое сжатие: сохранение упирается в диск, а не в процессор
+        save_layout.addWidget(self.export_level)
+        layout.addLayout(save_layout)
 
         self.scene = self.parent.scene
         self.view = ZoomableGraphicsView(self.scene, self)
@@ -582,9 +609,9 @@ class MapTab(QWidget):
         if not self.name_editor:
             params = self.map_settings_tab.get_parameters()
             self.name_editor = NameEditor(
-                self, self.image_with_grid, self.input_map, os.path.join("db", "name.db"), 
+                self, self.image_with_grid, self.map_store, os.path.join("db", "name.db"), 
                 params["name_settings"], params["origin"], 
-                params["output_resolution"][0] / self.input_map.size[0],
+                params["output_resolution"][0] / self.map_store.size[0],
                 self.processed_map.size[0], self.processed_map.size[1],
                 params, self.parent.log_text_edit.append
             )
@@ -635,10 +662,15 @@ class MapTab(QWidget):
 
     def load_map(self, file_path):
         if file_path and os.path.exists(file_path):
-            Image.MAX_IMAGE_PIXELS = None
-            self.input_map = Image.open(file_path).convert("RGBA")
+            # Результаты, начатые для прежней карты, больше не нужны
+            self.render_worker.cancel("grid")
+            self.render_worker.cancel("region")
+            self.prefetcher.cancel()
+            self.map_store = TileStore.open_map(file_path, log_func=self.parent.log_text_edit.append)
+            self.render_pipeline.clear()
             self.parent.log_text_edit.append(f"Карта загружена: {file_path}")
-            self.update_view(self.input_map)
+            # Просмотрщик читает из пирамиды хранилища только видимые тайлы
+            self.update_view(self.map_store)
             self.last_map = file_path
             self.update_map_list()  # Обновляем список после загрузки
 
@@ -652,74 +684,44 @@ class MapTab(QWidget):
             self.load_map(map_path)
 
     def apply_grid(self):
-        if self.input_map is None:
+        if self.map_store is None:
             self.parent.log_text_edit.append("Сначала загрузите карту!")
             return
 
         params = self.map_settings_tab.get_parameters()
-        output_resolution = params["output_resolution"]
-        scale_factor = output_resolution[0] / self.input_map.size[0]
-        resized = resize_image(self.input_map, output_resolution)
-        pixels_per_100m_output = params["pixels_per_100m"] * scale_factor
-
-        # Сохраняем карту с сеткой без надписей
-        self.image_with_grid = draw_grid(
-            resized.copy(), 
-            pixels_per_100m_output, 
-            params["grid_thickness_100"],
-            params["grid_thickness_1km"], 
-            params["color_100"], 
-            params["color_1km"],
-            params.get("label_mode_h", "0"), 
-            params.get("label_mode_v", "0"), 
-            params["font_size"],
-            params["font_path"], 
-            params["font_color"], 
-            params["margin"], 
-            params["origin"],
-            log_func=self.parent.log_text_edit.append
-        )
-        
-        # Полная карта с надписями
-        self.processed_map = draw_names(
-            self.image_with_grid.copy(),
-            os.path.join("db", "name.db"),
-            params["name_settings"],
-            params["origin"],
-            scale=scale_factor,
-            global_width=self.image_with_grid.size[0],
-            global_height=self.image_with_grid.size[1],
-            log_func=self.parent.log_text_edit.append
+        map_store = self.map_store
+        pipeline = self.render_pipeline
+        # Соседние участки, заказанные под прежние настройки, могли устареть
+        self.prefetcher.cancel()
+
+        def job(progress, log_func):
+            # Импорт названий до отрисовки; без изменений в name.txt он ничего не делает
+            db_path = os.path.join("db", "name.db")
+            name_file = "name.txt"
+            if os.path.exists(name_file):
+                parse_names_file(name_file, db_path, log_func)
+            # Карта с сеткой без надписей и полная карта с надписями;
+            # конвейер пересчитывает только стадии, чьи параметры изменились
+            return pipeline.render(map_store, params, log_func=log_func, progress=progress)
+
+        self.parent.log_text_edit.append("Отрисовка карты запущена в фоне")
+        self.render_worker.submit(
+            "grid", job,
+            lambda result: self.on_grid_ready(params, result),
+            on_progress=lambda stage: self.parent.log_text_edit.append(f"Отрисовка карты: стадия {stage}")
         )
-        self.update_view(self.processed_map)
 
-        db_path = os.path.join("db", "name.db")
-        name_file = "name.txt"
-        if os.path.exists(name_file):
-            parse_names_file(name_file, db_path, self.parent.log_text_edit.append)
-        
-        name_settings = params.get("name_settings", {
-            "NameCityCapital": {"font_size": 16, "font_color": (255, 0, 0, 255)},
-            "NameCity": {"font_size": 14, "font_color": (0, 0, 255, 255)},
-            "NameVillage": {"font_size": 12, "font_color": (0, 128, 0, 255)},
-            "Hill": {"font_size": 10, "font_color": (128, 128, 128, 255)},
-            "NameLocal": {"font_size": 10, "font_color": (128, 0, 128, 255)},
-            "NameMarine": {"font_size": 10, "font_color": (0, 128, 128, 255)}
-        })
-        global_size = self.processed_map.size
-        self.processed_map = draw_names(
-            self.processed_map,
-            db_path,
-            name_settings,
-            params["origin"],
-            scale=scale_factor,
-            crop_offset=None,  # Для полной карты нет смещения
-            global_width=global_size[0],
-            global_height=global_size[1],
-            log_func=self.parent.log_text_edit.append
-        )
+    def on_grid_ready(self, params, result):
+        self.image_with_grid, self.processed_map = result
         self.update_view(self.processed_map)
+        # Редактор помнит фон, настройки и рамки надписей прежней карты: следующий сеанс
+        # редактирования создаёт его заново
+        if self.name_editor is not None and not self.name_editor.is_editing:
+            self.name_editor = None
 
+        output_resolution = params["output_resolution"]
+        scale_factor = output_resolution[0] / self.map_store.size[0]
+        pixels_per_100m_output = params["pixels_per_100m"] * scale_factor
         full_cols = int(self.processed_map.size[0] // pixels_per_100m_output)
         full_rows = int(self.processed_map.size[1] // pixels_per_100m_output)
         self.map_settings_tab.center_col.setRange(0, full_cols - 1)
@@ -734,90 +736,87 @@ class MapTab(QWidget):
         params = self.map_settings_tab.get_parameters()
         center_cell = (params["center_col"], params["center_row"])
         n_cells = params["n_cells"]
-        scale_factor = params["output_resolution"][0] / self.input_map.size[0]
-        pixels_per_100m_output = params["pixels_per_100m"] * scale_factor
+        map_store = self.map_store
+        region_cache = self.region_cache
+        prefetcher = self.prefetcher
+
+        def job(progress, log_func):
+            progress("region")
+            # Участок мог уже рисоваться упреждающе – тогда дожидаемся его и берём из кэша
+            prefetcher.wait(region_key(map_store.map_hash, params, center_cell, n_cells))
+            # Читаем из тайлового хранилища только пиксели участка, без копии всей карты;
+            # уже отрисованные участки берём из кэша
+            region_with_names, _ = render_region_cached(
+                region_cache,
+                map_store,
+                map_store.map_hash,
+                params,
+                os.path.join("db", "name.db"),
+                center_cell,
+                n_cells,
+                log_func=log_func
+            )
+            return region_with_names
 
-        # ... (логирование параметров остаётся без изменений) ...
+        def done(region_with_names):
+            self.parent.log_text_edit.append(
+                f"Участок извлечён и отрисован: центр ({center_cell[0]}, {center_cell[1]}), "
+                f"размер {n_cells} ячеек в сторону"
+            )
+            self.show_extracted_region(region_with_names, center_cell)
+            queued = prefetcher.schedule(map_store, map_store.map_hash, params, center_cell, n_cells)
+            debug = debug_logger(self.parent.log_text_edit.append)
+            if debug:
+                debug(f"Упреждающая отрисовка соседних участков: {queued}")
 
-        region, start_col, start_row, total_cols, total_rows, crop_box = extract_region(
-            self.input_map.copy(),
-            center_cell,
-            n_cells,
-            pixels_per_100m_output,
-            params["origin"],
-            self.parent.log_text_edit.append
-        )
-        # ... (логирование вырезки остаётся без изменений) ...
-
-        offset_x = start_col
-        offset_y = start_row
-        self.parent.log_text_edit.append(f"Смещения: offset_x={offset_x}, offset_y={offset_y}")
-
-        region_with_grid = draw_grid_region(
-            region.copy(),
-            pixels_per_100m_output,
-            params["grid_thickness_100"],
-            params["grid_thickness_1km"],
-            params["color_100"],
-            params["color_1km"],
-            params.get("label_mode_h", "0"),
-            params.get("label_mode_v", "0"),
-            params["font_size"],
-            params["font_path"],
-            params["font_color"],
-            params["margin"],
-            params["origin"],
-            offset_x=offset_x,
-            offset_y=offset_y,
-            log_func=self.parent.log_text_edit.append
-        )
-
-        crop_offset = (crop_box[0], crop_box[1])
-        self.parent.log_text_edit.append(f"Crop offset: {crop_offset}")
-        self.parent.log_text_edit.append(f"Перед вызовом draw_names: scale_factor={scale_factor}, origin={params['origin']}, "
-                                        f"изображение вырезанного участка size={region_with_grid.size}")
-
-        db_path = os.path.join("db", "name.db")
-        name_settings = params.get("name_settings", {
-            "NameCityCapital": {"font_size": 16, "font_color": (255, 0, 0, 255)},
-            "NameCity": {"font_size": 14, "font_color": (0, 0, 255, 255)},
-            "NameVillage": {"font_size": 12, "font_color": (0, 128, 0, 255)},
-            "Hill": {"font_size": 10, "font_color": (128, 128, 128, 255)},
-            "NameLocal": {"font_size": 10, "font_color": (128, 0, 128, 255)},
-            "NameMarine": {"font_size": 10, "font_color": (0, 128, 128, 255)}
-        })
-        region_with_names = draw_names(
-            region_with_grid,
-            db_path,
-            name_settings,
-            params["origin"],
-            scale=scale_factor,
-            crop_offset=crop_offset,  # Учитываем смещение для участка
-            global_width=self.processed_map.size[0],
-            global_height=self.processed_map.size[1],
-            log_func=self.parent.log_text_edit.append
-        )
-        
-        self.parent.log_text_edit.append(
-            f"Участок извлечён и отрисован: центр ({center_cell[0]}, {center_cell[1]}), "
-            f"размер {n_cells} ячеек в сторону"
-        )
-        self.show_extracted_region(region_with_names, center_cell)
+        self.render_worker.submit("region", job, done)
 
     def save_map(self):
         if self.processed_map is None:
             self.parent.log_text_edit.append("Нет обработанной карты для сохранения!")
             return
 
-        file_path, _ = QFileDialog.getSaveFileName(self, "Сохранить карту", "", "PNG Files (*.png)")
-        if file_path:
-            self.processed_map.save(file_path, format="PNG", dpi=self.input_map.info.get("dpi", (72, 72)))
-            self.parent.log_text_edit.append(f"Карта сохранена: {file_path}")
+        self.save_image(self.processed_map, "Сохранить карту", "Карта сохранена")
+
+    def save_image(self, image, title, done_message):
+        """Диалог выбора файла и формата; кодирование идёт в фоне полосами (PNG) или целиком (WebP, JPEG)."""
+        filters = [f"{desc} (*.{ext})" for ext, desc in FORMATS.items()]
+        file_path, selected = QFileDialog.getSaveFileName(self, title, "", ";;".join(filters))
+        if not file_path:
+            return
+        fmt = list(FORMATS)[filters.index(selected)] if selected in filters else format_for_path(file_path)
+        if format_for_path(file_path, default=None) is None:
+            file_path += f".{fmt}"
+        level = self.export_level.value()
+        dpi = self.map_store.info.get("dpi", (72, 72))
+        log = self.parent.log_text_edit.append
+
+        def job(progress, log_func):
+            reported = [0]
+
+            def on_progress(fraction):
+                # В лог – не чаще, чем каждые 10%
+                step = int(fraction * 10)
+                if step > reported[0]:
+                    reported[0] = step
+                    progress(f"{step * 10}%")
+
+            return export_image(image, file_path, fmt, level=level, dpi=dpi, progress=on_progress,
+                                log_func=log_func)
+
+        log(f"Сохранение в фоне: {file_path}")
+        self.render_worker.submit(
+            f"export:{file_path}", job,
+            lambda path: log(f"{done_message}: {path}"),
+            on_progress=lambda stage: log(f"Сохранение {os.path.basename(file_path)}: {stage}")
+        )
 
-    def update_view(self, pil_image):
+    def update_view(self, source):
+        """Показывает карту (PIL.Image или TileStore) тайлами с уровнем детализации по масштабу."""
         self.scene.clear()
-        pixmap = pil_image_to_qpixmap(pil_image)
-        self.scene.addPixmap(pixmap)
+        self.map_item = TiledImageItem(source)
+        self.scene.addItem(self.map_item)
+        self.scene.setSceneRect(self.map_item.boundingRect())
 
     def show_extracted_region(self, region_image, center_cell):
         window = QWidget()
@@ -843,19 +842,109 @@ class MapTab(QWidget):
         self.region_windows = [w for w in self.region_windows if w.isVisible()]
 
     def save_region(self, region_image):
-        file_path, _ = QFileDialog.getSaveFileName(self, "Сохранить участок", "", "PNG Files (*.png)")
-        if file_path:
-            region_image.save(file_path, format="PNG", dpi=self.input_map.info.get("dpi", (72, 72)))
-            self.parent.log_text_edit.append(f"Участок сохранен: {file_path}")
+        self.save_image(region_image, "Сохранить участок", "Участок сохранен")
 
 class LogTab(QWidget):
+    LEVELS = [("Отладка", DEBUG), ("Информация", INFO), ("Предупреждения", WARNING), ("Ошибки", ERROR)]
+
     def __init__(self, parent):
         super().__init__(parent)
+        self.log_sink = None
         layout = QVBoxLayout()
+
+        level_layout = QHBoxLayout()
+        level_layout.addWidget(QLabel("Уровень:"))
+        self.level_combo = QComboBox()
+        for title, level in self.LEVELS:
+            self.level_combo.addItem(title, level)
+        self.level_combo.setCurrentIndex(1)
+        self.level_combo.currentIndexChanged.connect(self.on_level_changed)
+        level_layout.addWidget(self.level_combo)
+        level_layout.addStretch()
+        layout.addLayout(level_layout)
+
         self.text_edit = QTextEdit()
         self.text_edit.setReadOnly(True)
         layout.addWidget(self.text_edit)
         self.setLayout(layout)
-    
+
+    def set_sink(self, log_sink):
+        self.log_sink = log_sink
+        self.level_combo.setCurrentIndex([level for _, level in self.LEVELS].index(log_sink.level))
+
+    def on_level_changed(self, index):
+        if self.log_sink is not None:
+            self.log_sink.set_level(self.level_combo.itemData(index))
+
     def append(self, text):
-        self.text_edit.append(text)
\ No newline at end of file
+        if self.log_sink is not None:
+            self.log_sink.append(text)
+        else:
+            self.text_edit.append(text)
+
+class ProfileTab(QWidget):
+    # «Всего» включает вложенные стадии (render_region -> draw_grid_region, draw_names), «Собственное» – нет
+    COLUMNS = [("Стадия", None), ("Вызовов", "calls"), ("Вложенных", "nested"), ("Всего, мс", "total"),
+               ("Собственное, мс", "self"), ("Среднее, мс", "mean"), ("Макс, мс", "max"), ("Мпикс", "pixels"), ("МБ", "bytes"), ("Шрифты (попад.)", "font_hits"),
+               ("Надписи (попад.)", "sprite_hits"), ("Надписи (промахи)", "sprite_misses")]
+
+    def __init__(self, parent):
+        super().__init__(parent)
+        self.parent = parent
+        layout = QVBoxLayout()
+
+        controls = QHBoxLayout()
+        self.enable_check = QCheckBox("Профилирование")
+        self.enable_check.setChecked(profiler.is_enabled())
+        self.enable_check.toggled.connect(profiler.enable)
+        controls.addWidget(self.enable_check)
+        btn_clear = QPushButton("Сбросить")
+        btn_clear.clicked.connect(self.clear)
+        controls.addWidget(btn_clear)
+        btn_export = QPushButton("Экспорт Chrome trace")
+        btn_export.clicked.connect(self.export_trace)
+        controls.addWidget(btn_export)
+        controls.addStretch()
+        layout.addLayout(controls)
+
+        self.table = QTableWidget(0, len(self.COLUMNS))
+        self.table.setHorizontalHeaderLabels([title for title, _ in self.COLUMNS])
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+        self.table.setEditTriggers(QTableWidget.NoEditTriggers)
+        layout.addWidget(self.table)
+        self.setLayout(layout)
+
+        # Таблица обновляется, только пока вкладка видна и профилирование включено
+        self.timer = QTimer(self)
+        self.timer.setInterval(1000)
+        self.timer.timeout.connect(self.refresh)
+        self.timer.start()
+
+    def refresh(self):
+        if not self.isVisible() or not profiler.is_enabled():
+            return
+        rows = sorted(profiler.summary().items(), key=lambda item: -item[1]["self"])
+        self.table.setRowCount(len(rows))
+        for r, (stage, row) in enumerate(rows):
+            for c, (_, key) in enumerate(self.COLUMNS):
+                if key is None:
+                    text = stage
+                elif key in ("total", "self", "mean", "max"):
+                    text = f"{row[key] * 1000:.1f}"
+                elif key == "pixels":
+                    text = f"{row[key] / 1e6:.2f}"
+                elif key == "bytes":
+                    text = f"{row[key] / (1024 * 1024):.1f}"
+                else:
+                    text = str(row.get(key, 0))
+                self.table.setItem(r, c, QTableWidgetItem(text))
+
+    def clear(self):
+        profiler.clear()
+        self.table.setRowCount(0)
+
+    def export_trace(self):
+        file_path, _ = QFileDialog.getSaveFileName(self, "Экспорт профиля", "profile.json", "JSON Files (*.json)")
+        if file_path:
+            count = profiler.export_chrome_trace(file_path)
+            self.parent.log_text_edit.append(f"Профиль сохранён: {file_path}, событий: {count}")